@@ -0,0 +1,5 @@
+import sys
+
+from benchmarks import bench
+
+sys.exit(bench.main())
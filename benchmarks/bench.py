@@ -0,0 +1,316 @@
+# Benchmarks for the hot paths: sample conversion, the wavesample layout,
+# image building, extraction, verification, HFE encoding, catalog queries
+# and similarity search. Everything runs on seeded synthetic data (a random
+# template and random sample sources, see utility.create_dummy_data), so runs
+# are reproducible and need no real library. Each benchmark runs at several
+# library sizes (number of images worth of data) and reports the best of
+# several timings as MB/s and images/s.
+#
+# Results can be saved as a baseline and later runs compared against it; a
+# benchmark slower than the baseline by more than the tolerance is a
+# regression and makes the run fail. Baselines are machine specific, so keep
+# your own rather than committing one.
+#
+# usage: python -m benchmarks [--sizes 1,8,32] [--repeat 5] [--only NAME,...]
+#        [--save-baseline JSON] [--baseline JSON] [--tolerance 0.25]
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from diskimages import batch
+from diskimages import catalog
+from diskimages import hfe
+from diskimages import layout
+from diskimages import similarity
+from diskimages import utility
+from diskimages import verify
+from diskimages.diskmanager import MirageDiskManager
+from tests.waves import make_wave
+
+SIZES = (1, 8, 32)
+REPEAT = 5
+TOLERANCE = 0.25
+SEED = 1987
+
+# bytes of wavesample data in one image
+IMAGE_DATA = layout.WAVESAMPLE_COUNT * layout.WAVESAMPLE_SIZE
+
+Result = namedtuple('Result', ['name', 'size', 'seconds', 'mb_per_s', 'images_per_s'])
+
+CONFIG = """[LOGS]
+LEVEL = WARNING
+LOGFILE = benchmark.log
+
+[FILES]
+HOME = {home}
+OUTPUT_DISK_IMAGE_FOLDER = mirage_ready
+OUTPUT_HFE_FOLDER = hfe
+INTERMEDIATE_WAV_FOLDER = intermediate_wav
+WAVETABLES = wavetables
+FAIRLIGHT = fairlight
+KAWAIK3 = k3
+MIRAGE_SOUNDS = mirage_sounds
+"""
+
+
+# Synthetic workspace: a config and template in a temporary folder, a
+# MirageDiskManager using them, and helpers to fill it with seeded data.
+
+
+class Workspace:
+
+    def __init__(self, folder):
+        self.folder = folder
+        config_file = os.path.join(folder, 'config.ini')
+        with open(config_file, 'w') as config:
+            config.write(CONFIG.format(home=folder))
+        self.manager = MirageDiskManager(config_file)
+        template = os.path.join(folder, 'template.img')
+        with open(template, 'wb') as output:
+            output.write(utility.create_dummy_image(SEED))
+        # an absolute template path replaces the default one
+        self.manager.fairlight_template = template
+
+    def path(self, *names):
+        return os.path.join(self.manager.app_root, *names)
+
+    def sources(self, size):
+        names = []
+        for index in range(size):
+            name = f'source{index}.wav'
+            with open(self.path(self.manager.intermediate_wav, name), 'wb') as output:
+                output.write(utility.create_dummy_data(SEED + index, IMAGE_DATA))
+            names.append(name)
+        return names
+
+    def images(self, size):
+        folder = self.path(self.manager.mirage_ready, f'library{size}')
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for index in range(size):
+            path = os.path.join(folder, f'image{index}.img')
+            if not os.path.exists(path):
+                with open(path, 'wb') as output:
+                    output.write(utility.create_dummy_image(SEED + index))
+            paths.append(path)
+        return paths
+
+
+# Each benchmark takes a Workspace and a library size, does its setup and
+# returns (function to time, bytes processed per call, images per call).
+
+
+def bench_convert_float(workspace, size):
+    values = np.random.default_rng(SEED).uniform(-1, 1, size * IMAGE_DATA).astype('<f4').tobytes()
+    return lambda: utility.convert_32bf_to_8bit(values), len(values), size
+
+
+def bench_convert_16bit(workspace, size):
+    pcm = np.random.default_rng(SEED).integers(-32768, 32768, size * IMAGE_DATA, dtype='<i2').tobytes()
+    wave = make_wave(pcm, rate=29411)
+    return lambda: utility.convert_16_to_8bit(wave), len(pcm), size
+
+
+def bench_collapse(workspace, size):
+    images = [utility.create_dummy_image(SEED + index) for index in range(size)]
+    starts = [track * layout.TRACK_LENGTH for track in layout.WAVESAMPLE_TRACKS]
+
+    def collapse():
+        for image in images:
+            view = memoryview(image)
+            for start in starts:
+                utility.collapse_wave_data(view[start:start + layout.WAVESAMPLE_SPAN])
+
+    return collapse, size * IMAGE_DATA, size
+
+
+def bench_pack(workspace, size):
+    image = utility.create_dummy_image(SEED)
+    wavesamples = [utility.create_dummy_data(SEED + index, IMAGE_DATA) for index in range(size)]
+
+    def pack():
+        for data in wavesamples:
+            layout.pack(image, data)
+
+    return pack, size * IMAGE_DATA, size
+
+
+def bench_create_disk_image(workspace, size):
+    sources = workspace.sources(size)
+
+    def create():
+        for index, source in enumerate(sources):
+            workspace.manager.create_disk_image(source, f'built{index}')
+
+    return create, size * layout.IMAGE_SIZE, size
+
+
+def bench_extract(workspace, size):
+    images = workspace.images(size)
+    output = workspace.path(workspace.manager.mirage_sounds, 'extract')
+
+    def extract():
+        for path in images:
+            batch.extract_image(path, output)
+
+    return extract, size * layout.IMAGE_SIZE, size
+
+
+def bench_extract_library(workspace, size):
+    workspace.images(size)
+    root = workspace.path(workspace.manager.mirage_ready, f'library{size}')
+    output = workspace.path(workspace.manager.mirage_sounds, f'library{size}')
+    return lambda: batch.extract_library(root, output), size * layout.IMAGE_SIZE, size
+
+
+def bench_verify(workspace, size):
+    images = workspace.images(size)
+    reference = verify.file_checksums(images[0])
+
+    def check():
+        for path in images:
+            verify.verify_file(path, reference)
+
+    return check, size * layout.IMAGE_SIZE, size
+
+
+def bench_hfe(workspace, size):
+    images = [utility.create_dummy_image(SEED + index) for index in range(size)]
+
+    def encode():
+        for image in images:
+            hfe.img_to_hfe(image)
+
+    return encode, size * layout.IMAGE_SIZE, size
+
+
+def bench_catalog_find(workspace, size):
+    rows = size * layout.WAVESAMPLE_COUNT
+    records = np.zeros(rows, dtype=catalog.RECORD_DTYPE)
+    records['sample_period'] = np.arange(rows) % 40 + 20
+    records['wavesamples']['end_page'][:, 0] = 255
+    records['wavesamples']['loop_on'][::3, 0] = 1
+    library = catalog.Catalog([f'disk{index}.img' for index in range(size)], np.arange(rows) // 6,
+                              np.arange(rows) % 6, records)
+    return lambda: library.find(looped=True, sample_rate=(30000, None)), records.nbytes, size
+
+
+def bench_similarity_query(workspace, size):
+    rows = size * layout.WAVESAMPLE_COUNT
+    vectors = np.random.default_rng(SEED).random((rows, similarity.FEATURES), dtype=np.float32)
+    index = similarity.SimilarityIndex([str(row) for row in range(rows)], vectors)
+    return lambda: index.query(vector=vectors[0], k=5), vectors.nbytes, size
+
+
+BENCHMARKS = {
+    'convert_32bf_to_8bit': bench_convert_float,
+    'convert_16_to_8bit': bench_convert_16bit,
+    'collapse_wave_data': bench_collapse,
+    'layout_pack': bench_pack,
+    'create_disk_image': bench_create_disk_image,
+    'extract_wavesamples': bench_extract,
+    'extract_library': bench_extract_library,
+    'verify_image': bench_verify,
+    'img_to_hfe': bench_hfe,
+    'catalog_find': bench_catalog_find,
+    'similarity_query': bench_similarity_query,
+}
+
+
+# Best of repeat timings.
+
+
+def measure(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(names=None, sizes=SIZES, repeat=REPEAT, folder=None):
+    results = []
+    with tempfile.TemporaryDirectory(dir=folder) as workspace_folder:
+        workspace = Workspace(workspace_folder)
+        for name in names or BENCHMARKS:
+            for size in sizes:
+                function, processed, images = BENCHMARKS[name](workspace, size)
+                seconds = measure(function, repeat)
+                results.append(Result(name, size, seconds, processed / seconds / 1e6, images / seconds))
+    return results
+
+
+def print_results(results):
+    print(f'{"benchmark":24} {"size":>5} {"seconds":>10} {"MB/s":>10} {"images/s":>10}')
+    for result in results:
+        print(f'{result.name:24} {result.size:5} {result.seconds:10.4f} {result.mb_per_s:10.1f} '
+              f'{result.images_per_s:10.1f}')
+
+
+def _key(result):
+    return f'{result.name}/{result.size}'
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as output:
+        json.dump({_key(result): result._asdict() for result in results}, output, indent=1)
+
+
+def load_baseline(path):
+    with open(path) as baseline:
+        return json.load(baseline)
+
+
+# Results whose throughput fell below the baseline by more than tolerance
+# (a fraction), as (result, baseline MB/s) pairs. Benchmarks missing from the
+# baseline are not compared.
+
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    slower = []
+    for result in results:
+        expected = baseline.get(_key(result))
+        if expected is not None and result.mb_per_s < expected['mb_per_s'] * (1 - tolerance):
+            slower.append((result, expected['mb_per_s']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Mirage image tools.')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='library sizes in images')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timings per benchmark, the best is kept')
+    parser.add_argument('--only', help='comma separated benchmarks to run: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--save-baseline', metavar='JSON', help='save the results as a baseline')
+    parser.add_argument('--baseline', metavar='JSON', help='fail if slower than this baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown against the baseline, as a fraction')
+    args = parser.parse_args(argv)
+    names = args.only.split(',') if args.only else None
+    for name in names or ():
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name}')
+    results = run(names, [int(size) for size in args.sizes.split(',')], args.repeat)
+    print_results(results)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+        print(f'saved baseline to {args.save_baseline}')
+    if args.baseline:
+        slower = regressions(results, load_baseline(args.baseline), args.tolerance)
+        for result, expected in slower:
+            print(f'REGRESSION {result.name} size {result.size}: {result.mb_per_s:.1f} MB/s, '
+                  f'baseline {expected:.1f} MB/s')
+        if slower:
+            return 1
+        print(f'no regressions beyond {args.tolerance:.0%} of {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
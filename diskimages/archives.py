@@ -0,0 +1,169 @@
+# Read sample libraries straight out of zip and tar archives, without
+# unpacking them to disk first. Members are read one at a time, so memory
+# stays bounded by the largest member (and by how many folders are in flight
+# in map_folders), not by the size of the archive.
+#
+# Zip archives are read through their central directory. Tar archives (plain
+# or compressed) are read as a stream, 'r|*', so a multi GB .tar.gz never
+# needs seeking or a temporary copy. Packing an archive takes two passes: one
+# over the headers (sample_lengths) to plan where every sample goes, then one
+# over the data (samples) to put it there.
+#
+# map_folders decodes the folders of an archive in parallel: the archive is
+# read by one thread and each folder's members handed to converter threads
+# through pipeline.run_pipeline.
+import posixpath
+import tarfile
+import zipfile
+from collections import namedtuple
+
+from diskimages import pipeline
+from diskimages import riff
+
+# refuse members bigger than this, so a stray multi GB file can't exhaust memory
+MAX_MEMBER = 16 * 1024 * 1024
+
+Member = namedtuple('Member', ['name', 'data'])
+Folder = namedtuple('Folder', ['name', 'members'])
+
+
+def is_archive(path):
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def _wanted(name, suffixes):
+    return suffixes is None or name.lower().endswith(tuple(suffix.lower() for suffix in suffixes))
+
+
+def _check_size(name, size, max_size):
+    if size > max_size:
+        raise ValueError(f'archive member {name} is {size} bytes, more than {max_size}')
+
+
+# (name, size, stream) for every file in an archive whose name ends with one
+# of suffixes (None for all), in archive order. Names always use '/',
+# whatever the archive was made on. Each stream is only good until the next
+# member is asked for.
+
+
+def _open_members(path, suffixes, max_size):
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            # sorted by folder so each folder's files come together
+            for info in sorted(archive.infolist(), key=lambda info: _folder_key(info.filename)):
+                name = info.filename.replace('\\', '/')
+                if info.is_dir() or not _wanted(name, suffixes):
+                    continue
+                _check_size(name, info.file_size, max_size)
+                with archive.open(info) as stream:
+                    yield name, info.file_size, stream
+        return
+    with tarfile.open(path, 'r|*') as archive:
+        for info in archive:
+            name = info.name.replace('\\', '/')
+            if not info.isfile() or not _wanted(name, suffixes):
+                continue
+            _check_size(name, info.size, max_size)
+            yield name, info.size, archive.extractfile(info)
+
+
+def _folder_key(name):
+    name = name.replace('\\', '/')
+    return posixpath.dirname(name), name
+
+
+# Every wanted file in an archive as Members, in archive order.
+
+
+def members(path, suffixes=('.wav',), max_size=MAX_MEMBER):
+    for name, _, stream in _open_members(path, suffixes, max_size):
+        yield Member(name, stream.read())
+
+
+class _Prefixed:
+    # a stream with bytes already read from its start put back in front
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, count=-1):
+        if count < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b''
+            return data
+        data, self.prefix = self.prefix[:count], self.prefix[count:]
+        return data + self.stream.read(count - len(data)) if count > len(data) else data
+
+
+# WAV members are read up to the start of their PCM data. Returns the stream
+# to read the PCM from, its length and its sample rate; other files are raw
+# PCM as they are, with no rate (None).
+
+
+def _pcm(stream, size):
+    head = stream.read(12)
+    stream = _Prefixed(head, stream)
+    if not riff.is_riff(head):
+        return stream, size, None
+    info = riff.read_wave_info(stream)
+    return stream, max(0, min(info.data_size, size - info.data_offset)), info.sample_rate
+
+
+# (name, PCM length, sample rate) of the wanted members, reading only their
+# headers, so a packing can be planned before any sample data is read.
+
+
+def sample_lengths(path, suffixes=None, max_size=MAX_MEMBER):
+    return [(name,) + _pcm(stream, size)[1:] for name, size, stream in _open_members(path, suffixes, max_size)]
+
+
+# (name, PCM data, sample rate) of the wanted members, in the same order as
+# sample_lengths: WAV headers are dropped, other files are taken as raw PCM.
+
+
+def samples(path, suffixes=None, max_size=MAX_MEMBER):
+    for name, size, stream in _open_members(path, suffixes, max_size):
+        stream, length, rate = _pcm(stream, size)
+        yield name, stream.read(length), rate
+
+
+# The members of an archive grouped by folder, as Folders with the members in
+# name order. folder_suffix keeps only folders whose path ends with it (e.g.
+# 'EXPORT/VC2WAV'). A tar archive is streamed, so each folder's files must be
+# stored together (tar and every archiver we have seen do this); a ValueError
+# is raised if they are not.
+
+
+def folders(path, folder_suffix=None, suffixes=('.wav',), max_size=MAX_MEMBER):
+    suffix = folder_suffix.replace('\\', '/').strip('/') if folder_suffix else None
+    done = set()
+    current = None
+    group = []
+    for member in members(path, suffixes, max_size):
+        folder = posixpath.dirname(member.name)
+        if suffix and folder != suffix and not folder.endswith('/' + suffix):
+            continue
+        if folder != current:
+            if group:
+                yield Folder(current, sorted(group))
+            if folder in done:
+                raise ValueError(f'the files of {folder} are not stored together in {path}')
+            done.add(folder)
+            current, group = folder, []
+        group.append(member)
+    if group:
+        yield Folder(current, sorted(group))
+
+
+# Run convert(folder) -> write(folder, converted) for the folders of an
+# archive (or any iterable of Folders), reading the archive in one thread and
+# converting on converters threads. Yields a batch.JobResult per folder in
+# completion order, with the folder name as its job so the members are freed
+# as soon as the folder is written. depth bounds the folders held at once
+# between stages.
+
+
+def map_folders(source, convert, write, converters=None, writers=1, depth=pipeline.DEPTH):
+    for result in pipeline.run_pipeline(source, lambda folder: folder, convert, write,
+                                        readers=1, converters=converters, writers=writers, depth=depth):
+        yield result._replace(job=result.job.name)
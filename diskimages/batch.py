@@ -0,0 +1,308 @@
+# Batch disk image building and wavesample extraction. A build batch is a
+# list of jobs, each naming a sample source in INTERMEDIATE_WAV_FOLDER and an
+# output image name. Jobs are spread over a process pool; each job is timed
+# and a failing job is reported without stopping the rest of the batch.
+#
+# usage: python -m diskimages.batch [manifest.json] [--directory FOLDER] [--workers N]
+#        python -m diskimages.batch --extract LIBRARY --output FOLDER [--workers N]
+#
+# A manifest is a JSON list of {"source": "1st_24.wav", "output": "1st_24"}.
+# --incremental FILE keeps a build manifest (see buildmanifest.py) and only
+# rebuilds images whose inputs changed. --metrics FILE writes stage timers and
+# counters (see metrics.py; .prom for Prometheus text, else JSON) and
+# --profile FILE saves cProfile stats of the run.
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from diskimages import buildmanifest
+from diskimages import hfe
+from diskimages import layout
+from diskimages import metrics
+from diskimages import parameters
+from diskimages import samplestore
+from diskimages.diskimage import MirageDiskImage
+
+Job = namedtuple('Job', ['source', 'output'])
+# metrics is the worker's metrics.snapshot() for the job when metrics are enabled
+JobResult = namedtuple('JobResult', ['job', 'seconds', 'error', 'value', 'metrics'], defaults=(None,))
+
+
+def read_manifest(path):
+    with open(path) as manifest:
+        entries = json.load(manifest)
+    return [Job(entry['source'], entry.get('output') or os.path.splitext(entry['source'])[0]) for entry in entries]
+
+
+# One job per file in a folder of intermediate wav files. The output image is
+# named after the source file. Sources are absolute paths, so the folder does
+# not have to be INTERMEDIATE_WAV_FOLDER.
+
+
+def jobs_from_directory(folder):
+    folder = os.path.abspath(folder)
+    return [Job(os.path.join(folder, name), os.path.splitext(name)[0]) for name in sorted(os.listdir(folder))
+            if os.path.isfile(os.path.join(folder, name))]
+
+
+def _timed(function, item, collect=False):
+    # runs in the worker process. Exceptions are returned rather than raised
+    # so one bad job cannot take down the batch. With collect the job's
+    # metrics go back with the result.
+    if collect:
+        metrics.enable()
+        metrics.reset()
+    start = time.perf_counter()
+    try:
+        value = function(item)
+        error = None
+    except Exception:
+        value = None
+        error = traceback.format_exc(limit=3)
+    seconds = time.perf_counter() - start
+    return JobResult(item, seconds, error, value, metrics.snapshot() if collect else None)
+
+
+# Run function(item) for every item on a pool of worker processes and yield a
+# JobResult for each as it finishes. function must be a module level function
+# so it can be sent to the workers. workers defaults to the number of cores.
+# When metrics are enabled the workers' metrics are added to this process's.
+
+
+def run_jobs(function, items, workers=None, initializer=None, initargs=()):
+    collect = metrics.enabled
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        futures = [pool.submit(_timed, function, item, collect) for item in items]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.metrics:
+                metrics.merge(result.metrics)
+            yield result
+
+
+# Each worker process creates one MirageDiskManager and reuses it (and its
+# template cache) for every job it runs.
+_manager = None
+# why the worker's MirageDiskManager could not be created, if it could not
+_manager_error = None
+
+
+def _make_manager(config_file=None):
+    from diskimages.diskmanager import MirageDiskManager
+    return MirageDiskManager() if config_file is None else MirageDiskManager(config_file)
+
+
+def _init_manager(config_file=None):
+    # runs in each worker. An exception here would break the whole pool
+    # (BrokenProcessPool) with no word of why, so it is kept and every job
+    # the worker is given fails with it instead.
+    global _manager, _manager_error
+    try:
+        _manager = _make_manager(config_file)
+    except Exception:
+        _manager, _manager_error = None, traceback.format_exc(limit=3)
+
+
+# The worker's MirageDiskManager, for job functions.
+
+
+def _worker_manager():
+    if _manager is None:
+        raise RuntimeError(f'the disk manager could not be set up\n{_manager_error}')
+    return _manager
+
+
+def build_image(job):
+    _worker_manager().create_disk_image(job.source, job.output)
+    return job.output
+
+
+# With a BuildManifest only jobs whose output is missing or whose inputs,
+# template or layout changed are run; the rest come back as 'up to date'.
+# config_file is the config.ini the workers use (default settings/config.ini);
+# it is checked in this process first, so a bad one raises here.
+
+
+def build_images(jobs, workers=None, build_manifest=None, config_file=None):
+    # a bad config fails here, before any worker starts
+    manager = _make_manager(config_file)
+    if build_manifest is None:
+        return list(run_jobs(build_image, jobs, workers, initializer=_init_manager, initargs=(config_file,)))
+    stale = []
+    results = []
+    for job in jobs:
+        output, inputs = manager.image_build_paths(job.source, job.output)
+        if build_manifest.is_stale(output, inputs, layout.LAYOUT_PARAMETERS):
+            stale.append(job)
+        else:
+            results.append(JobResult(job, 0.0, None, 'up to date'))
+    for result in run_jobs(build_image, stale, workers, initializer=_init_manager, initargs=(config_file,)):
+        if not result.error:
+            output, inputs = manager.image_build_paths(result.job.source, result.job.output)
+            build_manifest.record(output, inputs, layout.LAYOUT_PARAMETERS)
+        results.append(result)
+    build_manifest.save()
+    return results
+
+
+# Library extraction. Every .img (or .hfe) file under a folder tree is split into its
+# six wavesamples (name_lh1.wav ... name_uh3.wav, raw 8 bit PCM), written to
+# the same relative folder under the output folder. Each worker gathers all
+# six wavesamples of an image in one pass into a buffer it reuses for every
+# image, and writes the six files straight from views of that buffer.
+
+_wavesamples = None
+
+
+def find_images(root, extensions=('.img',)):
+    images = []
+    for folder, _, files in os.walk(root):
+        images.extend(os.path.join(folder, name) for name in files if name.lower().endswith(extensions))
+    return sorted(images)
+
+
+# Open a .img file (memory-mapped) or decode an HFE emulator file into an image.
+
+
+def open_image(path):
+    if path.lower().endswith('.hfe'):
+        return MirageDiskImage(hfe.read_hfe(path), path)
+    return MirageDiskImage.open(path)
+
+
+# With with_parameters the decoded parameter blocks of the six halves are
+# also written, to name_params.json.
+
+
+def extract_image(path, output_folder, name_stub=None, store_root=None, with_parameters=False):
+    global _wavesamples
+    if _wavesamples is None:
+        _wavesamples = bytearray(layout.WAVESAMPLE_COUNT * layout.WAVESAMPLE_SIZE)
+    if name_stub is None:
+        name_stub = os.path.splitext(os.path.basename(path))[0]
+    with metrics.timer('extract_image'), open_image(path) as image:
+        image.read_wavesamples(_wavesamples)
+        sound_parameters = parameters.image_parameters(image) if with_parameters else None
+    metrics.count('wavesamples_extracted', layout.WAVESAMPLE_COUNT)
+    view = memoryview(_wavesamples)
+    halves = [view[half * layout.WAVESAMPLE_SIZE:(half + 1) * layout.WAVESAMPLE_SIZE]
+              for half in range(layout.WAVESAMPLE_COUNT)]
+    if store_root is not None:
+        # content-addressed: each unique wavesample is only written once
+        return [samplestore.store_object(store_root, wavesample) for wavesample in halves]
+    os.makedirs(output_folder, exist_ok=True)
+    outputs = []
+    for wavesample, half_name in zip(halves, layout.HALF_NAMES):
+        name = os.path.join(output_folder, f'{name_stub}_{half_name}.wav')
+        with open(name, 'wb') as output:
+            output.write(wavesample)
+        metrics.count('bytes_written', len(wavesample))
+        outputs.append(name)
+    if sound_parameters is not None:
+        name = os.path.join(output_folder, f'{name_stub}_params.json')
+        with open(name, 'w') as output:
+            json.dump(dict(zip(layout.HALF_NAMES, sound_parameters)), output, indent=1)
+        outputs.append(name)
+    return outputs
+
+
+def _extract_task(task):
+    path, root, output_root, store_root = task
+    relative = os.path.relpath(os.path.dirname(path), root)
+    return extract_image(path, os.path.normpath(os.path.join(output_root, relative)), store_root=store_root)
+
+
+# Extract every image under root into output_root using a process pool.
+# Writes one JSON manifest for the run (extract_manifest.json in output_root)
+# listing the files written for each image and any failures, and returns the
+# JobResults. With a WavesampleStore the wavesamples go into the store
+# instead of separate files, the manifest lists their hashes and the store
+# index records which image and half each came from.
+
+
+def extract_library(root, output_root, workers=None, manifest_name='extract_manifest.json', store=None):
+    start = time.perf_counter()
+    store_root = store.root if store is not None else None
+    tasks = [(path, root, output_root, store_root) for path in find_images(root, ('.img', '.hfe'))]
+    results = sorted(run_jobs(_extract_task, tasks, workers), key=lambda result: result.job[0])
+    if store is not None:
+        for result in results:
+            if not result.error:
+                for digest, half_name in zip(result.value, layout.HALF_NAMES):
+                    store.record(digest, result.job[0], half_name)
+    os.makedirs(output_root, exist_ok=True)
+    manifest = {
+        'root': os.path.abspath(root),
+        'seconds': time.perf_counter() - start,
+        'images': [{'image': result.job[0], 'seconds': result.seconds,
+                    'hashes' if store is not None else 'outputs': result.value,
+                    'error': result.error} for result in results],
+    }
+    with open(os.path.join(output_root, manifest_name), 'w') as output:
+        json.dump(manifest, output, indent=1)
+    return results
+
+
+def print_report(results, elapsed):
+    failures = [result for result in results if result.error]
+    for result in results:
+        status = 'FAILED' if result.error else 'ok'
+        print(f'{status:6} {result.seconds:8.3f}s {result.job}')
+        if result.error:
+            print(result.error)
+    print(f'{len(results) - len(failures)} of {len(results)} jobs succeeded in {elapsed:.3f}s')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build Mirage disk images in parallel.')
+    parser.add_argument('manifest', nargs='?', help='JSON list of {"source": ..., "output": ...} jobs')
+    parser.add_argument('--directory', help='build one image per file in this folder of intermediate wav files')
+    parser.add_argument('--extract', help='extract the wavesamples of every .img file under this folder')
+    parser.add_argument('--output', help='output folder for --extract')
+    parser.add_argument('--incremental', metavar='FILE', help='build manifest; skip images that are up to date')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--metrics', metavar='FILE', help='write metrics to FILE (.prom for Prometheus text)')
+    parser.add_argument('--profile', metavar='FILE', help='save cProfile stats of the run to FILE')
+    parser.add_argument('--log-level', default='WARNING', help='logging level, e.g. INFO or DEBUG')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    metrics.enable(args.metrics is not None)
+    with metrics.profile(args.profile) if args.profile else contextlib.nullcontext():
+        status = _run(parser, args)
+    if args.metrics:
+        metrics.save(args.metrics)
+    return status
+
+
+def _run(parser, args):
+    start = time.perf_counter()
+    if args.extract:
+        if not args.output:
+            parser.error('--extract needs --output')
+        results = extract_library(args.extract, args.output, args.workers)
+        failures = [result for result in results if result.error]
+        print(f'extracted {len(results) - len(failures)} of {len(results)} images in '
+              f'{time.perf_counter() - start:.3f}s, manifest in {args.output}')
+        return 1 if failures else 0
+    if args.manifest:
+        jobs = read_manifest(args.manifest)
+    elif args.directory:
+        jobs = jobs_from_directory(args.directory)
+    else:
+        parser.error('a manifest, --directory or --extract is required')
+    build_manifest = buildmanifest.BuildManifest(args.incremental) if args.incremental else None
+    results = build_images(jobs, args.workers, build_manifest)
+    failures = print_report(results, time.perf_counter() - start)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
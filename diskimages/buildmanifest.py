@@ -0,0 +1,69 @@
+# Build manifest for incremental rebuilds. For every output (an intermediate
+# wav or a .img) the manifest records the hashes of the files it was built
+# from, including the template, plus the layout parameters used. An output
+# only needs rebuilding when it is missing or that record no longer matches.
+#
+# Hashes are cached against each file's modification time and size, so
+# checking an unchanged library costs a stat per file rather than a read.
+import hashlib
+import json
+import os
+import tempfile
+
+BLOCK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BuildManifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.outputs = {}
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as manifest:
+                data = json.load(manifest)
+            self.outputs = data.get('outputs', {})
+            self.files = data.get('files', {})
+
+    # hash of a file, reusing the cached value if its mtime and size are unchanged
+    def hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        digest = file_hash(path)
+        self.files[path] = [stat.st_mtime_ns, stat.st_size, digest]
+        return digest
+
+    def signature(self, inputs, params=None):
+        return {'inputs': {os.path.abspath(path): self.hash(path) for path in inputs}, 'params': params or {}}
+
+    # True if output is missing, was never recorded or any input or parameter changed.
+    def is_stale(self, output, inputs, params=None):
+        recorded = self.outputs.get(os.path.abspath(output))
+        if recorded is None or not os.path.exists(output):
+            return True
+        try:
+            return recorded != self.signature(inputs, params)
+        except OSError:
+            # a missing input can't be up to date
+            return True
+
+    def record(self, output, inputs, params=None):
+        self.outputs[os.path.abspath(output)] = self.signature(inputs, params)
+
+    def save(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        handle, temporary = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(handle, 'w') as output:
+            json.dump({'outputs': self.outputs, 'files': self.files}, output, indent=1)
+        os.replace(temporary, self.path)
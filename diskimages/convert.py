@@ -0,0 +1,128 @@
+# Sample format conversion to the 8 bit unsigned PCM the Mirage uses.
+# Everything here works on whole buffers at once with NumPy instead of one
+# sample at a time, so a wavetable archive converts in milliseconds.
+import numpy as np
+
+from diskimages import metrics
+
+# Supported input formats. Each entry is the NumPy dtype used to read the
+# data and the number of bits in a sample. int24 has no NumPy dtype so it is
+# assembled from bytes by hand.
+SAMPLE_FORMATS = {
+    'uint8': ('u1', 8),
+    'uint16': ('u2', 16),
+    'int16': ('i2', 16),
+    'int24': (None, 24),
+    'int32': ('i4', 32),
+    'float32': ('f4', 32),
+    'float64': ('f8', 64),
+}
+
+BYTE_ORDERS = {'little': '<', 'big': '>'}
+
+
+def sample_width(sample_format):
+    # bytes per sample for a format name
+    return SAMPLE_FORMATS[sample_format][1] // 8
+
+
+# Read a buffer of raw PCM into a NumPy array of samples. Trailing bytes that
+# do not make up a whole sample are ignored. No data is copied unless the
+# format is int24.
+
+
+def decode_samples(data, sample_format, byteorder='little'):
+    if sample_format not in SAMPLE_FORMATS:
+        raise ValueError(f'unsupported sample format {sample_format}')
+    if byteorder not in BYTE_ORDERS:
+        raise ValueError(f'unsupported byte order {byteorder}')
+    dtype, bits = SAMPLE_FORMATS[sample_format]
+    width = bits // 8
+    raw = np.frombuffer(data, dtype=np.uint8)
+    raw = raw[:len(raw) - len(raw) % width]
+    if dtype is not None:
+        return raw.view(BYTE_ORDERS[byteorder] + dtype)
+    # int24: build 32 bit values with the sample in the top 3 bytes so the
+    # sign comes along for free, then shift back down.
+    triples = raw.reshape(-1, 3).astype(np.int32)
+    if byteorder == 'big':
+        triples = triples[:, ::-1]
+    return ((triples[:, 0] << 8) | (triples[:, 1] << 16) | (triples[:, 2] << 24)) >> 8
+
+
+# Scale decoded samples to floats in the range -1 to +1.
+
+
+def to_float(samples, sample_format):
+    dtype, bits = SAMPLE_FORMATS[sample_format]
+    if sample_format.startswith('float'):
+        return samples.astype(np.float64)
+    if sample_format.startswith('uint'):
+        return samples.astype(np.float64) / (1 << (bits - 1)) - 1.0
+    return samples.astype(np.float64) / (1 << (bits - 1))
+
+
+# Average interleaved channels down to one. Incomplete trailing frames are
+# dropped.
+
+
+def mix_down(values, channels):
+    if channels == 1:
+        return values
+    return values[:len(values) - len(values) % channels].reshape(-1, channels).mean(axis=1)
+
+
+# Convert floats in the range -1 to +1 to unsigned 8 bit. Values outside the
+# range are clipped. Without dither the value is truncated, which is what the
+# original convert_32bf_to_8bit did. With dither, triangular (TPDF) noise of
+# +/- 1 LSB is added and the result is rounded.
+
+
+def float_to_8bit(values, dither=False, rng=None):
+    scaled = (np.clip(values, -1.0, 1.0) + 1.0) / 2 * 255
+    if dither:
+        if rng is None:
+            rng = np.random.default_rng()
+        scaled = np.floor(scaled + 0.5 + rng.random(len(scaled)) - rng.random(len(scaled)))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+# Convert a buffer of PCM samples in any supported format to unsigned 8 bit
+# and return it as a bytearray. Integer data with no dither or normalization
+# takes a fast path that keeps the most significant 8 bits of each sample.
+# normalize scales the buffer so its peak reaches full scale; pass peak to
+# normalize against a value measured elsewhere (e.g. over a whole file that is
+# converted a block at a time). Interleaved multi channel data is mixed down
+# to mono.
+
+
+@metrics.timed('convert')
+def convert_to_8bit(data, sample_format='int16', byteorder='little', dither=False, normalize=False, rng=None,
+                    channels=1, peak=None):
+    samples = decode_samples(data, sample_format, byteorder)
+    metrics.count('samples_converted', len(samples))
+    if not (dither or normalize) and channels == 1 and not sample_format.startswith('float'):
+        bits = SAMPLE_FORMATS[sample_format][1]
+        if sample_format.startswith('uint'):
+            return bytearray((samples >> (bits - 8)).astype(np.uint8))
+        return bytearray(((samples >> (bits - 8)) + 128).astype(np.uint8))
+    values = to_float(samples, sample_format)
+    values = mix_down(values, channels)
+    if normalize and len(values):
+        if peak is None:
+            peak = np.max(np.abs(values))
+        if peak > 0:
+            values = values / peak
+    return bytearray(float_to_8bit(values, dither, rng))
+
+
+# Peak absolute value of a buffer as a float in the range 0 to 1, after mixing
+# down to mono.
+
+
+def peak_level(data, sample_format='int16', byteorder='little', channels=1):
+    values = to_float(decode_samples(data, sample_format, byteorder), sample_format)
+    values = mix_down(values, channels)
+    if not len(values):
+        return 0.0
+    return float(np.max(np.abs(values)))
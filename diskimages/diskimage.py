@@ -0,0 +1,119 @@
+# A Mirage disk image (.img) as an object. Images opened from a file are
+# memory-mapped, and every accessor returns a memoryview window onto the
+# mapping, so reading, verifying and patching an image copies nothing until
+# the caller asks for it.
+# The disk layout itself is described in layout.py.
+import mmap
+
+from diskimages.layout import HALF_NAMES, IMAGE_SIZE, PARAMETER_SIZE, SECTOR_SIZE, SECTORS_PER_TRACK, \
+    SHORT_SECTOR_SIZE, TRACK_COUNT, TRACK_LENGTH, WAVESAMPLE_SIZE, WAVESAMPLE_TRACKS
+from diskimages import layout
+
+
+class MirageDiskImage:
+
+    # buffer is anything supporting the buffer protocol: an mmap, bytearray or
+    # bytes. Read only buffers give read only views.
+    def __init__(self, buffer, name=None):
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._file = None
+        self.name = name
+        if len(self._view) != IMAGE_SIZE:
+            size = len(self._view)
+            # release the view so the caller can close the buffer
+            self._view.release()
+            raise ValueError(f'disk image is {size} bytes, expected {IMAGE_SIZE}')
+
+    # Map an image file into memory. writable maps it shared, so changes made
+    # through the views go straight to the file.
+    @classmethod
+    def open(cls, path, writable=False):
+        file = open(path, 'r+b' if writable else 'rb')
+        try:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            file.close()
+            raise
+        try:
+            image = cls(mapping, path)
+        except ValueError:
+            mapping.close()
+            file.close()
+            raise
+        image._file = file
+        return image
+
+    # Any views handed out must be released (or dropped) before closing a
+    # mapped image, otherwise the mapping cannot be closed.
+    def close(self):
+        self._view.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def data(self):
+        # view of the whole image
+        return self._view
+
+    def track(self, track):
+        if not 0 <= track < TRACK_COUNT:
+            raise IndexError(f'track {track} out of range')
+        start = track * TRACK_LENGTH
+        return self._view[start:start + TRACK_LENGTH]
+
+    def sector(self, track, sector):
+        if not 0 <= sector < SECTORS_PER_TRACK:
+            raise IndexError(f'sector {sector} out of range')
+        start = sector * SECTOR_SIZE
+        size = SHORT_SECTOR_SIZE if sector == SECTORS_PER_TRACK - 1 else SECTOR_SIZE
+        return self.track(track)[start:start + size]
+
+    # half is 0-5 (lh1, uh1, lh2, uh2, lh3, uh3)
+    def parameter_block(self, half):
+        return self.track(WAVESAMPLE_TRACKS[half])[0:PARAMETER_SIZE]
+
+    # The 13 windows that make up a wavesample, in order. Together they are
+    # exactly 64KB.
+    def wavesample_segments(self, half):
+        return [self._view[image_offset:image_offset + length]
+                for wave_offset, image_offset, length in layout.segments(half)]
+
+    # Gather a wavesample into out (a 64KB writable buffer), allocating one
+    # only if none is given. Pass the same buffer when scanning many images.
+    def read_wavesample(self, half, out=None):
+        if out is None:
+            out = bytearray(WAVESAMPLE_SIZE)
+        target = memoryview(out)
+        for wave_offset, image_offset, length in layout.segments(half):
+            target[wave_offset:wave_offset + length] = self._view[image_offset:image_offset + length]
+        return out
+
+    # Scatter 64KB of wavesample data into the image.
+    def write_wavesample(self, half, data):
+        source = memoryview(data)
+        if len(source) != WAVESAMPLE_SIZE:
+            raise ValueError(f'wavesample is {len(source)} bytes, expected {WAVESAMPLE_SIZE}')
+        for wave_offset, image_offset, length in layout.segments(half):
+            self._view[image_offset:image_offset + length] = source[wave_offset:wave_offset + length]
+
+    # All six wavesamples (6 * 64KB, intermediate wav order) in one gather.
+    def read_wavesamples(self, out=None):
+        return layout.unpack(self._view, out)
+
+    # Replace all six wavesamples in one scatter.
+    def write_wavesamples(self, data):
+        layout.pack(self._view, data)
@@ -9,13 +9,24 @@ import configparser
 import logging
 import os.path
 import sys
+import time
 
 from pathlib import Path
 from sys import platform
 
+from diskimages import batch
+from diskimages import hfe
+from diskimages import layout
+from diskimages import loops
+from diskimages import metrics
+from diskimages import packing
+from diskimages import preprocessor
+from diskimages import templates
 from diskimages import utility
 
 APP = "wavsyn"
+# settings/config.ini next to the diskimages package
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "settings", "config.ini")
 
 
 class MirageDiskManager:
@@ -30,22 +41,22 @@ class MirageDiskManager:
     home = os.getenv("HOMEPATH")
     logfile = None
 
-    # init method
-    def __init__(self):
+    # init method. config_file defaults to settings/config.ini in the project.
+    def __init__(self, config_file=CONFIG_FILE):
         if platform == "linux" or platform == "linux2" or platform == "darwin":
             # linux
             self.home = os.getenv("HOME")
         # windows HOMEPATH is the default
         # read config file parameters needed
         config = configparser.ConfigParser()
-        config.read("C:\\Users\\eizde\\PycharmProjects\\pythonProject\\settings" + os.path.sep + "config.ini")
+        if not config.read(config_file):
+            raise FileNotFoundError(f'config file {config_file} not found')
         # set variables
         if config['FILES']['HOME']:
             self.home = config['FILES']['HOME']
         # need an app_root directory
         self.app_root = self.home + os.path.sep + APP
-        if not os.path.exists(self.app_root):
-            os.makedirs(self.app_root)
+        os.makedirs(self.app_root, exist_ok=True)
         # logging
         self.logfile = self.app_root + os.path.sep + config['LOGS']['LOGFILE']
         logging.basicConfig(filename=self.logfile, level=config['LOGS']['LEVEL'])
@@ -56,63 +67,79 @@ class MirageDiskManager:
         self.fairlight = config['FILES']['FAIRLIGHT']
         self.k3 = config['FILES']['KAWAIK3']
         self.mirage_sounds = config['FILES']['MIRAGE_SOUNDS']
-        if not os.path.exists(self.app_root + os.path.sep + self.mirage_ready):
-            os.makedirs(self.app_root + os.path.sep + self.mirage_ready)
-        if not os.path.exists(self.app_root + os.path.sep + self.hfe):
-            os.makedirs(self.app_root + os.path.sep + self.hfe)
-        if not os.path.exists(self.app_root + os.path.sep + self.intermediate_wav):
-            os.makedirs(self.app_root + os.path.sep + self.intermediate_wav)
-        if not os.path.exists(self.app_root + os.path.sep + self.wavetables):
-            os.makedirs(self.app_root + os.path.sep + self.wavetables)
-        if not os.path.exists(self.app_root + os.path.sep + self.fairlight):
-            os.makedirs(self.app_root + os.path.sep + self.fairlight)
-        if not os.path.exists(self.app_root + os.path.sep + self.k3):
-            os.makedirs(self.app_root + os.path.sep + self.k3)
-        if not os.path.exists(self.app_root + os.path.sep + self.mirage_sounds):
-            os.makedirs(self.app_root + os.path.sep + self.mirage_sounds)
-        logging.info("initialized application from settings/config.ini")
+        for folder in (self.mirage_ready, self.hfe, self.intermediate_wav, self.wavetables, self.fairlight, self.k3,
+                       self.mirage_sounds):
+            os.makedirs(os.path.join(self.app_root, folder), exist_ok=True)
+        logging.info(f"initialized application from {config_file}")
         logging.info("application output directory is " + self.app_root)
 
     # Reads a file from INTERMEDIATE_WAV_FOLDER defined in config.ini and writes it to a mirage disk image format
     # using a template to insert the data in. The template contains the Mirage OS, sound parameters, wavetable
-    # settings, and global mirage config parameters.
-
-    def create_disk_image(self, sample_source, output_file):
-        template = self.read_template_disk_image(self.fairlight_template)
-        new_wavesamples = self.read_sample_source(sample_source)
-        # copy the template byte data to the new disk image
-        new_image = bytearray(len(template))
-        new_image[0:len(template)] = template[0:len(template)]
-
-        # go through the tracks/sectors and write data. copy template to the new_image as you go.
-        track_length = 5632
-        # wavesample plus extra data size
-        sample_size = 72704
-        # track start number for wave samples
-        sample_metadata = {2, 15, 28, 41, 54, 67}
-        # each wavesample start at the given track PLUS 1024 bytes
-
-        # write 78 sectors worth of data (6 * 64KB) into the 5120 byte slots in the template
-        for count in range(6):
-            for x in range(13):
-                track = (count * 13) + x + 2
-                position = track * track_length
-                wavesample_position = count * 65536 + x * 5120
-                if x == 0:
-                    # skip 1024 and copy 4096 for first sector of each sample.
-                    wavesample_position = count * 65536
-                    new_image[position + 1024:position + 5120] = \
-                        new_wavesamples[wavesample_position:wavesample_position + 4096]
-                else:
-                    wavesample_position = count * 65536 + 4096 + (x - 1) * 5120
-                    new_image[position:position + 5120] = \
-                        new_wavesamples[wavesample_position:wavesample_position + 5120]
-            print(f'info: wrote wave sample {count + 1}')
-        # save the new disk image
-        utility.write_file(new_image, "mirage_ready\\" + output_file + ".img")
-
-        # verify
-        utility.verify_image(new_image)
+    # settings, and global mirage config parameters. The image is written to MIRAGE_READY.
+    # An optional WavesampleStore records the six wavesamples under the output image name.
+    # tables, if given, holds the wavesample table entries of each of the six halves (see loops.write_loops); they
+    # replace the template's before the image is written.
+    # With a BuildManifest the image is only rebuilt when the sample source, template, layout or tables changed.
+    # Returns False if the build was skipped.
+
+    def create_disk_image(self, sample_source, output_file, store=None, manifest=None, tables=None):
+        output, inputs = self.image_build_paths(sample_source, output_file)
+        params = layout.LAYOUT_PARAMETERS if tables is None else {**layout.LAYOUT_PARAMETERS, 'tables': tables}
+        if manifest is not None and not manifest.is_stale(output, inputs, params):
+            logging.info(f'{output} is up to date')
+            return False
+        with metrics.timer('create_disk_image'):
+            new_wavesamples = self.read_sample_source(sample_source)
+            if store is not None:
+                store.add_wavesamples(new_wavesamples, output_file + ".img")
+            # the new disk image is a copy-on-write clone of the cached template, so
+            # only the pages holding wavesample data get copied.
+            with templates.clone(self.template_path()) as new_image:
+                # write 78 sectors worth of data (6 * 64KB) into the 5120 byte slots of each track in one scatter
+                new_image.write_wavesamples(new_wavesamples)
+                logging.debug('wrote wave samples 1-6')
+                for half, entries in enumerate(tables or []):
+                    loops.write_loops(new_image, half, entries)
+                # save the new disk image
+                utility.write_file(new_image.data, output)
+
+                # verify
+                utility.verify_image(new_image)
+        metrics.count('images_built')
+        if manifest is not None:
+            manifest.record(output, inputs, params)
+        return True
+
+    # Pack samples of any length (bytes-like, up to 64KB each) into as few disk images as they fit, up to 8 per
+    # half. Writes the intermediate wavs to INTERMEDIATE_WAV_FOLDER, then builds output_file.img,
+    # output_file_2.img ... Returns the placement of each sample.
+    # Samples start on page boundaries. The parameter blocks are copied from the template unchanged unless
+    # write_tables is set: then the wavesample tables are built to point at the samples, and with find_loops a loop
+    # is found for each sample and written to its table entry too. The table layout (see parameters) has not been
+    # checked against a real Mirage disk yet, so writing it stays opt-in; find_loops implies write_tables.
+    # An optional WavesampleStore records the wavesamples of every image built.
+
+    def create_packed_disk_images(self, samples, output_file, find_loops=False, store=None, write_tables=False):
+        buffers, placements = packing.pack_images(samples)
+        tables = None
+        if write_tables or find_loops:
+            found = [loops.find_loop(sample, pages=True) if find_loops else None for sample in samples]
+            tables = loops.wavesample_entries(placements, found)
+        for number, (buffer, name) in enumerate(zip(buffers, preprocessor.spill_names(output_file, len(buffers)))):
+            self.write_wave_sample(buffer, name + ".wav")
+            self.create_disk_image(name + ".wav", name, store=store, tables=None if tables is None else
+                                   [tables.get((number, half), []) for half in range(layout.WAVESAMPLE_COUNT)])
+        logging.info(f'packed {len(samples)} samples into {len(buffers)} images')
+        return placements
+
+    def template_path(self):
+        return os.path.join(sys.path[0], self.fairlight_template)
+
+    # The output path of an image and the files it is built from.
+
+    def image_build_paths(self, sample_source, output_file):
+        output = os.path.join(self.app_root, self.mirage_ready, output_file + ".img")
+        return output, [os.path.join(self.app_root, self.intermediate_wav, sample_source), self.template_path()]
 
     # This file needs to be written to a floppy disk for use in the Mirage, or
     # converted to a format used with a USB drive.
@@ -133,53 +160,57 @@ class MirageDiskManager:
     def read_template_disk_image(self, template):
         disk_image_template = open(os.path.join(sys.path[0], template), 'rb')
         mirage_data = bytearray(disk_image_template.read())
-        print(f'info: data read from template disk image = {len(mirage_data)}.')
+        logging.debug(f'data read from template disk image = {len(mirage_data)}.')
         return mirage_data
 
+    # sample_file is relative to INTERMEDIATE_WAV_FOLDER unless it is an absolute path.
+
     def read_sample_source(self, sample_file):
-        input_source = self.app_root + os.path.sep + self.intermediate_wav + os.path.sep + sample_file
+        input_source = os.path.join(self.app_root, self.intermediate_wav, sample_file)
         samples = open(input_source, 'rb')
         data = bytearray(samples.read())
-        logging.info(f'data read from {input_source} = {len(data)}.')
+        metrics.count('bytes_read', len(data))
+        logging.debug(f'data read from {input_source} = {len(data)}.')
         samples.close()
         return data
 
     # This will extract the data from a mirage disk image (original, not hfe) in MIRAGE_READY from config.ini.
     # and write it out as 6 wavesample files. They are raw pcm data (no wav header). Format is:
     # mono, unsigned 8 bit, little-endian
+    # With with_parameters the decoded sound parameters (sample rate, loops, envelopes) go to name_params.json.
 
-    def extract_wavesamples(self, filename):
+    def extract_wavesamples(self, filename, with_parameters=False):
         logging.info(f"processing file {filename}")
-        name_stub = os.path.splitext(filename)[0]
-        # create six separate arrays of binary data, each initially 72704 bytes.
-        # This contains the 64KB wavesample plus extra 512 byte sectors
-        # and initial 1024 byte parameter data to be removed.
-        mirage_disk = open(self.app_root + os.path.sep + self.mirage_ready + os.path.sep + filename, 'rb')
-        mirage_data = bytearray(mirage_disk.read())
-        logging.info(f'data read = {len(mirage_data)}.')
-        mirage_disk.close()
-
-        # wavesample plus extra data size
-        sample_size = 72704
-        # calculate offset and remove short sectors
-        # lower half wavesample 1, starts at sector 2 (skips 0 and 1)
-        track_length = 5632
-        # track start number for samples
-        sample_metadata = {name_stub + "_lh1.wav": 2, name_stub + "_uh1.wav": 15,
-                           name_stub + "_lh2.wav": 28, name_stub + "_uh2.wav": 41,
-                           name_stub + "_lh3.wav": 54, name_stub + "_uh3.wav": 67}
-
-        for name, track in sample_metadata.items():
-            # create a new byte array containing correct data (64KB chunk)
-            offset = track * track_length
-            data = bytearray(mirage_data[offset:offset + sample_size])
-            logging.info(f"***** processing {name} *****")
-            wavesample = utility.collapse_wave_data(data)
-            self.write_mirage_sound(wavesample, name)
+        # the image is memory-mapped and all six 64KB wavesamples are gathered
+        # in one pass, skipping the 1024 byte parameter data and the short
+        # 512 byte sectors.
+        path = os.path.join(self.app_root, self.mirage_ready, filename)
+        outputs = batch.extract_image(path, os.path.join(self.app_root, self.mirage_sounds),
+                                      with_parameters=with_parameters)
+        logging.info(f'wrote {len(outputs)} wavesamples from {filename}')
+
+    # Extract every image under MIRAGE_READY (or another folder tree) into
+    # MIRAGE_SOUNDS using worker processes. One manifest is written per run.
+    # With a WavesampleStore each unique wavesample is stored once instead.
+
+    def extract_library(self, root=None, workers=None, store=None):
+        root = root or os.path.join(self.app_root, self.mirage_ready)
+        results = batch.extract_library(root, os.path.join(self.app_root, self.mirage_sounds), workers, store=store)
+        failures = [result for result in results if result.error]
+        logging.info(f'extracted {len(results) - len(failures)} of {len(results)} images from {root}')
+        return results
+
+    # Convert an image in MIRAGE_READY to an HFE file in OUTPUT_HFE_FOLDER for use with a Gotek drive.
+
+    def write_hfe(self, filename):
+        hfe_file = os.path.join(self.app_root, self.hfe, os.path.splitext(filename)[0] + ".hfe")
+        hfe.write_hfe(os.path.join(self.app_root, self.mirage_ready, filename), hfe_file)
+        logging.info(f'wrote {hfe_file}')
+        return hfe_file
 
     # Write a 64KB wave file. File is mono, 8bit unsigned PCM. Sample rate is unknown, but
-    # default is 29411Hz, so the sample is about 2 seconds long. To get the actual sample rate,
-    # you need to know how to read the parameter data from the disk and what it means.
+    # default is 29411Hz, so the sample is about 2 seconds long. The actual sample rate is in the
+    # parameter data, see parameters.decode.
 
     def write_mirage_sound(self, samples, name):
         output = open(self.app_root + os.path.sep + self.mirage_sounds + os.path.sep + name, 'wb')
@@ -189,17 +220,6 @@ class MirageDiskManager:
 
 if __name__ == '__main__':
     # read and pass file name argument
-
-    mirage = MirageDiskManager()
-    mirage.create_disk_image("1st_24.wav", "1st_24")
-    mirage.create_disk_image("2nd_24.wav", "2nd_24")
-    mirage.create_disk_image("3rd_24.wav", "3rd_24")
-    mirage.create_disk_image("4th_24.wav", "4th_24")
-    mirage.create_disk_image("5th_24.wav", "5th_24")
-    exit(0)
-    # mirage.create_disk_image("virus_ti.wav", "virus_ti.img")
-
-
     print('''
     The sample source file must contain 6 64KB chunks of data, organized in this order:
     lower half 1
@@ -210,25 +230,22 @@ if __name__ == '__main__':
     upper half 3
     
     Of course you can load any data you like, any way you like, since not bound by Mirage sampling rules.
+    For manifests and worker settings use python -m diskimages.batch.
     ''')
+    start = time.perf_counter()
     if len(sys.argv) == 3:
-        create_disk_image(sys.argv[1], sys.argv[2])
+        mirage = MirageDiskManager()
+        mirage.create_disk_image(sys.argv[1], sys.argv[2])
     elif len(sys.argv) == 2:
         # my hack to process some ppg files; voices-image.wav voices
-        mirage.create_disk_image("1st_24.wav", "1st_24")
-        mirage.create_disk_image("2nd_24.wav", "2nd_24")
-        mirage.create_disk_image("3rd_24.wav", "3rd_24")
-        mirage.create_disk_image("4th_24.wav", "4th_24")
-        mirage.create_disk_image("5th_24.wav", "5th_24")
-
+        jobs = [batch.Job(name + ".wav", name) for name in ("1st_24", "2nd_24", "3rd_24", "4th_24", "5th_24")]
+        batch.print_report(batch.build_images(jobs), time.perf_counter() - start)
     else:
         path = Path(sys.argv[0])
         root_directory = os.path.join(path.parent.absolute(), "fairlight")
-        root = os.listdir(root_directory)
-        print(f'root directory = {root}')
-        for item in root:
-            print(f'processing {item}')
-            create_disk_image(os.path.join(root_directory, item), item)
+        print(f'root directory = {os.listdir(root_directory)}')
+        results = batch.build_images(batch.jobs_from_directory(root_directory))
+        batch.print_report(results, time.perf_counter() - start)
 
         # print("A sample source file name and output file name (for new disk image) is required. Exiting.")
         # sys.exit(1)
@@ -0,0 +1,365 @@
+# Write Mirage disk images as HFE files for HxC/Gotek floppy emulators, which
+# is what OUTPUT_HFE_FOLDER is for, and read HFE files back into images.
+#
+# The Mirage disk is double density MFM, 250 kbit/s at 300 rpm, single sided,
+# with 80 tracks of five 1024 byte sectors and one 512 byte sector (IDs 0-5).
+# Each track is laid out IBM System 34 style (gap, sync, address mark, ID,
+# CRC, gap, sync, data mark, data, CRC, gap), with gaps shortened so the 5632
+# bytes fit in the 6250 byte track.
+#
+# Encoding is table driven and works on all 80 tracks at once: the raw track
+# bytes are assembled from a precomputed track template with one NumPy
+# scatter, then each byte is looked up in a byte -> 16 bit MFM table indexed
+# by the previous data bit, and finally a bit reversal table puts the bits in
+# HFE's least significant bit first order.
+#
+# Decoding runs the same tables backwards on a whole track at a time: the
+# bit cells are unpacked with NumPy, address marks are found by matching a
+# sliding 16 cell window against the sync pattern, and each field is decoded
+# by taking every second cell (the data bits) and packing them into bytes.
+#
+# usage: python -m diskimages.hfe LIBRARY OUTPUT [--to-img] [--workers N]
+import argparse
+import binascii
+import os
+import struct
+import sys
+
+import numpy as np
+
+from diskimages import batch
+from diskimages import layout
+from diskimages import metrics
+
+BIT_RATE = 250
+RPM = 300
+# bytes of MFM data per track (before encoding): 200ms at 250 kbit/s
+TRACK_BYTES = BIT_RATE * 1000 * 60 // RPM // 8
+FIRST_SECTOR_ID = 0
+HFE_SIGNATURE = b'HXCPICFE'
+ISOIBM_MFM_ENCODING = 0
+GENERIC_SHUGART_DD_FLOPPYMODE = 7
+BLOCK_SIZE = 512
+
+GAP_BYTE = 0x4e
+GAP4A = 32
+GAP1 = 32
+GAP2 = 22
+GAP3 = 24
+SYNC = 12
+# address marks: written as A1 A1 A1 (or C2 C2 C2 for the index mark) with a
+# missing clock bit so they can't occur in normal data
+SYNC_A1 = 0x4489
+SYNC_C2 = 0x5224
+INDEX_MARK = 0xfc
+ID_MARK = 0xfe
+DATA_MARK = 0xfb
+
+# raw track bytes are MFM encoded into 16 bit cells
+SIDE_BYTES = TRACK_BYTES * 2
+TRACK_BLOCKS = -(-SIDE_BYTES // (BLOCK_SIZE // 2))
+
+
+def _sector_sizes():
+    return [layout.SHORT_SECTOR_SIZE if sector == layout.SECTORS_PER_TRACK - 1 else layout.SECTOR_SIZE
+            for sector in range(layout.SECTORS_PER_TRACK)]
+
+
+def _size_code(size):
+    # 128 << N bytes
+    return (size // 128).bit_length() - 1
+
+
+# Precompute the byte layout shared by every track. Returns the template
+# bytes, a mark array (0 normal byte, 1 A1 sync, 2 C2 sync), the positions of
+# the ID fields (C H R N), of each sector's data and of each CRC.
+
+
+def _track_template():
+    track = []
+    marks = []
+
+    def put(values, mark=0):
+        start = len(track)
+        track.extend(values)
+        marks.extend([mark] * len(values))
+        return start
+
+    put([GAP_BYTE] * GAP4A)
+    put([0] * SYNC)
+    put([0xc2] * 3, 2)
+    put([INDEX_MARK])
+    put([GAP_BYTE] * GAP1)
+    ids = []
+    data = []
+    for sector, size in enumerate(_sector_sizes()):
+        put([0] * SYNC)
+        id_start = put([0xa1] * 3, 1)
+        put([ID_MARK])
+        put([0, 0, FIRST_SECTOR_ID + sector, _size_code(size)])
+        put([0, 0])
+        put([GAP_BYTE] * GAP2)
+        put([0] * SYNC)
+        data_start = put([0xa1] * 3, 1)
+        put([DATA_MARK])
+        put([0] * size)
+        put([0, 0])
+        put([GAP_BYTE] * GAP3)
+        ids.append(id_start)
+        data.append(data_start)
+    if len(track) > TRACK_BYTES:
+        raise ValueError(f'track layout needs {len(track)} bytes, only {TRACK_BYTES} fit')
+    put([GAP_BYTE] * (TRACK_BYTES - len(track)))
+    return np.array(track, dtype=np.uint8), np.array(marks, dtype=np.uint8), ids, data
+
+
+TRACK_TEMPLATE, TRACK_MARKS, ID_POSITIONS, DATA_POSITIONS = _track_template()
+
+# where each byte of a 5632 byte image track goes in the raw track
+SECTOR_INDEX = np.concatenate([np.arange(start + 4, start + 4 + size)
+                               for start, size in zip(DATA_POSITIONS, _sector_sizes())])
+
+
+def _mfm_table():
+    # MFM[previous data bit, byte] -> 16 bit cell pattern, most significant first.
+    # A clock bit is 1 only between two 0 data bits.
+    table = np.zeros((2, 256), dtype=np.uint16)
+    for previous in (0, 1):
+        for byte in range(256):
+            last = previous
+            word = 0
+            for bit in range(7, -1, -1):
+                data = (byte >> bit) & 1
+                clock = 1 if (last == 0 and data == 0) else 0
+                word = (word << 2) | (clock << 1) | data
+                last = data
+            table[previous, byte] = word
+    return table
+
+
+MFM_TABLE = _mfm_table()
+# reverse the bits of a byte: HFE stores the first bit cell in bit 0
+BIT_REVERSE = np.array([int(f'{byte:08b}'[::-1], 2) for byte in range(256)], dtype=np.uint8)
+
+
+# Raw (unencoded) track bytes for every track of an image, shape (80, 6250).
+
+
+def raw_tracks(image):
+    data = np.frombuffer(image, dtype=np.uint8)
+    if len(data) != layout.IMAGE_SIZE:
+        raise ValueError(f'disk image is {len(data)} bytes, expected {layout.IMAGE_SIZE}')
+    tracks = np.tile(TRACK_TEMPLATE, (layout.TRACK_COUNT, 1))
+    tracks[:, SECTOR_INDEX] = data.reshape(layout.TRACK_COUNT, layout.TRACK_LENGTH)
+    for track in range(layout.TRACK_COUNT):
+        row = tracks[track]
+        for id_start, data_start, size in zip(ID_POSITIONS, DATA_POSITIONS, _sector_sizes()):
+            row[id_start + 4] = track
+            id_crc = binascii.crc_hqx(row[id_start:id_start + 8].tobytes(), 0xffff)
+            row[id_start + 8:id_start + 10] = (id_crc >> 8, id_crc & 0xff)
+            data_crc = binascii.crc_hqx(row[data_start:data_start + 4 + size].tobytes(), 0xffff)
+            row[data_start + 4 + size:data_start + 6 + size] = (data_crc >> 8, data_crc & 0xff)
+    return tracks
+
+
+# MFM encode raw track bytes (any shape, last axis along the track) to bit
+# cells, two bytes per input byte, most significant bit first.
+
+
+def mfm_encode(raw, marks=TRACK_MARKS):
+    previous = np.zeros_like(raw)
+    previous[..., 1:] = raw[..., :-1] & 1
+    words = MFM_TABLE[previous, raw]
+    words[..., marks == 1] = SYNC_A1
+    words[..., marks == 2] = SYNC_C2
+    return words.astype('>u2').view(np.uint8).reshape(raw.shape[:-1] + (raw.shape[-1] * 2,))
+
+
+def _header():
+    header = struct.pack('<8sBBBBHHBBHBBBBBB', HFE_SIGNATURE, 0, layout.TRACK_COUNT, 1, ISOIBM_MFM_ENCODING,
+                         BIT_RATE, RPM, GENERIC_SHUGART_DD_FLOPPYMODE, 1, 1, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff)
+    return header + b'\xff' * (BLOCK_SIZE - len(header))
+
+
+def _track_list():
+    entries = b''.join(struct.pack('<HH', 2 + track * TRACK_BLOCKS, SIDE_BYTES * 2)
+                       for track in range(layout.TRACK_COUNT))
+    return entries + b'\xff' * (BLOCK_SIZE - len(entries))
+
+
+# Convert a Mirage disk image (any buffer) to the bytes of an HFE file.
+
+
+@metrics.timed('img_to_hfe')
+def img_to_hfe(image):
+    cells = BIT_REVERSE[mfm_encode(raw_tracks(image))]
+    sides = np.empty((layout.TRACK_COUNT, TRACK_BLOCKS * 256, 2), dtype=np.uint8)
+    # the second side is unused: fill it with encoded gap bytes
+    blank = BIT_REVERSE[mfm_encode(np.full(TRACK_BYTES, GAP_BYTE, dtype=np.uint8),
+                                   np.zeros(TRACK_BYTES, dtype=np.uint8))]
+    sides[:, :, 0] = 0x55
+    sides[:, :, 1] = 0x55
+    sides[:, :SIDE_BYTES, 0] = cells
+    sides[:, :SIDE_BYTES, 1] = blank
+    # HFE interleaves the sides in 256 byte halves of each 512 byte block
+    blocks = sides.reshape(layout.TRACK_COUNT, TRACK_BLOCKS, 256, 2).transpose(0, 1, 3, 2)
+    return _header() + _track_list() + blocks.tobytes()
+
+
+# Decoding
+
+
+class HfeError(ValueError):
+    pass
+
+
+# Bit cells of one side of one track, most significant (first) cell first.
+
+
+def _track_cells(hfe, offset, length, side=0):
+    start = offset * BLOCK_SIZE
+    blocks = -(-length // BLOCK_SIZE)
+    data = np.frombuffer(hfe, dtype=np.uint8, count=blocks * BLOCK_SIZE, offset=start)
+    side_data = data.reshape(blocks, 2, BLOCK_SIZE // 2)[:, side, :].reshape(-1)[:length // 2]
+    return np.unpackbits(BIT_REVERSE[side_data])
+
+
+def _decode_bytes(cells, start, count):
+    # data bits are every second cell, after the clock
+    return np.packbits(cells[start + 1:start + 1 + 16 * count:2]).tobytes()
+
+
+# Cell positions of the byte following each A1 A1 A1 address mark. Marks can
+# start at any cell, so the cells are packed into bytes at each of the eight
+# bit offsets and each packing is searched for the six byte mark pattern.
+
+_MARK_BYTES = np.array([SYNC_A1] * 3, dtype='>u2').tobytes()
+
+
+def _address_marks(cells):
+    positions = []
+    for shift in range(8):
+        stream = np.packbits(cells[shift:]).tobytes()
+        position = stream.find(_MARK_BYTES)
+        while position >= 0:
+            positions.append(shift + position * 8 + 48)
+            position = stream.find(_MARK_BYTES, position + len(_MARK_BYTES))
+    return sorted(positions)
+
+
+# Decode the sectors of one track. Returns a dict of (cylinder, sector id)
+# -> sector data for every sector whose ID and data CRCs check out.
+
+
+def decode_track(cells):
+    sectors = {}
+    sync = bytes([0xa1] * 3)
+    header = None
+    for position in _address_marks(cells):
+        mark = _decode_bytes(cells, position, 1)[0]
+        if mark == ID_MARK:
+            field = _decode_bytes(cells, position + 16, 6)
+            if len(field) == 6 and binascii.crc_hqx(sync + bytes([mark]) + field, 0xffff) == 0:
+                header = field
+            else:
+                header = None
+        elif mark in (DATA_MARK, 0xf8) and header is not None:
+            size = 128 << header[3]
+            field = _decode_bytes(cells, position + 16, size + 2)
+            if len(field) == size + 2 and binascii.crc_hqx(sync + bytes([mark]) + field, 0xffff) == 0:
+                sectors[(header[0], header[2])] = field[:size]
+            header = None
+    return sectors
+
+
+# Convert the bytes of an HFE file back to a Mirage disk image. Raises
+# HfeError if a sector is missing or fails its CRC, unless strict is False, in
+# which case missing sectors are left as zeros.
+
+
+@metrics.timed('hfe_to_img')
+def hfe_to_img(hfe, strict=True):
+    view = memoryview(hfe)
+    signature, _, tracks, _, encoding = struct.unpack_from('<8sBBBB', view)
+    if signature != HFE_SIGNATURE:
+        raise HfeError('not an HFE file')
+    if encoding != ISOIBM_MFM_ENCODING:
+        raise HfeError(f'unsupported track encoding {encoding}')
+    track_list = struct.unpack_from('<H', view, 18)[0] * BLOCK_SIZE
+    image = bytearray(layout.IMAGE_SIZE)
+    missing = []
+    sizes = _sector_sizes()
+    for track in range(min(tracks, layout.TRACK_COUNT)):
+        offset, length = struct.unpack_from('<HH', view, track_list + track * 4)
+        sectors = decode_track(_track_cells(view, offset, length))
+        position = track * layout.TRACK_LENGTH
+        for sector, size in enumerate(sizes):
+            data = sectors.get((track, FIRST_SECTOR_ID + sector))
+            if data is None or len(data) != size:
+                missing.append((track, sector))
+            else:
+                image[position:position + size] = data
+            position += size
+    if tracks < layout.TRACK_COUNT:
+        missing.extend((track, sector) for track in range(tracks, layout.TRACK_COUNT) for sector in range(len(sizes)))
+    if missing and strict:
+        raise HfeError(f'{len(missing)} sectors missing or bad, first at track {missing[0][0]} sector {missing[0][1]}')
+    return image
+
+
+def read_hfe(path, strict=True):
+    with open(path, 'rb') as source:
+        return hfe_to_img(source.read(), strict)
+
+
+def write_hfe(image_path, hfe_path):
+    with open(image_path, 'rb') as source:
+        hfe = img_to_hfe(source.read())
+    with open(hfe_path, 'wb') as output:
+        output.write(hfe)
+    return hfe_path
+
+
+def write_img(hfe_path, image_path):
+    image = read_hfe(hfe_path)
+    with open(image_path, 'wb') as output:
+        output.write(image)
+    return image_path
+
+
+def _convert_task(task):
+    path, root, output_root, to_img = task
+    relative = os.path.relpath(path, root)
+    output = os.path.join(output_root, os.path.splitext(relative)[0] + ('.img' if to_img else '.hfe'))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    return write_img(path, output) if to_img else write_hfe(path, output)
+
+
+# Convert every .img under root to .hfe under output_root (or every .hfe to
+# .img with to_img), keeping the folder structure, on a process pool. Returns
+# batch.JobResults.
+
+
+def convert_library(root, output_root, workers=None, to_img=False):
+    tasks = [(path, root, output_root, to_img) for path in batch.find_images(root, ('.hfe',) if to_img else ('.img',))]
+    return sorted(batch.run_jobs(_convert_task, tasks, workers), key=lambda result: result.job[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Mirage .img files to HFE and back.')
+    parser.add_argument('library', help='folder tree of .img (or .hfe) files')
+    parser.add_argument('output', help='folder for the converted files')
+    parser.add_argument('--to-img', action='store_true', help='decode .hfe files to .img')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    results = convert_library(args.library, args.output, args.workers, args.to_img)
+    for result in results:
+        if result.error:
+            print(f'FAILED {result.job[0]}\n{result.error}')
+    failures = [result for result in results if result.error]
+    print(f'converted {len(results) - len(failures)} of {len(results)} images')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
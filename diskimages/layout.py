@@ -0,0 +1,138 @@
+# The Mirage disk layout, computed once. Everything that moves wavesample
+# data in or out of a disk image uses the tables here instead of working out
+# track and sector positions itself.
+#
+# Disk layout: 80 tracks of 5632 bytes. Each track holds five 1024 byte
+# sectors and one 512 byte sector. Six wavesamples (lower and upper half for
+# each of the three sounds) start at tracks 2, 15, 28, 41, 54 and 67. Each
+# spans 13 tracks: a 1024 byte parameter block at the start of the first
+# track, then the wavesample data in the five long sectors of each track. The
+# short sector is skipped.
+import numpy as np
+
+from diskimages import metrics
+
+TRACK_LENGTH = 5632
+TRACK_COUNT = 80
+IMAGE_SIZE = TRACK_COUNT * TRACK_LENGTH
+SECTOR_SIZE = 1024
+SHORT_SECTOR_SIZE = 512
+SECTORS_PER_TRACK = 6
+# bytes of wavesample data per track: the five long sectors
+TRACK_DATA_SIZE = 5 * SECTOR_SIZE
+PARAMETER_SIZE = 1024
+WAVESAMPLE_SIZE = 65536
+WAVESAMPLE_COUNT = 6
+TRACKS_PER_WAVESAMPLE = 13
+# start track for each wavesample, in the order lh1, uh1, lh2, uh2, lh3, uh3
+WAVESAMPLE_TRACKS = (2, 15, 28, 41, 54, 67)
+HALF_NAMES = ('lh1', 'uh1', 'lh2', 'uh2', 'lh3', 'uh3')
+# bytes from the start of a wavesample's first track to the end of its data
+# (72704), i.e. 13 tracks less the final short sector.
+WAVESAMPLE_SPAN = (TRACKS_PER_WAVESAMPLE - 1) * TRACK_LENGTH + TRACK_DATA_SIZE
+
+# the layout as plain data, recorded in build manifests so a layout change
+# invalidates previously built images
+LAYOUT_PARAMETERS = {'track_length': TRACK_LENGTH, 'parameter_size': PARAMETER_SIZE,
+                     'wavesample_size': WAVESAMPLE_SIZE, 'wavesample_tracks': list(WAVESAMPLE_TRACKS)}
+
+
+def _segments():
+    segments = []
+    for half, first in enumerate(WAVESAMPLE_TRACKS):
+        wave_offset = half * WAVESAMPLE_SIZE
+        for track in range(first, first + TRACKS_PER_WAVESAMPLE):
+            # the first track starts with the parameter block
+            skip = PARAMETER_SIZE if track == first else 0
+            length = TRACK_DATA_SIZE - skip
+            segments.append((half, wave_offset, track * TRACK_LENGTH + skip, length))
+            wave_offset += length
+    return tuple(segments)
+
+
+def _image_index():
+    index = np.empty(WAVESAMPLE_COUNT * WAVESAMPLE_SIZE, dtype=np.int32)
+    for half, wave_offset, image_offset, length in SEGMENTS:
+        index[wave_offset:wave_offset + length] = np.arange(image_offset, image_offset + length, dtype=np.int32)
+    index.setflags(write=False)
+    return index
+
+
+# (half, wavesample offset, image offset, length) for each of the 78 runs of
+# wavesample data. Wavesample offsets count through all six wavesamples
+# (6 * 64KB), in the order they are stored in an intermediate wav file.
+SEGMENTS = _segments()
+
+# IMAGE_INDEX[i] is the image offset of byte i of the six wavesamples. It is
+# read only.
+IMAGE_INDEX = _image_index()
+
+# (track, sector, image offset, size) for all 480 sectors on the disk, in disk order
+SECTORS = tuple((track, sector, track * TRACK_LENGTH + sector * SECTOR_SIZE,
+                 SHORT_SECTOR_SIZE if sector == SECTORS_PER_TRACK - 1 else SECTOR_SIZE)
+                for track in range(TRACK_COUNT) for sector in range(SECTORS_PER_TRACK))
+
+# (track, sector) of every sector holding wavesample data (not the parameter block)
+WAVESAMPLE_SECTORS = frozenset((first + x, sector)
+                               for first in WAVESAMPLE_TRACKS for x in range(TRACKS_PER_WAVESAMPLE)
+                               for sector in range(5) if x or sector)
+
+# SEGMENTS split per wavesample, with offsets relative to the wavesample
+HALF_SEGMENTS = tuple(tuple((wave_offset - half * WAVESAMPLE_SIZE, image_offset, length)
+                            for segment_half, wave_offset, image_offset, length in SEGMENTS if segment_half == half)
+                      for half in range(WAVESAMPLE_COUNT))
+
+# offsets of one wavesample relative to the start of its first track
+SPAN_INDEX = IMAGE_INDEX[0:WAVESAMPLE_SIZE] - WAVESAMPLE_TRACKS[0] * TRACK_LENGTH
+SPAN_INDEX.setflags(write=False)
+
+
+def half_index(half):
+    # image offsets of one wavesample, as a read only view of IMAGE_INDEX
+    return IMAGE_INDEX[half * WAVESAMPLE_SIZE:(half + 1) * WAVESAMPLE_SIZE]
+
+
+def segments(half):
+    # the runs making up one wavesample as (wavesample offset, image offset,
+    # length), with offsets relative to that wavesample
+    return HALF_SEGMENTS[half]
+
+
+def _as_array(buffer):
+    return np.frombuffer(buffer, dtype=np.uint8)
+
+
+# Scatter all six wavesamples (6 * 64KB, intermediate wav order) into a disk
+# image buffer in one pass. image must be writable.
+
+
+@metrics.timed('layout_pack')
+def pack(image, wavesamples):
+    source = _as_array(wavesamples)
+    if len(source) != len(IMAGE_INDEX):
+        raise ValueError(f'wavesample data is {len(source)} bytes, expected {len(IMAGE_INDEX)}')
+    _as_array(image)[IMAGE_INDEX] = source
+
+
+# Gather all six wavesamples out of a disk image in one pass. Returns out,
+# allocating a 6 * 64KB bytearray if none is given.
+
+
+@metrics.timed('layout_unpack')
+def unpack(image, out=None):
+    if out is None:
+        out = bytearray(len(IMAGE_INDEX))
+    np.take(_as_array(image), IMAGE_INDEX, out=_as_array(out))
+    return out
+
+
+# Gather one wavesample from a buffer that starts at the wavesample's first
+# track (WAVESAMPLE_SPAN bytes, as cut out by older code) rather than at the
+# start of the image.
+
+
+def unpack_span(span, out=None):
+    if out is None:
+        out = bytearray(WAVESAMPLE_SIZE)
+    np.take(_as_array(span), SPAN_INDEX, out=_as_array(out))
+    return out
@@ -0,0 +1,214 @@
+# In-memory sample library. N wavesamples live in one contiguous (N, 64KB)
+# uint8 array, with a small __slots__ record per wavesample saying where it
+# came from. Library wide jobs (extracting a folder of images, hashing,
+# verifying, normalizing, resampling, building images) then work on the
+# whole array in a few NumPy calls instead of opening and allocating once
+# per file.
+#
+# A library is saved as a single pack file: a short JSON header with the
+# records, then the sample array, page aligned so it can be memory-mapped
+# back without reading it.
+#
+#   library = SampleLibrary.from_images(batch.find_images('mirage_ready'))
+#   library.save('library.pack')
+#   library = SampleLibrary.load('library.pack')     # memory-mapped
+#   library.write_images(template, 'out')
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from diskimages import batch
+from diskimages import layout
+from diskimages import resample
+from diskimages import riff
+from diskimages import samplestore
+
+MAGIC = b'MIRAGELIB1'
+# the sample array starts on a multiple of this
+ALIGN = 4096
+# silence in unsigned 8 bit PCM, used to pad short samples
+SILENCE = 128
+# wavesamples processed at once by normalize
+CHUNK = 256
+
+
+class SampleRecord:
+    __slots__ = ('name', 'source', 'half', 'length', 'digest')
+
+    def __init__(self, name, source=None, half=None, length=layout.WAVESAMPLE_SIZE, digest=None):
+        self.name = name
+        self.source = source
+        self.half = half
+        self.length = length
+        self.digest = digest
+
+    def as_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self):
+        return f'SampleRecord({self.name!r}, {self.source!r}, {self.half!r}, {self.length}, {self.digest!r})'
+
+
+class SampleLibrary:
+
+    def __init__(self, data=None, records=None):
+        self.data = np.zeros((0, layout.WAVESAMPLE_SIZE), dtype=np.uint8) if data is None else data
+        self.records = records if records is not None else [SampleRecord(str(index)) for index in range(len(self.data))]
+        if len(self.records) != len(self.data):
+            raise ValueError(f'{len(self.records)} records for {len(self.data)} wavesamples')
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    # All six wavesamples of every image (.img or .hfe), lh1 ... uh3 per image.
+
+    @classmethod
+    def from_images(cls, paths):
+        data = np.empty((len(paths) * layout.WAVESAMPLE_COUNT, layout.WAVESAMPLE_SIZE), dtype=np.uint8)
+        records = []
+        for number, path in enumerate(paths):
+            rows = data[number * layout.WAVESAMPLE_COUNT:(number + 1) * layout.WAVESAMPLE_COUNT]
+            with batch.open_image(path) as image:
+                image.read_wavesamples(rows.reshape(-1))
+            stub = os.path.splitext(os.path.basename(path))[0]
+            records.extend(SampleRecord(f'{stub}_{half_name}', path, half_name) for half_name in layout.HALF_NAMES)
+        return cls(data, records)
+
+    # Sample files of up to 64KB: raw unsigned 8 bit PCM, or WAV files (wider
+    # formats are converted). Shorter samples are padded with silence.
+
+    @classmethod
+    def from_files(cls, paths):
+        data = np.full((len(paths), layout.WAVESAMPLE_SIZE), SILENCE, dtype=np.uint8)
+        records = []
+        for row, path in enumerate(paths):
+            sample = riff.read_sample(path)
+            if len(sample) > layout.WAVESAMPLE_SIZE:
+                raise ValueError(f'{path} is {len(sample)} bytes, more than a 64KB wavesample')
+            data[row, :len(sample)] = np.frombuffer(sample, dtype=np.uint8)
+            records.append(SampleRecord(os.path.splitext(os.path.basename(path))[0], path, length=len(sample)))
+        return cls(data, records)
+
+    # Pack file: MAGIC, header length (uint32), JSON header, padding, data.
+
+    def save(self, path):
+        header = json.dumps({'count': len(self), 'records': [record.as_dict() for record in self.records]}).encode()
+        offset = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+        with open(path, 'wb') as output:
+            output.write(MAGIC + struct.pack('<I', len(header)) + header)
+            output.write(bytes(offset - output.tell()))
+            output.write(np.ascontiguousarray(self.data).data)
+
+    # Load a pack file. By default the samples are memory-mapped read only;
+    # mode='r+' maps them writable and mode=None reads them into memory.
+
+    @classmethod
+    def load(cls, path, mode='r'):
+        with open(path, 'rb') as source:
+            if source.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a sample library pack file')
+            size, = struct.unpack('<I', source.read(4))
+            header = json.loads(source.read(size))
+            offset = -(-(len(MAGIC) + 4 + size) // ALIGN) * ALIGN
+            shape = (header['count'], layout.WAVESAMPLE_SIZE)
+            if mode is None:
+                source.seek(offset)
+                data = np.fromfile(source, dtype=np.uint8, count=shape[0] * shape[1]).reshape(shape)
+        if mode is not None:
+            data = np.memmap(path, dtype=np.uint8, mode=mode, offset=offset, shape=shape) if shape[0] else \
+                np.zeros(shape, dtype=np.uint8)
+        return cls(data, [SampleRecord(**record) for record in header['records']])
+
+    # Hashes of every wavesample (the same ones samplestore uses). With
+    # record=True they are also kept in the records for verify.
+
+    def hashes(self, record=False):
+        digests = [samplestore.wavesample_hash(row) for row in self.data]
+        if record:
+            for entry, digest in zip(self.records, digests):
+                entry.digest = digest
+        return digests
+
+    # Indices of wavesamples whose hash no longer matches their record.
+
+    def verify(self):
+        return [index for index, (entry, row) in enumerate(zip(self.records, self.data))
+                if entry.digest is not None and samplestore.wavesample_hash(row) != entry.digest]
+
+    # Groups of indices holding identical wavesamples. Rows are compared by a
+    # short hash first, then byte for byte within a group.
+
+    def duplicates(self):
+        groups = {}
+        for index, row in enumerate(self.data):
+            groups.setdefault(hashlib.blake2b(row, digest_size=8).digest(), []).append(index)
+        found = []
+        for indices in groups.values():
+            while len(indices) > 1:
+                same = [index for index in indices if np.array_equal(self.data[index], self.data[indices[0]])]
+                if len(same) > 1:
+                    found.append(same)
+                indices = [index for index in indices if index not in same]
+        return found
+
+    # Put every wavesample in a WavesampleStore. Returns the hashes.
+
+    def add_to_store(self, store):
+        return [store.put(row, entry.source or entry.name, entry.half) for entry, row in zip(self.records, self.data)]
+
+    # Scale every wavesample so its peak reaches full scale, in place. Rows
+    # are done CHUNK at a time so the temporaries stay small, however big
+    # (or memory-mapped) the library is.
+
+    def normalize(self):
+        for first in range(0, len(self), CHUNK):
+            rows = self.data[first:first + CHUNK]
+            centred = rows.astype(np.float32) - 128
+            peaks = np.abs(centred).max(axis=1, keepdims=True)
+            centred *= np.where(peaks > 0, 127 / np.maximum(peaks, 1), 1)
+            rows[:] = np.clip(np.rint(centred) + 128, 0, 255).astype(np.uint8)
+
+    # Resample every wavesample in one batch, in place. The result is cut or
+    # padded with silence to 64KB and each record's length updated.
+
+    def resample(self, src_rate, dst_rate, quality='medium'):
+        converted = resample.resample_8bit(self.data, src_rate, dst_rate, quality)
+        width = min(layout.WAVESAMPLE_SIZE, converted.shape[1])
+        self.data[:, :width] = converted[:, :width]
+        self.data[:, width:] = SILENCE
+        for entry in self.records:
+            entry.length = min(layout.WAVESAMPLE_SIZE, int(entry.length * dst_rate // src_rate))
+
+    # Disk images of the library, six wavesamples each in order, built from
+    # a template. One image buffer is reused: each image is the template with
+    # its six rows scattered in, and the buffer is only good until the next
+    # one, so copy it to keep it. A last partial image keeps the template's
+    # wavesamples in its unused halves.
+
+    def iter_images(self, template):
+        image = bytearray(template)
+        buffer = np.frombuffer(image, dtype=np.uint8)
+        for first in range(0, len(self), layout.WAVESAMPLE_COUNT):
+            rows = self.data[first:first + layout.WAVESAMPLE_COUNT].reshape(-1)
+            if len(rows) < len(layout.IMAGE_INDEX):
+                image[:] = template
+            buffer[layout.IMAGE_INDEX[:len(rows)]] = rows
+            yield image
+
+    # Write the images to a folder as name_1.img, name_2.img ... Returns the paths.
+
+    def write_images(self, template, folder, name='library'):
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for number, image in enumerate(self.iter_images(template), 1):
+            path = os.path.join(folder, f'{name}_{number}.img')
+            with open(path, 'wb') as output:
+                output.write(image)
+            paths.append(path)
+        return paths
@@ -0,0 +1,191 @@
+# Loop point analysis for wavesamples. A loop plays [start, end) and then
+# jumps back to start, and it is click free when the audio just before end
+# looks like the audio just before start. Candidate points are upward zero
+# crossings (or page boundaries, since the Mirage stores loop points in 256
+# byte pages). Every end candidate is scored against every start candidate
+# at once, as a matrix of normalized correlations of the windows before them,
+# and the best pair wins.
+#
+# find_loops runs this over the waveform slots of a buffer, analyze_image
+# over the wavesamples of an image (as listed in its parameter blocks) and
+# analyze_library over a folder tree on the process pool. wavesample_entries
+# and write_loops turn the results into parameter block entries, and
+# MirageDiskManager.create_packed_disk_images can use them for packed images.
+#
+# usage: python -m diskimages.loops LIBRARY [--pages] [--workers N]
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from diskimages import batch
+from diskimages import layout
+from diskimages import parameters
+
+# samples compared before each loop point
+WINDOW = 64
+# most start and end points tried per waveform
+CANDIDATES = 48
+MIN_LENGTH = parameters.PAGE_SIZE
+
+Loop = namedtuple('Loop', ['start', 'end', 'score'])
+
+
+def _centred(sample):
+    return np.frombuffer(sample, dtype=np.uint8).astype(np.float32) - 128
+
+
+# Indices of the upward zero crossings of unsigned 8 bit PCM: the first
+# sample at or above the midpoint after one below it.
+
+
+def zero_crossings(sample):
+    values = _centred(sample)
+    return np.flatnonzero((values[:-1] < 0) & (values[1:] >= 0)) + 1
+
+
+def _windows(values, points, window):
+    rows = values[points[:, None] + np.arange(-window, 0)]
+    rows -= rows.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows / np.maximum(norms, 1e-6), norms[:, 0]
+
+
+def _spread(points, count):
+    if len(points) <= count:
+        return points
+    return points[np.linspace(0, len(points) - 1, count).round().astype(np.int64)]
+
+
+# Best loop of a waveform (a buffer of unsigned 8 bit PCM), or None if it is
+# too short to have one. End candidates come from the second half of the
+# waveform, so loops are long; starts are spread over everything at least
+# min_length before. With pages both points are multiples of 256.
+
+
+def find_loop(sample, window=WINDOW, candidates=CANDIDATES, min_length=MIN_LENGTH, pages=False):
+    values = _centred(sample)
+    if pages:
+        points = np.arange(parameters.PAGE_SIZE, len(values) + 1, parameters.PAGE_SIZE)
+    else:
+        points = zero_crossings(sample)
+    points = points[points >= window]
+    ends = points[points >= len(values) // 2][-candidates:]
+    starts = _spread(points[points <= (ends[-1] if len(ends) else 0) - min_length], candidates)
+    if not len(ends) or not len(starts):
+        return None
+    end_windows, end_levels = _windows(values, ends, window)
+    start_windows, start_levels = _windows(values, starts, window)
+    scores = end_windows @ start_windows.T
+    # a silent window correlates with nothing; count two silent windows as a match
+    silent = (end_levels[:, None] < 1e-3) & (start_levels[None, :] < 1e-3)
+    scores[silent] = 1.0
+    scores[ends[:, None] - starts[None, :] < min_length] = -np.inf
+    best = np.unravel_index(np.argmax(scores), scores.shape)
+    if not np.isfinite(scores[best]):
+        return None
+    return Loop(int(starts[best[1]]), int(ends[best[0]]), float(scores[best]))
+
+
+# Best loops of the waveform slots of a buffer, slots being (offset, length)
+# pairs such as packing placements. Loop points are relative to each slot.
+
+
+def find_loops(buffer, slots, **options):
+    view = memoryview(buffer)
+    return [find_loop(view[offset:offset + length], **options) for offset, length in slots]
+
+
+# Slots of the wavesamples in use in each half of an image, from its
+# parameter blocks. A half with an empty wavesample table is one slot.
+
+
+def image_slots(image):
+    slots = []
+    for half in range(layout.WAVESAMPLE_COUNT):
+        base = half * layout.WAVESAMPLE_SIZE
+        wavesamples = parameters.decode(image.parameter_block(half))['wavesamples']
+        if not wavesamples:
+            slots.append((half, 0, base, layout.WAVESAMPLE_SIZE))
+        for entry, wavesample in enumerate(wavesamples):
+            start = min(wavesample['start'], layout.WAVESAMPLE_SIZE)
+            end = min(wavesample['end'] + parameters.PAGE_SIZE, layout.WAVESAMPLE_SIZE)
+            if end > start:
+                slots.append((half, entry, base + start, end - start))
+    return slots
+
+
+# Loops of every wavesample of an image file, as (half, table entry, Loop).
+
+
+def analyze_image(path, pages=False):
+    with batch.open_image(path) as image:
+        wavesamples = image.read_wavesamples()
+        slots = image_slots(image)
+    loops = find_loops(wavesamples, [(offset, length) for _, _, offset, length in slots], pages=pages)
+    return [(half, entry, loop) for (half, entry, _, _), loop in zip(slots, loops)]
+
+
+def _analyze_task(task):
+    path, pages = task
+    return analyze_image(path, pages)
+
+
+def analyze_library(root, workers=None, pages=False):
+    tasks = [(path, pages) for path in batch.find_images(root, ('.img', '.hfe'))]
+    return sorted(batch.run_jobs(_analyze_task, tasks, workers), key=lambda result: result.job[0])
+
+
+# Parameter block entries for packed samples: for every (image, half) the
+# wavesample table entries of its samples in offset order, with loops (found
+# with pages=True, samples packed with align=PAGE_SIZE) switched on.
+
+
+def wavesample_entries(placements, loops):
+    tables = {}
+    for placement, loop in sorted(zip(placements, loops), key=lambda pair: pair[0].offset):
+        first = placement.offset // parameters.PAGE_SIZE
+        entry = {'start_page': first,
+                 'end_page': (placement.offset + max(placement.length, 1) - 1) // parameters.PAGE_SIZE,
+                 'loop_on': 0}
+        if loop is not None:
+            entry.update(loop_start_page=first + loop.start // parameters.PAGE_SIZE,
+                         loop_end_page=first + loop.end // parameters.PAGE_SIZE - 1, loop_on=1)
+        tables.setdefault((placement.image, placement.half), []).append(entry)
+    return tables
+
+
+# Write wavesample table entries into a half of an image (a writable
+# MirageDiskImage). Unused entries are cleared; the program settings are
+# kept. This writes through the experimental parameters layout, so it is only
+# called when a build asks for tables (create_packed_disk_images write_tables).
+
+
+def write_loops(image, half, entries):
+    empty = dict.fromkeys(parameters.WAVESAMPLE_FIELDS, 0)
+    table = [{**empty, **entry} for entry in entries] + [empty] * (parameters.WAVESAMPLES_PER_HALF - len(entries))
+    parameters.encode(wavesamples=table, block=image.parameter_block(half), experimental=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find loop points in Mirage wavesamples.')
+    parser.add_argument('library', help='folder tree of .img or .hfe files')
+    parser.add_argument('--pages', action='store_true', help='only loop on 256 byte page boundaries')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    failures = 0
+    for result in analyze_library(args.library, args.workers, args.pages):
+        if result.error:
+            failures += 1
+            print(f'FAILED {result.job[0]}\n{result.error}')
+            continue
+        for half, entry, loop in result.value:
+            if loop is not None:
+                print(f'{result.job[0]} {layout.HALF_NAMES[half]} wavesample {entry + 1}: '
+                      f'loop {loop.start}-{loop.end} score {loop.score:.3f}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
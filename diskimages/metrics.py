@@ -0,0 +1,159 @@
+# Counters and stage timers for the image tools. Counters add up bytes,
+# images and samples; timers add up calls and seconds per stage. Both are
+# off by default, and while off a counter is one flag check and a timer
+# hands back a shared do-nothing context, so instrumented code costs close to
+# nothing in normal runs.
+#
+# Values can be exported as JSON or Prometheus text, and profile() wraps a
+# block in cProfile. Worker processes send their values back with each job
+# result (see batch.run_jobs), so totals cover the whole batch.
+#
+#   metrics.enable()
+#   with metrics.timer('create_disk_image'):
+#       ...
+#   metrics.count('bytes_written', len(data))
+#   print(metrics.to_prometheus())
+import cProfile
+import contextlib
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+from functools import wraps
+
+PREFIX = 'mirage'
+
+enabled = False
+_counters = {}
+# stage -> [calls, seconds]
+_timers = {}
+_lock = threading.Lock()
+_null = contextlib.nullcontext()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def count(name, amount=1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def add_time(name, seconds, calls=1):
+    with _lock:
+        timer = _timers.setdefault(name, [0, 0.0])
+        timer[0] += calls
+        timer[1] += seconds
+
+
+def timer(name):
+    return _Timer(name) if enabled else _null
+
+
+# Decorator form of timer, timing every call of a function as a stage.
+
+
+def timed(name):
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    with _lock:
+        return {'counters': dict(_counters),
+                'timers': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in _timers.items()}}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+# Add a snapshot (e.g. from a worker process) to the totals.
+
+
+def merge(values):
+    with _lock:
+        for name, amount in values['counters'].items():
+            _counters[name] = _counters.get(name, 0) + amount
+        for name, timing in values['timers'].items():
+            timer = _timers.setdefault(name, [0, 0.0])
+            timer[0] += timing['calls']
+            timer[1] += timing['seconds']
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=1, sort_keys=True)
+
+
+def to_prometheus(prefix=PREFIX):
+    values = snapshot()
+    lines = []
+    for name, amount in sorted(values['counters'].items()):
+        lines.append(f'# TYPE {prefix}_{name}_total counter')
+        lines.append(f'{prefix}_{name}_total {amount}')
+    if values['timers']:
+        lines.append(f'# TYPE {prefix}_stage_calls_total counter')
+        for name, timing in sorted(values['timers'].items()):
+            lines.append(f'{prefix}_stage_calls_total{{stage="{name}"}} {timing["calls"]}')
+        lines.append(f'# TYPE {prefix}_stage_seconds_total counter')
+        for name, timing in sorted(values['timers'].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {timing["seconds"]:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+# Write the metrics to a file: Prometheus text for .prom or .txt, else JSON.
+
+
+def save(path):
+    text = to_prometheus() if path.endswith(('.prom', '.txt')) else to_json()
+    with open(path, 'w') as output:
+        output.write(text)
+
+
+# Profile a block with cProfile. The stats are dumped to path (for pstats or
+# snakeviz) if given, and the top entries are logged at INFO.
+
+
+@contextlib.contextmanager
+def profile(path=None, sort='cumulative', limit=25):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats(sort).print_stats(limit)
+        logging.info(report.getvalue())
@@ -0,0 +1,195 @@
+# Declarative wavesample packing. A packing scheme says how source tables
+# are laid out in the 6 * 64KB intermediate buffer, as a tuple of Rules:
+#
+#   Rule(source, length=None, chunk_size=None, repeat=1, halves=None, offset=0)
+#
+# source is an index into the list of sources. The first length bytes of it
+# (all of it by default) are cut into chunk_size pieces (one piece by
+# default) and each piece is written repeat times in a row. With halves the
+# result is written offset bytes into each listed half (0-5); without, it
+# goes at a cursor that carries on from the previous rule without halves.
+#
+# compile_plan turns a scheme into a flat tuple of Copy operations once, and
+# execute runs them as memoryview block copies from sources that were each
+# read once.
+#
+# plan_halves is the other way round: given samples of any length it decides
+# where they go, up to 8 per half (the Mirage multisample limit), over as few
+# halves and therefore images as it can, and pack_images emits the buffers.
+import bisect
+from collections import namedtuple
+from functools import lru_cache
+
+from diskimages import layout
+from diskimages import parameters
+
+BUFFER_SIZE = layout.WAVESAMPLE_COUNT * layout.WAVESAMPLE_SIZE
+
+# most wavesamples (multisamples) the Mirage can split one half into
+MAX_PER_HALF = 8
+# wavesample tables give start and end in 256 byte pages, so samples start
+# on page boundaries unless asked otherwise
+ALIGN = parameters.PAGE_SIZE
+
+Rule = namedtuple('Rule', ['source', 'length', 'chunk_size', 'repeat', 'halves', 'offset'],
+                  defaults=(None, None, 1, None, 0))
+Copy = namedtuple('Copy', ['source', 'start', 'destination', 'length'])
+Placement = namedtuple('Placement', ['source', 'image', 'half', 'offset', 'length'])
+
+
+# Compile a scheme for sources of the given lengths. The plan only depends on
+# the scheme and the lengths, so it is cached. Raises ValueError if the
+# scheme writes past the end of the buffer, or a rule with halves past the end
+# of one of its halves.
+
+
+@lru_cache(maxsize=64)
+def compile_plan(rules, source_lengths, size=BUFFER_SIZE):
+    copies = []
+    cursor = 0
+    for rule in rules:
+        length = source_lengths[rule.source]
+        if rule.length is not None:
+            length = min(length, rule.length)
+        chunk_size = rule.chunk_size or length
+        chunks = [(offset, min(chunk_size, length - offset)) for offset in range(0, length, chunk_size or 1)]
+        if rule.halves is not None:
+            starts = [(half * layout.WAVESAMPLE_SIZE + rule.offset, (half + 1) * layout.WAVESAMPLE_SIZE, f'half {half}')
+                      for half in rule.halves]
+        else:
+            starts = [(cursor, size, 'the buffer')]
+        for position, end, target in starts:
+            for offset, chunk_length in chunks:
+                for _ in range(rule.repeat):
+                    copies.append(Copy(rule.source, offset, position, chunk_length))
+                    position += chunk_length
+            if position > min(end, size):
+                raise ValueError(f'packing rule {rule} writes {position - min(end, size)} bytes past the end of '
+                                 f'{target}')
+            if rule.halves is None:
+                cursor = position
+    return tuple(_merge(copies))
+
+
+def _merge(copies):
+    # join copies that continue each other in both source and destination
+    merged = []
+    for copy in copies:
+        if merged:
+            last = merged[-1]
+            if last.source == copy.source and last.start + last.length == copy.start \
+                    and last.destination + last.length == copy.destination:
+                merged[-1] = last._replace(length=last.length + copy.length)
+                continue
+        merged.append(copy)
+    return merged
+
+
+# Run a plan. sources are buffers (bytes, bytearray, memoryview ...). Returns
+# output, a zero filled 6 * 64KB bytearray unless one is given.
+
+
+def execute(plan, sources, output=None):
+    if output is None:
+        output = bytearray(BUFFER_SIZE)
+    target = memoryview(output)
+    views = [memoryview(source) for source in sources]
+    for copy in plan:
+        source = views[copy.source][copy.start:copy.start + copy.length]
+        target[copy.destination:copy.destination + copy.length] = source
+    return output
+
+
+def pack(rules, sources, output=None):
+    plan = compile_plan(tuple(rules), tuple(len(source) for source in sources))
+    return execute(plan, sources, output)
+
+
+# Assign samples of the given lengths to halves, at most max_per_half per
+# half. Two greedy plans are made and the one using fewer halves is kept:
+#
+# - best fit decreasing: largest sample first, each into the fullest half it
+#   still fits. Close to optimal when space is what runs out.
+# - balanced: one half at a time, opened with the largest sample left and
+#   filled with samples near the average size the remaining slots allow. Does
+#   better when the 8 sample limit is what runs out.
+#
+# Halves are numbered in order and filled six to an image. Every sample
+# starts on a multiple of align bytes, by default a page, so the wavesample
+# tables can point at it. Returns one Placement per sample, in
+# the order of lengths. Samples longer than a half raise ValueError.
+
+
+def plan_halves(lengths, capacity=layout.WAVESAMPLE_SIZE, max_per_half=MAX_PER_HALF, align=ALIGN):
+    slots = [-(-length // align) * align for length in lengths]
+    for source, length in enumerate(slots):
+        if length > capacity:
+            raise ValueError(f'sample {source} is {length} bytes, more than the {capacity} bytes of a half')
+    halves = min(_best_fit(slots, capacity, max_per_half), _balanced(slots, capacity, max_per_half), key=len)
+    placements = [None] * len(lengths)
+    for number, sources in enumerate(halves):
+        offset = 0
+        for source in sources:
+            placements[source] = Placement(source, number // layout.WAVESAMPLE_COUNT,
+                                           number % layout.WAVESAMPLE_COUNT, offset, lengths[source])
+            offset += slots[source]
+    return placements
+
+
+def _best_fit(lengths, capacity, max_per_half):
+    halves = []
+    # (space left, half number) of halves that can take another sample, sorted
+    open_halves = []
+    for source in sorted(range(len(lengths)), key=lambda index: -lengths[index]):
+        length = lengths[source]
+        position = bisect.bisect_left(open_halves, (length, -1))
+        if position < len(open_halves):
+            space, number = open_halves.pop(position)
+        else:
+            space, number = capacity, len(halves)
+            halves.append([])
+        halves[number].append(source)
+        if len(halves[number]) < max_per_half and space > length:
+            bisect.insort(open_halves, (space - length, number))
+    return halves
+
+
+def _balanced(lengths, capacity, max_per_half):
+    halves = []
+    # (length, source) of samples not placed yet, sorted
+    remaining = sorted((length, source) for source, length in enumerate(lengths))
+    end = len(lengths)
+    while remaining:
+        length, source = remaining.pop()
+        half = [source]
+        space = capacity - length
+        while len(half) < max_per_half and remaining:
+            largest = bisect.bisect_right(remaining, (space, end)) - 1
+            if largest < 0:
+                break
+            slots = max_per_half - len(half)
+            position = largest if slots == 1 else min(bisect.bisect_left(remaining, (space / slots, -1)), largest)
+            length, source = remaining.pop(position)
+            half.append(source)
+            space -= length
+        halves.append(half)
+    return halves
+
+
+# Packing schemes for placements, one per image.
+
+
+def image_schemes(placements):
+    schemes = [[] for _ in range(max((placement.image for placement in placements), default=-1) + 1)]
+    for placement in sorted(placements, key=lambda placement: (placement.image, placement.half, placement.offset)):
+        schemes[placement.image].append(Rule(placement.source, halves=(placement.half,), offset=placement.offset))
+    return [tuple(scheme) for scheme in schemes]
+
+
+# Plan and pack samples into as few 6 * 64KB buffers as they fit. Returns
+# the buffers and the placements.
+
+
+def pack_images(samples, max_per_half=MAX_PER_HALF, align=ALIGN):
+    placements = plan_halves([len(sample) for sample in samples], max_per_half=max_per_half, align=align)
+    return [pack(scheme, samples) for scheme in image_schemes(placements)], placements
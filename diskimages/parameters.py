@@ -0,0 +1,155 @@
+# Decoder for the 1024 byte sound parameter block at the start of each
+# wavesample half. The block holds the half's program settings (sampling
+# period, filter and amplitude envelopes, filter and LFO) and a table of up
+# to 8 wavesamples (multisamples), each with its start and end page, loop
+# points and top key (the split point).
+#
+# The layout is described as data in PROGRAM_FIELDS and WAVESAMPLE_FIELDS
+# and compiled to a NumPy structured dtype, so one block or a whole library
+# of blocks decodes in a single frombuffer.
+#
+# EXPERIMENTAL: the offsets follow the published Mirage parameter lists but
+# have not yet been checked against a block from a real template or sound
+# disk. Until they are, treat the decoded values as a best guess and the
+# module as read-only: encode only writes into an existing block when called
+# with experimental=True. If a disk decodes oddly, fix the tables.
+#
+# Pages are 256 bytes; a 64KB half holds 256 of them.
+import numpy as np
+
+from diskimages import layout
+
+PAGE_SIZE = 256
+WAVESAMPLES_PER_HALF = 8
+# the Mirage default sampling period, 34us, is 29411Hz
+DEFAULT_PERIOD = 34
+
+# name -> (offset, NumPy type)
+PROGRAM_FIELDS = {
+    'sample_period': (0x00, 'u1'),
+    'filter_attack': (0x10, 'u1'),
+    'filter_peak': (0x11, 'u1'),
+    'filter_decay': (0x12, 'u1'),
+    'filter_sustain': (0x13, 'u1'),
+    'filter_release': (0x14, 'u1'),
+    'amp_attack': (0x15, 'u1'),
+    'amp_peak': (0x16, 'u1'),
+    'amp_decay': (0x17, 'u1'),
+    'amp_sustain': (0x18, 'u1'),
+    'amp_release': (0x19, 'u1'),
+    'filter_cutoff': (0x1a, 'u1'),
+    'filter_resonance': (0x1b, 'u1'),
+    'lfo_speed': (0x1c, 'u1'),
+    'lfo_depth': (0x1d, 'u1'),
+}
+
+# The wavesample table: WAVESAMPLES_PER_HALF entries of WAVESAMPLE_STRIDE
+# bytes from WAVESAMPLE_TABLE. Offsets are within an entry.
+WAVESAMPLE_TABLE = 0x40
+WAVESAMPLE_STRIDE = 0x10
+WAVESAMPLE_FIELDS = {
+    'start_page': (0x0, 'u1'),
+    'end_page': (0x1, 'u1'),
+    'loop_start_page': (0x2, 'u1'),
+    'loop_end_page': (0x3, 'u1'),
+    'loop_fine': (0x4, 'u1'),
+    'loop_on': (0x5, 'u1'),
+    'top_key': (0x6, 'u1'),
+    'relative_tune': (0x7, 'i1'),
+    'fine_tune': (0x8, 'i1'),
+}
+
+
+def _dtype(fields, itemsize):
+    names = list(fields)
+    return np.dtype({'names': names, 'formats': [fields[name][1] for name in names],
+                     'offsets': [fields[name][0] for name in names], 'itemsize': itemsize})
+
+
+WAVESAMPLE_DTYPE = _dtype(WAVESAMPLE_FIELDS, WAVESAMPLE_STRIDE)
+BLOCK_DTYPE = np.dtype({
+    'names': list(PROGRAM_FIELDS) + ['wavesamples'],
+    'formats': [PROGRAM_FIELDS[name][1] for name in PROGRAM_FIELDS] + [(WAVESAMPLE_DTYPE, WAVESAMPLES_PER_HALF)],
+    'offsets': [PROGRAM_FIELDS[name][0] for name in PROGRAM_FIELDS] + [WAVESAMPLE_TABLE],
+    'itemsize': layout.PARAMETER_SIZE,
+})
+
+
+# Decode any number of parameter blocks at once. data is a buffer of
+# n * 1024 bytes; returns a structured array of n BLOCK_DTYPE records.
+
+
+def decode_blocks(data):
+    view = memoryview(data).cast('B')
+    if len(view) % layout.PARAMETER_SIZE:
+        raise ValueError(f'parameter data is {len(view)} bytes, not a multiple of {layout.PARAMETER_SIZE}')
+    return np.frombuffer(view, dtype=BLOCK_DTYPE)
+
+
+# Sample rate in Hz from the sampling period in microseconds. Works on single
+# values and arrays; a period of 0 (an empty block) counts as the default.
+
+
+def sample_rate(period):
+    period = np.asarray(period, dtype=np.float64)
+    return 1e6 / np.where(period > 0, period, DEFAULT_PERIOD)
+
+
+def period_for_rate(rate):
+    return int(min(255, max(1, round(1e6 / rate))))
+
+
+# Decode one block into plain Python values: the program fields, the sample
+# rate and the list of wavesamples in use (those with an end page). Page
+# numbers also come as byte offsets into the 64KB half.
+
+
+def decode(block):
+    record = decode_blocks(block)[0]
+    values = {name: int(record[name]) for name in PROGRAM_FIELDS}
+    values['sample_rate'] = float(sample_rate(record['sample_period']))
+    wavesamples = []
+    for entry in record['wavesamples']:
+        if entry['end_page'] == 0:
+            continue
+        wavesample = {name: int(entry[name]) for name in WAVESAMPLE_FIELDS}
+        wavesample['loop_on'] = bool(entry['loop_on'])
+        for name in ('start', 'end', 'loop_start', 'loop_end'):
+            wavesample[name] = int(entry[name + '_page']) * PAGE_SIZE
+        wavesamples.append(wavesample)
+    values['wavesamples'] = wavesamples
+    return values
+
+
+# Write fields into a block, returning it (a new zeroed block if none is
+# given). program is {field: value}; wavesamples is a list of up to 8
+# {field: value} dicts for table entries 0, 1 ... Fields not given keep
+# their current value. The layout is unverified, so writing into an existing
+# block (one taken from an image) needs experimental=True.
+
+
+def encode(program=None, wavesamples=(), block=None, experimental=False):
+    if block is None:
+        block = bytearray(layout.PARAMETER_SIZE)
+    elif not experimental:
+        raise ValueError('the parameter block layout is unverified; pass experimental=True to write into a block')
+    record = np.frombuffer(block, dtype=BLOCK_DTYPE)[0]
+    for name, value in (program or {}).items():
+        if name not in PROGRAM_FIELDS:
+            raise KeyError(f'unknown program field {name}')
+        record[name] = value
+    if len(wavesamples) > WAVESAMPLES_PER_HALF:
+        raise ValueError(f'{len(wavesamples)} wavesamples, at most {WAVESAMPLES_PER_HALF} fit in a half')
+    for entry, fields in zip(record['wavesamples'], wavesamples):
+        for name, value in fields.items():
+            if name not in WAVESAMPLE_FIELDS:
+                raise KeyError(f'unknown wavesample field {name}')
+            entry[name] = value
+    return block
+
+
+# The six decoded parameter blocks of an image (a MirageDiskImage).
+
+
+def image_parameters(image):
+    return [decode(image.parameter_block(half)) for half in range(layout.WAVESAMPLE_COUNT)]
@@ -0,0 +1,287 @@
+# In place patches of existing disk images. Changing one wavesample or
+# parameter block no longer means rebuilding the image from its template:
+# a patch is a list of (image offset, data) ranges, and only the ranges whose
+# bytes actually change are written, with positioned writes (os.pwrite, or
+# seek and write where it is missing).
+#
+# Each image is patched atomically. Before anything is written the bytes
+# about to be overwritten are saved to a journal next to the image
+# (name.img.journal), written to a temporary file, synced and renamed into
+# place, so a journal exists only once it is complete. The journal is removed
+# once the image is synced. If a write fails the image is rolled back at
+# once; if the process dies, recover (called before every patch, or from the
+# command line) rolls it back from the journal next time.
+#
+# Patches are built with half_patches, sector_patch and parameter_patch, or
+# ParameterEdit to change some parameter fields and keep the rest, and
+# applied to one image with apply_patches or to many with patch_images.
+# ParameterEdit goes through the unverified parameters layout and is refused
+# unless made with experimental=True (--experimental on the command line).
+#
+# usage: python -m diskimages.patch IMAGE... [--half lh1 (--wavesample FILE | --parameters FILE)]
+#        [--period N --experimental] [--recover] [--workers N]
+import argparse
+import bisect
+import os
+import struct
+import sys
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from diskimages import batch
+from diskimages import layout
+from diskimages import metrics
+from diskimages import parameters
+
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_MAGIC = b'MIRAGEJ1'
+# changed bytes this close together are written as one range; rewriting a
+# few unchanged bytes is cheaper than another write
+GAP = 512
+
+Patch = namedtuple('Patch', ['offset', 'data'])
+# resolved against the parameter block as left by the patches before it
+ParameterEdit = namedtuple('ParameterEdit', ['half', 'program', 'wavesamples', 'experimental'],
+                           defaults=(None, (), False))
+
+
+def _pread(file, length, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(file.fileno(), length, offset)
+    file.seek(offset)
+    return file.read(length)
+
+
+def _pwrite(file, data, offset):
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(file.fileno(), view, offset)
+            view, offset = view[written:], offset + written
+        return
+    file.seek(offset)
+    file.write(data)
+    file.flush()
+
+
+# Patches replacing a whole wavesample (64KB) of half 0-5: one per run of
+# the wavesample on disk.
+
+
+def half_patches(half, data):
+    source = bytes(data)
+    if len(source) != layout.WAVESAMPLE_SIZE:
+        raise ValueError(f'wavesample is {len(source)} bytes, expected {layout.WAVESAMPLE_SIZE}')
+    return [Patch(image_offset, source[wave_offset:wave_offset + length])
+            for wave_offset, image_offset, length in layout.segments(half)]
+
+
+def sector_patch(track, sector, data):
+    if not 0 <= track < layout.TRACK_COUNT or not 0 <= sector < layout.SECTORS_PER_TRACK:
+        raise IndexError(f'no sector {sector} on track {track}')
+    size = layout.SHORT_SECTOR_SIZE if sector == layout.SECTORS_PER_TRACK - 1 else layout.SECTOR_SIZE
+    if len(data) != size:
+        raise ValueError(f'sector data is {len(data)} bytes, expected {size}')
+    return Patch(track * layout.TRACK_LENGTH + sector * layout.SECTOR_SIZE, bytes(data))
+
+
+def parameter_patch(half, block):
+    if len(block) != layout.PARAMETER_SIZE:
+        raise ValueError(f'parameter block is {len(block)} bytes, expected {layout.PARAMETER_SIZE}')
+    return Patch(_parameter_offset(half), bytes(block))
+
+
+def _parameter_offset(half):
+    return layout.WAVESAMPLE_TRACKS[half] * layout.TRACK_LENGTH
+
+
+def journal_path(path):
+    return path + JOURNAL_SUFFIX
+
+
+# Undo a patch interrupted before it finished, if its journal is still
+# there. Returns True if the image was rolled back.
+
+
+def recover(path):
+    journal = journal_path(path)
+    if not os.path.exists(journal):
+        return False
+    with open(journal, 'rb') as source:
+        saved = source.read()
+    if not saved.startswith(JOURNAL_MAGIC):
+        raise ValueError(f'{journal} is not a patch journal')
+    with open(path, 'r+b') as image:
+        _restore(image, saved)
+        os.fsync(image.fileno())
+    os.remove(journal)
+    return True
+
+
+def _journal_ranges(saved):
+    position = len(JOURNAL_MAGIC)
+    while position < len(saved):
+        offset, length = struct.unpack_from('<II', saved, position)
+        position += 8
+        yield offset, saved[position:position + length]
+        position += length
+
+
+def _restore(image, saved):
+    for offset, data in _journal_ranges(saved):
+        _pwrite(image, data, offset)
+
+
+# Save the original bytes of ranges ((offset, data) pairs) as the image's
+# journal. Returns the journal's contents.
+
+
+def _write_journal(path, ranges):
+    saved = b''.join([JOURNAL_MAGIC] + [struct.pack('<II', offset, len(data)) + data for offset, data in ranges])
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(handle, 'wb') as output:
+        output.write(saved)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary, journal_path(path))
+    return saved
+
+
+# The ranges of the patches that change something, merged where they touch,
+# with the image's current bytes for each. Patches are applied in order to a
+# copy of the affected bytes, so later patches win where they overlap and a
+# ParameterEdit sees the patches before it.
+
+
+def _span(patch):
+    if isinstance(patch, ParameterEdit):
+        return _parameter_offset(patch.half), layout.PARAMETER_SIZE
+    offset, length = patch.offset, len(patch.data)
+    if offset < 0 or offset + length > layout.IMAGE_SIZE:
+        raise ValueError(f'patch of {length} bytes at {offset} is outside the image')
+    return offset, length
+
+
+def _changes(image, patches):
+    spans = [_span(patch) for patch in patches]
+    merged = []
+    for offset, length in sorted(spans):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], offset + length - merged[-1][0])
+        else:
+            merged.append([offset, length])
+    starts = [start for start, _ in merged]
+    originals = [_pread(image, length, start) for start, length in merged]
+    copies = [bytearray(original) for original in originals]
+    for patch, (offset, length) in zip(patches, spans):
+        # every span lies inside exactly one merged range
+        index = bisect.bisect_right(starts, offset) - 1
+        window = memoryview(copies[index])[offset - starts[index]:offset - starts[index] + length]
+        if isinstance(patch, ParameterEdit):
+            parameters.encode(patch.program, patch.wavesamples, window, experimental=patch.experimental)
+        else:
+            window[:] = bytes(patch.data)
+    ranges = []
+    for start, current, updated in zip(starts, originals, copies):
+        # split the range into runs that really change
+        changed = np.flatnonzero(np.frombuffer(updated, dtype=np.uint8) != np.frombuffer(current, dtype=np.uint8))
+        if not len(changed):
+            continue
+        breaks = np.flatnonzero(np.diff(changed) > GAP)
+        for first, last in zip(changed[np.r_[0, breaks + 1]], changed[np.r_[breaks, len(changed) - 1]] + 1):
+            ranges.append((start + int(first), current[first:last], bytes(updated[first:last])))
+    return ranges
+
+
+# Apply patches (Patches and ParameterEdits) to an .img file in place,
+# atomically. Returns the number of bytes written, 0 if nothing changed.
+
+
+@metrics.timed('patch_image')
+def apply_patches(path, patches):
+    recover(path)
+    with open(path, 'r+b') as image:
+        size = os.fstat(image.fileno()).st_size
+        if size != layout.IMAGE_SIZE:
+            raise ValueError(f'{path} is {size} bytes, expected {layout.IMAGE_SIZE}')
+        ranges = _changes(image, patches)
+        if not ranges:
+            return 0
+        saved = _write_journal(path, [(offset, original) for offset, original, _ in ranges])
+        try:
+            for offset, _, data in ranges:
+                _pwrite(image, data, offset)
+            os.fsync(image.fileno())
+        except BaseException:
+            _restore(image, saved)
+            os.fsync(image.fileno())
+            os.remove(journal_path(path))
+            raise
+    os.remove(journal_path(path))
+    written = sum(len(data) for _, _, data in ranges)
+    metrics.count('bytes_patched', written)
+    return written
+
+
+def _patch_task(job):
+    path, patches = job
+    return apply_patches(path, patches)
+
+
+# Apply patches to many images in parallel. jobs is a list of (path,
+# patches). Returns batch.JobResults in path order, value being the bytes
+# written; an image that fails is left as it was.
+
+
+def patch_images(jobs, workers=None):
+    return sorted(batch.run_jobs(_patch_task, [(path, list(patches)) for path, patches in jobs], workers),
+                  key=lambda result: result.job[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Patch Mirage disk images in place.')
+    parser.add_argument('images', nargs='+', help='.img files to patch')
+    parser.add_argument('--half', choices=layout.HALF_NAMES, help='half to patch')
+    parser.add_argument('--wavesample', help='replace the half\'s wavesample with this 64KB raw file')
+    parser.add_argument('--parameters', help='replace the half\'s parameter block with this 1KB file')
+    parser.add_argument('--period', type=int, help='set the half\'s sampling period (microseconds)')
+    parser.add_argument('--experimental', action='store_true',
+                        help='allow --period, which writes through the unverified parameter layout')
+    parser.add_argument('--recover', action='store_true', help='only roll back interrupted patches')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    if args.recover:
+        for path in args.images:
+            if recover(path):
+                print(f'rolled back {path}')
+        return 0
+    if args.half is None:
+        parser.error('--half is required')
+    half = layout.HALF_NAMES.index(args.half)
+    patches = []
+    if args.wavesample:
+        with open(args.wavesample, 'rb') as source:
+            patches.extend(half_patches(half, source.read()))
+    if args.parameters:
+        with open(args.parameters, 'rb') as source:
+            patches.append(parameter_patch(half, source.read()))
+    if args.period is not None:
+        if not args.experimental:
+            parser.error('--period writes through the unverified parameter layout; add --experimental')
+        patches.append(ParameterEdit(half, {'sample_period': args.period}, experimental=True))
+    if not patches:
+        parser.error('nothing to patch: give --wavesample, --parameters or --period')
+    failures = 0
+    for result in patch_images([(path, patches) for path in args.images], args.workers):
+        if result.error:
+            failures += 1
+            print(f'FAILED {result.job[0]}\n{result.error}')
+        else:
+            print(f'{result.job[0]}: {result.value} bytes written')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
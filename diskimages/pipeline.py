@@ -0,0 +1,110 @@
+# Staged pipeline for bulk conversions: reader threads -> converter threads
+# -> writer threads, joined by bounded queues. Reads, conversion and writes
+# of different files overlap, and when one stage falls behind the queue in
+# front of it fills and the stages before it wait, so at most a few files
+# per stage are in memory at once. A folder finishes at about the speed of
+# the slowest stage instead of the sum of all three.
+#
+# Threads are enough for every stage: file I/O and the NumPy conversions in
+# convert.py release the GIL.
+import os
+import queue
+import threading
+import time
+import traceback
+
+from diskimages.batch import JobResult
+
+# items waiting between two stages
+DEPTH = 8
+
+_STOP = object()
+
+
+class _Stage:
+
+    def __init__(self, function, workers, source, sink):
+        self.function = function
+        self.workers = workers
+        self.source = source
+        self.sink = sink
+        self.next_workers = 1
+        self.remaining = workers
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            packet = self.source.get()
+            if packet is _STOP:
+                break
+            item, value, seconds, error = packet
+            if error is None:
+                start = time.perf_counter()
+                try:
+                    value = self.function(item, value)
+                except Exception:
+                    value = None
+                    error = traceback.format_exc(limit=3)
+                seconds += time.perf_counter() - start
+            self.sink.put((item, value, seconds, error))
+        with self.lock:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            # the next stage stops once everything before it has
+            for _ in range(self.next_workers):
+                self.sink.put(_STOP)
+
+
+def _feed(items, sink, workers, failures):
+    try:
+        for item in items:
+            sink.put((item, None, 0.0, None))
+    except Exception as error:
+        # items can be a generator reading an archive; stop cleanly and let
+        # run_pipeline raise its error
+        failures.append(error)
+    finally:
+        for _ in range(workers):
+            sink.put(_STOP)
+
+
+# Run read(item) -> convert(data) -> write(item, converted) for every item
+# and yield a JobResult for each as it leaves the pipeline, in completion
+# order. value is what write returned, seconds the time spent in the three
+# stages. An exception in any stage becomes the error of that item and it
+# skips the stages after. converters defaults to the number of cores. If
+# iterating items itself fails, the items already queued finish and then its
+# exception is raised.
+
+
+def run_pipeline(items, read, convert, write, readers=2, converters=None, writers=2, depth=DEPTH):
+    functions = [lambda item, value: read(item), lambda item, value: convert(value), write]
+    counts = [readers, converters or os.cpu_count(), writers]
+    queues = [queue.Queue(depth) for _ in range(len(functions) + 1)]
+    stages = [_Stage(function, count, queues[index], queues[index + 1])
+              for index, (function, count) in enumerate(zip(functions, counts))]
+    for stage, following in zip(stages, stages[1:]):
+        stage.next_workers = following.workers
+    failures = []
+    threads = [threading.Thread(target=_feed, args=(items, queues[0], stages[0].workers, failures), daemon=True)]
+    threads.extend(threading.Thread(target=stage.run, daemon=True) for stage in stages for _ in range(stage.workers))
+    for thread in threads:
+        thread.start()
+    results = queues[-1]
+    try:
+        while True:
+            packet = results.get()
+            if packet is _STOP:
+                break
+            item, value, seconds, error = packet
+            yield JobResult(item, seconds, error, value)
+    finally:
+        # if the caller stopped early, let the rest of the work drain
+        while packet is not _STOP:
+            packet = results.get()
+        for thread in threads:
+            thread.join()
+    if failures:
+        raise failures[0]
+
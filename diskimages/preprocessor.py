@@ -2,9 +2,40 @@
 # expected by writediskimage.py. The format is a single PCM file containing
 # 6 * 64KB chunks of 8bit, mono, pcm data. The routines in this file are highly
 # specific. Add your own!
+# Given a WavesampleStore (store=) the preprocessors also store each unique
+# wavesample they write once, under the name of the intermediate wav.
+import logging
 import os
+import posixpath
 import sys
-import utility
+
+import numpy as np
+
+from diskimages import archives
+from diskimages import buildmanifest
+from diskimages import layout
+from diskimages import packing
+from diskimages import pipeline
+from diskimages import resample
+from diskimages import riff
+from diskimages import utility
+
+
+# Write an intermediate wav (a 6 * 64KB buffer). With a WavesampleStore its six
+# wavesamples are also stored, under the file's name.
+
+
+def write_intermediate(buffer, name, store=None):
+    utility.write_file(buffer, name)
+    if store is not None:
+        store.add_wavesamples(buffer, name)
+
+
+# Packing scheme for wavetable16_to_4KB_sample_source: the first 16KB of
+# table i is cut into 1KB samples, each written 4 times in a row, across
+# halves 2i and 2i + 1.
+FOUR_KB_SCHEME = tuple(packing.Rule(i, length=16384, chunk_size=1024, repeat=4, halves=(2 * i, 2 * i + 1))
+                       for i in range(3))
 
 
 # Convert 16 sample wavetables (16KB 8 bit files) to 6 * 64 chunks. Write
@@ -13,24 +44,19 @@ import utility
 # upper keys on Mirage has the sample 16 samples spread across it.
 
 
-def wavetable16_to_sample_source(table1, table2, table3, name):
+def wavetable16_to_sample_source(table1, table2, table3, name, store=None):
     # table 1,2,3 are file names of 8bit wavetable files.
     # name is the output file name
     tables = [table1, table2, table3]
-    output = bytearray(6 * 65536)
-
-    index = 0
+    sources = []
     for item in tables:
-        table = utility.read_file_bytes(item)
-        print(f'preprocessing {item}')
-        chunksize = len(table)
-        for j in range(8):
-            # write entire table each time
-            output[index:index + chunksize] = table[0:chunksize]
-            index += chunksize
+        sources.append(utility.read_file_bytes(item))
+        logging.debug(f'preprocessing {item}')
+    # write entire table eight times in a row
+    output = packing.pack([packing.Rule(i, repeat=8) for i in range(len(sources))], sources)
 
     # will write to the disk_image directory. Should change this.
-    utility.write_file(output, name)
+    write_intermediate(output, name, store)
 
 
 # Convert 16 sample wavetables (16KB 8 bit files) to 6 * 64 chunks. Write
@@ -40,61 +66,97 @@ def wavetable16_to_sample_source(table1, table2, table3, name):
 # Data is raw PCM- no wave header.
 
 
-def wavetable16_to_1KB_sample_source(source, name):
+def wavetable16_to_1KB_sample_source(source, name, store=None):
     # table 1,2,3 are file names of 8bit wavetable files.
     # name is the output file name
     count = len(os.listdir(source))
     tables = os.listdir(source)[0:24]
     if count > 24:
-        print(f"directory has {count} files. Only using first 24.")
-    output = bytearray(6 * 65536)
+        logging.warning(f"directory has {count} files. Only using first 24.")
     # read in 16KB chunks
     chunksize = 16384
-    index = 0
+    sources = []
     for item in tables:
-        table = utility.read_file_bytes(item, source)
-        print(f'preprocessing {item}')
-        # write each table once
-        output_start = index * chunksize
-        output[output_start:output_start + chunksize] = table
-        index += 1
+        sources.append(utility.read_file_bytes(item, source))
+        logging.debug(f'preprocessing {item}')
+    # write each table once
+    output = packing.pack([packing.Rule(i, length=chunksize) for i in range(len(sources))], sources)
 
     # will write to the disk_image directory. Should change this.
-    utility.write_file(output, name)
+    write_intermediate(output, name, store)
 
 
 # Convert 16 sample wavetables (16KB 8 bit files) to 6 * 64 chunks. Write
 # the output file.
 # Read in 3 files. Write each 1KB sample 4 times in a row.
+# With a BuildManifest nothing is done if the output is up to date.
 
 
-def wavetable16_to_4KB_sample_source(table1, table2, table3, name):
+def wavetable16_to_4KB_sample_source(table1, table2, table3, name, manifest=None, store=None):
     # table 1,2,3 are file names of 8bit wavetable files.
     # name is the output file name
     tables = [table1, table2, table3]
-    output = bytearray(6 * 65536)
-
-    index = 0
-    count = 0
+    inputs = [os.path.join(sys.path[0], table) for table in tables]
+    if manifest is not None and not manifest.is_stale(name, inputs, {'packer': '4KB'}):
+        logging.info(f'{name} is up to date')
+        return
+    sources = []
     for item in tables:
-        table = utility.read_file_bytes(item)
-        print(f'preprocessing {item}')
-        chunksize = 1024
-        # write each table twice (lower and upper half)
-        for x in range(2):
-            for j in range(16):
-                # write each 1KB sample four times.
-                for k in range(4):
-                    sample_start = j * chunksize
-                    sample = table[sample_start: sample_start + chunksize]
-                    index = j * 4 + k
-                    output_start = index * chunksize + count * 65536
-                    output[output_start:output_start + chunksize] = sample
-
-            count = count + 1
+        sources.append(utility.read_file_bytes(item))
+        logging.debug(f'preprocessing {item}')
+    # write each 1KB sample four times, filling a lower and upper half per table
+    output = packing.pack(FOUR_KB_SCHEME[:len(sources)], sources)
 
     # will write to the disk_image directory. Should change this.
-    utility.write_file(output, name)
+    write_intermediate(output, name, store)
+    if manifest is not None:
+        manifest.record(name, inputs, {'packer': '4KB'})
+
+
+FAIRLIGHT_SAMPLE_SIZE = 16384
+
+
+# Fairlight wav files (bytes) to 16KB samples, headers removed and
+# resampled to rate if given. 24 files (3 sounds, 4 samples per half) fill an
+# image; more spill over into further images.
+
+
+def fairlight_samples(files, rate=None, quality='medium'):
+    samples = []
+    for data in files:
+        # remove wav header
+        sample = utility.remove_waveheader(data)
+        # should be 16384
+        if len(sample) != FAIRLIGHT_SAMPLE_SIZE:
+            # pad to 16384
+            raise ValueError("Sample size is not 16384")
+        samples.append(sample)
+    chunksize = FAIRLIGHT_SAMPLE_SIZE
+    if rate and samples:
+        stacked = np.frombuffer(b''.join(samples), dtype=np.uint8).reshape(len(samples), chunksize)
+        resampled = resample.resample_8bit(stacked, resample.FAIRLIGHT_RATE, rate, quality)
+        # silence is 128 in unsigned 8 bit
+        padded = np.full((len(samples), chunksize), 128, dtype=np.uint8)
+        width = min(chunksize, resampled.shape[1])
+        padded[:, :width] = resampled[:, :width]
+        samples = [row.tobytes() for row in padded]
+    return samples
+
+
+# Every intermediate wav count Fairlight samples are packed into: name, then
+# name_2 ... if they spill over.
+
+
+def fairlight_outputs(name, count):
+    placements = packing.plan_halves([FAIRLIGHT_SAMPLE_SIZE] * count)
+    return spill_names(name, max((placement.image for placement in placements), default=0) + 1)
+
+
+# True if a manifest has every one of outputs up to date with inputs.
+
+
+def _up_to_date(manifest, outputs, inputs, params):
+    return manifest is not None and not any(manifest.is_stale(output, inputs, params) for output in outputs)
 
 
 # Just write all samples to disk in order. No spanning whole keyboard. Can do that
@@ -104,74 +166,232 @@ def wavetable16_to_4KB_sample_source(table1, table2, table3, name):
 # Take a directory of Fairlight IIX wav files and convert to
 # multiple 6 * 64KB sample source files for writing as a mirage image
 # disk.
+# With a BuildManifest nothing is done if every output is up to date.
+# rate resamples the samples from the Fairlight's 30200Hz (e.g. to resample.MIRAGE_RATE)
+# so they play at the right pitch. They are resampled together in one batch, then
+# padded with silence (or trimmed) back to 16KB. quality is a resample.QUALITIES key.
 
-def write_fairlight_directory_to_intermediate_wav(src_folder, image_name):
+def write_fairlight_directory_to_intermediate_wav(src_folder, image_name, manifest=None, rate=None,
+                                                  quality='medium', store=None):
     # get all file names in input directory. Use them all. Just stop when you run out.
     source_files = os.listdir(src_folder)
-    print(source_files)
-    print(f'copying {len(source_files)} samples to image')
-    name = os.path.basename(src_folder)
-    # take files 12 at a time (3 sounds, 4 samples per sound) and write a disk image
-    file_count = len(source_files)
-    if file_count > 24:
-        # can only write a max of 24 files
-        source_files = source_files[0:24]
-        print(f"can't write all files. skipping {source_files[24:]}")
-    # check for remainder and print out what is missing
-    output = bytearray(6 * 65536)
-    index = 0
-    for item in source_files:
-        sample = utility.read_file_bytes(item, src_folder)
-        # remove wav header
-        sample = utility.remove_waveheader(sample)
-        print(f'preprocessing {item}')
-        # should be 16384
-        chunksize = len(sample)
-        if chunksize != 16384:
-            # pad to 16384
-            raise ValueError("Sample size is not 16384")
-        # write entire 16KB sample
-        output[index:index + chunksize] = sample[0:chunksize]
-        index += chunksize
+    output_name = os.path.join("intermediate_wav", image_name)
+    inputs = [os.path.join(src_folder, item) for item in sorted(source_files)]
+    params = {'packer': 'fairlight', 'rate': rate, 'quality': quality if rate else None}
+    if _up_to_date(manifest, fairlight_outputs(output_name, len(inputs)), inputs, params):
+        logging.info(f'{output_name} is up to date')
+        return
+    logging.debug(source_files)
+    logging.info(f'copying {len(source_files)} samples to image')
+    samples = fairlight_samples([utility.read_file_bytes(item, src_folder) for item in source_files], rate, quality)
+    # write entire 16KB samples, in order
+    outputs = write_packed_intermediate_wavs(samples, output_name, store)
+    if manifest is not None:
+        for output in outputs:
+            manifest.record(output, inputs, params)
+    return outputs
+
+
+# Names of the intermediate wavs for packed samples: name, then name_2,
+# name_3 ... for the images it spills into.
+
+
+def spill_names(name, count):
+    stem, extension = os.path.splitext(name)
+    return [name] + [f'{stem}_{index}{extension}' for index in range(2, count + 1)]
+
+
+# Pack samples of any length (up to 64KB) into as few intermediate wavs as
+# possible, up to 8 per half, and write them. Returns the file names.
+
+
+def write_packed_intermediate_wavs(samples, name, store=None):
+    buffers, placements = packing.pack_images(samples)
+    names = spill_names(name, len(buffers))
+    for placement in placements:
+        logging.debug(f'sample {placement.source}: {names[placement.image]} half {placement.half + 1} '
+                      f'offset {placement.offset}')
+    for buffer, output in zip(buffers, names):
+        # will write to the disk_image directory. Should change this.
+        write_intermediate(buffer, output, store)
+    return names
+
+
+# A sample of length frames at src_rate resampled to rate, and its length
+# after. Nothing is done without both rates; raw PCM has no rate of its own.
+
+
+def _resampled_length(length, src_rate, rate):
+    return length * rate // src_rate if rate and src_rate else length
 
-    # will write to the disk_image directory. Should change this.
-    utility.write_file(output, os.path.join("intermediate_wav",  image_name))
 
+def _resampled(sample, src_rate, rate, quality):
+    if not rate or not src_rate or src_rate == rate:
+        return sample
+    return resample.resample_8bit(sample, src_rate, rate, quality)
 
-def write_virus_directory_to_intermediate_wav(src_folder, image_name):
+
+# Pack every 8 bit sample (raw or wav) in a folder, whatever the length.
+# rate resamples them (e.g. to resample.MIRAGE_RATE): WAV files from the rate
+# in their header, raw files from source_rate, or not at all if it is not
+# given. quality is a resample.QUALITIES key.
+
+
+def write_packed_directory_to_intermediate_wav(src_folder, image_name, store=None, rate=None, quality='medium',
+                                               source_rate=None):
+    source_files = sorted(os.listdir(src_folder))
+    logging.info(f'packing {len(source_files)} samples')
+    samples = []
+    for item in source_files:
+        data = utility.read_file_bytes(item, src_folder)
+        if riff.is_riff(data):
+            info, pcm = riff.parse_wave(data)
+            samples.append(_resampled(bytearray(pcm), info.sample_rate, rate, quality))
+        else:
+            samples.append(_resampled(data, source_rate, rate, quality))
+    return write_packed_intermediate_wavs(samples, os.path.join("intermediate_wav", image_name), store)
+
+
+# The same from a zip or tar archive, without unpacking it. Every file in the
+# archive is a sample. The packing is planned from the members' headers, the
+# output files are created zero filled and then each sample is written into
+# place as the archive streams past, so only one sample is in memory at a
+# time however big the archive is.
+
+
+def write_packed_archive_to_intermediate_wav(archive, image_name, store=None, rate=None, quality='medium',
+                                             source_rate=None):
+    entries = archives.sample_lengths(archive)
+    placements = packing.plan_halves([_resampled_length(length, sample_rate or source_rate, rate)
+                                      for _, length, sample_rate in entries])
+    outputs = spill_names(os.path.join("intermediate_wav", image_name),
+                          max((placement.image for placement in placements), default=0) + 1)
+    logging.info(f'packing {len(placements)} samples from {archive} into {len(outputs)} images')
+    for output in outputs:
+        with open(output, 'wb') as empty:
+            empty.truncate(packing.BUFFER_SIZE)
+    for placement, (name, data, sample_rate) in zip(placements, archives.samples(archive)):
+        data = _resampled(data, sample_rate or source_rate, rate, quality)
+        if name != entries[placement.source][0] or len(data) != placement.length:
+            raise ValueError(f'{archive} changed while it was being packed')
+        logging.debug(f'sample {name}: {outputs[placement.image]} half {placement.half + 1} '
+                      f'offset {placement.offset}')
+        with open(outputs[placement.image], 'r+b') as output:
+            output.seek(placement.half * layout.WAVESAMPLE_SIZE + placement.offset)
+            output.write(data)
+    if store is not None:
+        for output in outputs:
+            with open(output, 'rb') as packed:
+                store.add_wavesamples(packed.read(), output)
+    return outputs
+
+
+FAIRLIGHT_FOLDER = 'EXPORT/VC2WAV'
+
+
+# The disk a Fairlight sample folder in an archive belongs to: the folder
+# name above EXPORT/VC2WAV.
+
+
+def fairlight_disk(folder):
+    return posixpath.basename(folder[:-len(FAIRLIGHT_FOLDER)].rstrip('/'))
+
+
+# Preprocess every Fairlight disk in a zip or tar archive of the library (the
+# "Fairlight CMI IIx Disks Image" tree) as write_fairlight_directory_to_intermediate_wav
+# does for one unpacked folder. The archive is streamed once and the disks
+# decoded in parallel. Disks named in exclude are skipped, and with a
+# BuildManifest so are disks whose outputs are all up to date with the archive.
+# Returns a JobResult per disk folder.
+
+
+def write_fairlight_archive_to_intermediate_wavs(archive, manifest=None, rate=None, quality='medium', exclude=(),
+                                                 converters=None, store=None):
+    params = {'packer': 'fairlight', 'rate': rate, 'quality': quality if rate else None}
+
+    def output_name(folder):
+        return os.path.join("intermediate_wav", fairlight_disk(folder.name).replace(' ', '_'))
+
+    def wanted(folders):
+        for folder in folders:
+            if fairlight_disk(folder.name) in exclude:
+                continue
+            if _up_to_date(manifest, fairlight_outputs(output_name(folder), len(folder.members)), [archive], params):
+                logging.info(f'{output_name(folder)} is up to date')
+                continue
+            yield folder
+
+    def convert(folder):
+        return fairlight_samples([member.data for member in folder.members], rate, quality)
+
+    def write(folder, samples):
+        # one writer thread, so the store is only used from one thread
+        return write_packed_intermediate_wavs(samples, output_name(folder), store)
+
+    results = []
+    for result in archives.map_folders(wanted(archives.folders(archive, FAIRLIGHT_FOLDER)), convert, write,
+                                       converters=converters):
+        if result.error:
+            logging.error(f'failed to preprocess {result.job}\n{result.error}')
+        elif manifest is not None:
+            for output in result.value:
+                manifest.record(output, [archive], params)
+        results.append(result)
+    return results
+
+
+def write_virus_directory_to_intermediate_wav(src_folder, image_name, store=None):
     # get all file names in input directory. Use them all. Just stop when you run out.
     source_files = os.listdir(src_folder)
-    print(source_files)
-    print(f'copying {len(source_files)} samples to image')
-    output = bytearray(6 * 65536)
-    index = 0
-    # write each 3 times so all 3 sounds are the same
-    for x in range(3):
-        for item in source_files:
-            sample = utility.read_file_bytes(item, src_folder)
-            print(f'preprocessing {item}')
-            chunksize = 2048
-            # write entire 2KB sample
-            output[index:index + chunksize] = sample[0:chunksize]
-            index += chunksize
+    logging.debug(source_files)
+    logging.info(f'copying {len(source_files)} samples to image')
+    samples = []
+    for item in source_files:
+        samples.append(utility.read_file_bytes(item, src_folder))
+        logging.debug(f'preprocessing {item}')
+    # write each 2KB sample, and the whole set 3 times so all 3 sounds are the same
+    rules = [packing.Rule(i, length=2048) for i in range(len(samples))]
+    output = packing.pack(rules * 3, samples)
 
     # FIXME will write to proper wavsyn directory using config.ini
-    utility.write_file(output, os.path.join("intermediate_wav",  image_name))
+    write_intermediate(output, os.path.join("intermediate_wav",  image_name), store)
+
+
+
+VIRUS_ROOT = "F:\\wavsyn\\virusT1\\Virus Classic Waveforms"
 
 
+# Convert the Virus 32 bit float waveforms to 8 bit. Tables go through the
+# pipeline, so reading one table, converting another and writing a third
+# overlap. Returns the pipeline's JobResults.
 
-def bulk_process_virus():
-    root = "F:\\wavsyn\\virusT1\\Virus Classic Waveforms"
-    tables = os.listdir(root)
-    for file in tables:
-        data = utility.read_file_bytes(file, root)
-        #skip 100 byte header and convert
-        eights = utility.convert_32bf_to_8bit(data[100:])
-        utility.write_file(eights, (os.path.splitext(file)[0] + "_8bit.wav").replace(' ', '_'))
 
+def bulk_process_virus(root=VIRUS_ROOT):
+    tables = [os.path.join(root, file) for file in sorted(os.listdir(root))]
+    results = list(pipeline.run_pipeline(tables, _read_virus, utility.convert_32bf_to_8bit, _write_virus))
+    for result in results:
+        if result.error:
+            logging.error(f'failed to convert {result.job}\n{result.error}')
+    return results
 
 
-def bulk_process_ppg_tables():
+def _read_virus(table):
+    with open(table, 'rb') as source:
+        # skip 100 byte header
+        source.seek(100)
+        return source.read()
+
+
+def _write_virus(table, converted):
+    output_name = (os.path.splitext(os.path.basename(table))[0] + "_8bit.wav").replace(' ', '_')
+    utility.write_file(converted, output_name)
+    return output_name
+
+
+# With a BuildManifest only tables that changed are reprocessed.
+
+
+def bulk_process_ppg_tables(manifest=None, store=None):
     file_stub = "8bit-PPG_WA"
     for x in range(12, 31, 3):
 
@@ -182,7 +402,9 @@ def bulk_process_ppg_tables():
         file2 = file_stub + zero + str(x + 1) + ".wav"
         file3 = file_stub + zero + str(x + 2) + ".wav"
 
-        wavetable16_to_4KB_sample_source(file1, file2, file3, "ppg" + str(x) + "-image.wav")
+        wavetable16_to_4KB_sample_source(file1, file2, file3, "ppg" + str(x) + "-image.wav", manifest, store)
+    if manifest is not None:
+        manifest.save()
 
 
 if __name__ == '__main__':
@@ -205,13 +427,22 @@ if __name__ == '__main__':
     write_virus_directory_to_intermediate_wav("F:\\wavsyn\\wavetables\\virus", "virus_ti.wav" )
     exit(0)
 
+    # or straight from the zip, without unpacking it
+    # write_fairlight_archive_to_intermediate_wavs("F:\\samples\\Fairlight CMI IIx Disks Image.zip",
+    #                                              buildmanifest.BuildManifest("build_manifest.json"),
+    #                                              exclude=("Electric & Keyboard Inst. (6809) Series IIx",
+    #                                                       "Mode 1 (6809) Series IIx", "Pianos (6809) Series IIx"))
+
     root_dir = "F:\\samples\\Fairlight CMI IIx Disks Image\\disks\\BIN\\IIx_disks\\New Voice Disks"
     source_folders = os.listdir(root_dir)
     print(source_folders)
     print(f'copying {len(source_folders)} folders of samples to multiple images')
+    # only folders that changed since the last run are rewritten
+    manifest = buildmanifest.BuildManifest("build_manifest.json")
     for child in source_folders:
         if child in ("Electric & Keyboard Inst. (6809) Series IIx", "Mode 1 (6809) Series IIx",
                      "Pianos (6809) Series IIx"):
             continue
         name = os.path.join(root_dir, child)
-        write_fairlight_directory_to_intermediate_wav(name + "\\EXPORT\\VC2WAV", child.replace(' ', '_'))
+        write_fairlight_directory_to_intermediate_wav(name + "\\EXPORT\\VC2WAV", child.replace(' ', '_'), manifest)
+    manifest.save()
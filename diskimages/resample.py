@@ -0,0 +1,101 @@
+# Sample rate conversion for getting source material to Mirage rates, e.g.
+# 30200Hz Fairlight voices to the Mirage default of 29411Hz.
+#
+# This is a polyphase windowed-sinc resampler. A bank of Kaiser windowed sinc
+# filters, one per fractional phase, is computed once per quality setting.
+# Each output sample picks the filter for its phase and takes a dot product
+# with the input samples around it. Everything is vectorized with NumPy, and
+# a 2D array (one sample per row, all the same length) is resampled in one
+# call.
+import numpy as np
+
+MIRAGE_RATE = 29411
+FAIRLIGHT_RATE = 30200
+
+# quality -> (filter taps, phases, Kaiser beta). More taps give a sharper
+# cutoff, more phases a more accurate fractional position. The taps are
+# counted at the lower of the two rates.
+QUALITIES = {
+    'fast': (8, 64, 5.0),
+    'medium': (16, 256, 7.0),
+    'best': (48, 1024, 9.0),
+}
+
+# fraction of the lower Nyquist frequency kept by the anti-alias filter
+ROLLOFF = 0.95
+# output samples computed per pass, to bound memory for long or batched input
+CHUNK = 8192
+
+_banks = {}
+
+
+# The filters for a quality and a rate ratio (output rate over input rate).
+# When downsampling the cutoff drops to the output's Nyquist frequency and
+# the filters get 1 / ratio times the taps, so they span as many of the
+# sinc's zero crossings as they do at the input rate.
+
+
+def filter_bank(quality, ratio):
+    ratio = min(1.0, ratio)
+    key = (quality, round(ratio, 6))
+    if key not in _banks:
+        taps, phases, beta = QUALITIES[quality]
+        cutoff = ratio * ROLLOFF
+        half = int(np.ceil(taps / 2 / ratio))
+        offsets = np.arange(-half + 1, half + 1)
+        fractions = np.arange(phases) / phases
+        # distance from each tap to the output position, for each phase
+        distance = offsets[None, :] - fractions[:, None]
+        # Kaiser window evaluated at the exact tap distances
+        window = np.i0(beta * np.sqrt(np.clip(1 - (distance / half) ** 2, 0, 1))) / np.i0(beta)
+        bank = cutoff * np.sinc(cutoff * distance) * window
+        bank /= bank.sum(axis=1, keepdims=True)
+        _banks[key] = (bank, offsets)
+    return _banks[key]
+
+
+# Resample float samples from src_rate to dst_rate. samples is 1D, or 2D with
+# one sample per row. Returns float64 of the same dimensions.
+
+
+def resample(samples, src_rate, dst_rate, quality='medium'):
+    if quality not in QUALITIES:
+        raise ValueError(f'unknown resampling quality {quality}')
+    samples = np.asarray(samples, dtype=np.float64)
+    if src_rate == dst_rate:
+        return samples.copy()
+    single = samples.ndim == 1
+    if single:
+        samples = samples[None, :]
+    length = samples.shape[1]
+    out_length = int(length * dst_rate // src_rate)
+    bank, offsets = filter_bank(quality, dst_rate / src_rate)
+    phases = len(bank)
+    # zero padding either side so every tap has an input sample
+    pad = len(offsets)
+    padded = np.zeros((samples.shape[0], length + 2 * pad))
+    padded[:, pad:pad + length] = samples
+    output = np.empty((samples.shape[0], out_length))
+    step = src_rate / dst_rate
+    for start in range(0, out_length, CHUNK):
+        position = np.arange(start, min(start + CHUNK, out_length)) * step
+        index = np.floor(position).astype(np.int64)
+        phase = np.rint((position - index) * phases).astype(np.int64)
+        # a phase that rounds up to a whole sample is phase 0 of the next one
+        index += phase // phases
+        phase %= phases
+        taps = padded[:, index[:, None] + offsets[None, :] + pad]
+        output[:, start:start + len(index)] = np.einsum('bnt,nt->bn', taps, bank[phase])
+    return output[0] if single else output
+
+
+# Resample unsigned 8 bit PCM (the Mirage format). data is a buffer or a 2D
+# uint8 array of equal length samples. Returns a bytearray for a buffer, a
+# uint8 array for a 2D array.
+
+
+def resample_8bit(data, src_rate, dst_rate, quality='medium'):
+    array = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.uint8)
+    result = resample((array.astype(np.float64) - 128) / 128, src_rate, dst_rate, quality)
+    converted = np.clip(np.rint(result * 128 + 128), 0, 255).astype(np.uint8)
+    return converted if isinstance(data, np.ndarray) else bytearray(converted)
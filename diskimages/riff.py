@@ -0,0 +1,207 @@
+# Chunk aware RIFF/WAV reading. Rather than assume a 44 byte header, the chunk
+# list is walked until the fmt and data chunks are found, so LIST, fact, cue
+# and other chunks are skipped. PCM data is read in fixed size blocks into a
+# single reused buffer, so memory use does not depend on the file size.
+import struct
+from collections import namedtuple
+
+from diskimages import convert
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xfffe
+
+# frames per block when streaming
+BLOCK_FRAMES = 16384
+
+WaveInfo = namedtuple('WaveInfo', ['format_tag', 'channels', 'sample_rate', 'bits_per_sample', 'block_align',
+                                   'byteorder', 'data_offset', 'data_size'])
+
+
+def is_riff(data):
+    # true if a buffer starts with a RIFF (little-endian) or RIFX (big-endian) WAVE header
+    return len(data) >= 12 and bytes(data[0:4]) in (b'RIFF', b'RIFX') and bytes(data[8:12]) == b'WAVE'
+
+
+def _skip(stream, count):
+    # seek past data when possible, otherwise read and discard it (e.g. archive members)
+    try:
+        stream.seek(count, 1)
+    except (AttributeError, OSError, ValueError):
+        while count > 0:
+            skipped = len(stream.read(min(count, 65536)))
+            if not skipped:
+                break
+            count -= skipped
+
+
+def _parse_fmt(chunk, endian):
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from(endian + 'HHIIHH', chunk)
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+        # the real format tag is the first two bytes of the sub format GUID
+        format_tag = struct.unpack_from(endian + 'H', chunk, 24)[0]
+    return format_tag, channels, sample_rate, bits, block_align
+
+
+# Read the header of a WAV file from a binary stream. On return the stream is
+# positioned at the first byte of PCM data. Raises ValueError if the stream is
+# not a WAV file or has no data chunk.
+
+
+def read_wave_info(stream):
+    header = stream.read(12)
+    if not is_riff(header):
+        raise ValueError('not a RIFF WAVE file')
+    endian = '<' if header[0:4] == b'RIFF' else '>'
+    position = 12
+    fmt = None
+    while True:
+        chunk_header = stream.read(8)
+        if len(chunk_header) < 8:
+            raise ValueError('no data chunk found')
+        chunk_id, size = chunk_header[0:4], struct.unpack(endian + 'I', chunk_header[4:8])[0]
+        position += 8
+        if chunk_id == b'fmt ':
+            fmt = _parse_fmt(stream.read(size), endian)
+            _skip(stream, size & 1)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('data chunk found before fmt chunk')
+            byteorder = 'little' if endian == '<' else 'big'
+            return WaveInfo(*fmt, byteorder, position, size)
+        else:
+            # chunks are padded to an even length
+            _skip(stream, size + (size & 1))
+        position += size + (size & 1)
+
+
+# Parse the header of a WAV file already held in memory. Returns the info and
+# a zero-copy memoryview of the PCM data.
+
+
+def parse_wave(data):
+    view = memoryview(data)
+    reader = _ViewReader(view)
+    info = read_wave_info(reader)
+    # tolerate files whose data chunk size runs past the end of the file
+    return info, view[info.data_offset:info.data_offset + info.data_size]
+
+
+class _ViewReader:
+    # minimal file-like wrapper so read_wave_info can parse a buffer without copying it
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def read(self, count):
+        data = self.view[self.position:self.position + count]
+        self.position += len(data)
+        return bytes(data)
+
+    def seek(self, offset, whence=0):
+        self.position = offset if whence == 0 else self.position + offset
+
+
+# Name of the convert module sample format for a WAV file.
+
+
+def sample_format(info):
+    bits = info.bits_per_sample
+    if info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits not in (32, 64):
+            raise ValueError(f'unsupported float width {bits}')
+        return f'float{bits}'
+    if info.format_tag != WAVE_FORMAT_PCM:
+        raise ValueError(f'unsupported wav format tag {info.format_tag:#x}')
+    if bits == 8:
+        # 8 bit wav data is unsigned, everything wider is signed
+        return 'uint8'
+    if bits not in (16, 24, 32):
+        raise ValueError(f'unsupported sample width {bits}')
+    return f'int{bits}'
+
+
+# Generator yielding the PCM data of a WAV stream as memoryviews of at most
+# block_frames frames. The same buffer is reused for every block, so copy a
+# block if it has to outlive the next iteration.
+
+
+def iter_blocks(stream, info, block_frames=BLOCK_FRAMES):
+    block_align = max(info.block_align, 1)
+    buffer = bytearray(block_frames * block_align)
+    view = memoryview(buffer)
+    remaining = info.data_size
+    while remaining > 0:
+        count = _read_into(stream, view[:min(len(buffer), remaining)])
+        if count == 0:
+            # truncated file
+            break
+        remaining -= count
+        yield view[:count]
+
+
+def _read_into(stream, view):
+    # fill as much of view as the stream allows. readinto may return short counts.
+    filled = 0
+    readinto = getattr(stream, 'readinto', None)
+    while filled < len(view):
+        if readinto is not None:
+            count = readinto(view[filled:])
+        else:
+            chunk = stream.read(len(view) - filled)
+            count = len(chunk)
+            view[filled:filled + count] = chunk
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+# Stream a WAV file through the 8 bit converter, yielding converted blocks.
+# With normalize the data is read twice: once to find the peak and once to
+# convert. fmt overrides the sample format derived from the header.
+
+
+def iter_8bit(path, block_frames=BLOCK_FRAMES, dither=False, normalize=False, fmt=None):
+    peak = None
+    with open(path, 'rb') as stream:
+        info = read_wave_info(stream)
+        fmt = fmt or sample_format(info)
+        if normalize:
+            peak = 0.0
+            for block in iter_blocks(stream, info, block_frames):
+                peak = max(peak, convert.peak_level(block, fmt, info.byteorder, info.channels))
+            stream.seek(info.data_offset)
+        for block in iter_blocks(stream, info, block_frames):
+            yield convert.convert_to_8bit(block, fmt, info.byteorder, dither, normalize, channels=info.channels,
+                                          peak=peak)
+
+
+# Convert a WAV file to raw 8 bit unsigned mono PCM with constant memory.
+# Returns the number of bytes written.
+
+
+def convert_wave_file(source, destination, block_frames=BLOCK_FRAMES, dither=False, normalize=False, fmt=None):
+    written = 0
+    with open(destination, 'wb') as output:
+        for block in iter_8bit(source, block_frames, dither, normalize, fmt):
+            output.write(block)
+            written += len(block)
+    return written
+
+
+# Unsigned 8 bit PCM from a file: WAV files are decoded (and converted if
+# wider than 8 bits), anything else is taken as raw 8 bit data.
+
+
+def read_sample(path):
+    with open(path, 'rb') as source:
+        data = source.read()
+    if not is_riff(data):
+        return data
+    info, pcm = parse_wave(data)
+    fmt = sample_format(info)
+    if fmt == 'uint8' and info.channels == 1:
+        return pcm
+    return convert.convert_to_8bit(pcm, fmt, info.byteorder, channels=info.channels)
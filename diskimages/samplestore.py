@@ -0,0 +1,119 @@
+# Content-addressed store for 64KB wavesamples. Each unique wavesample is
+# written once, as objects/<first two hex digits>/<hash>.raw, no matter how
+# many images or intermediate files it appears in. An append-only index
+# (index.jsonl) maps each hash to the places it was seen as (source, half)
+# pairs, and is loaded into a dict so "where else is this sound?" is a single
+# lookup.
+import hashlib
+import json
+import os
+import tempfile
+
+from diskimages import layout
+from diskimages.diskimage import MirageDiskImage
+
+INDEX_NAME = 'index.jsonl'
+
+
+def wavesample_hash(data):
+    # 128 bit BLAKE2b, faster than MD5 and plenty for dedup
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def object_path(root, digest):
+    return os.path.join(root, 'objects', digest[0:2], digest + '.raw')
+
+
+# Write a wavesample into the object folder of a store if it is not already
+# there and return its hash. Safe to call from several processes at once: the
+# object is written to a temporary file and renamed into place. Worker
+# processes use this and leave the index to the parent.
+
+
+def store_object(root, data):
+    digest = wavesample_hash(data)
+    path = object_path(root, digest)
+    if not os.path.exists(path):
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as output:
+            output.write(data)
+        os.replace(temporary, path)
+    return digest
+
+
+class WavesampleStore:
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._locations = {}
+        self._seen = set()
+        index_path = os.path.join(root, INDEX_NAME)
+        if os.path.exists(index_path):
+            with open(index_path) as index:
+                for line in index:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._remember(entry['hash'], entry['source'], entry['half'])
+        self._index = open(index_path, 'a')
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._locations)
+
+    def __contains__(self, digest):
+        return digest in self._locations
+
+    def _remember(self, digest, source, half):
+        key = (digest, source, half)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self._locations.setdefault(digest, []).append((source, half))
+        return True
+
+    # Add a location for a wavesample already in the objects folder.
+    def record(self, digest, source, half):
+        if self._remember(digest, source, half):
+            self._index.write(json.dumps({'hash': digest, 'source': source, 'half': half}) + '\n')
+            self._index.flush()
+
+    # Store a wavesample and note where it came from. half is the half name
+    # (lh1 ... uh3) or None. Returns the hash.
+    def put(self, data, source=None, half=None):
+        digest = store_object(self.root, data)
+        self.record(digest, source, half)
+        return digest
+
+    def get(self, digest):
+        with open(object_path(self.root, digest), 'rb') as stored:
+            return stored.read()
+
+    # Every (source, half) a wavesample was seen at. Accepts a hash or the
+    # wavesample data itself.
+    def where(self, digest_or_data):
+        digest = digest_or_data if isinstance(digest_or_data, str) else wavesample_hash(digest_or_data)
+        return list(self._locations.get(digest, ()))
+
+    # Store the six wavesamples of an intermediate wav buffer (6 * 64KB).
+    def add_wavesamples(self, data, source):
+        view = memoryview(data)
+        return [self.put(view[half * layout.WAVESAMPLE_SIZE:(half + 1) * layout.WAVESAMPLE_SIZE], source, name)
+                for half, name in enumerate(layout.HALF_NAMES)]
+
+    # Store the six wavesamples of a disk image file.
+    def add_image(self, path):
+        with MirageDiskImage.open(path) as image:
+            return self.add_wavesamples(image.read_wavesamples(), path)
@@ -0,0 +1,248 @@
+# Job server for front ends that run many small jobs. It keeps a pool of
+# worker processes running, each with one MirageDiskManager (config read
+# once, template cache warm), and takes jobs over a Unix socket or a
+# localhost TCP port, so a job no longer pays for interpreter startup,
+# imports and config parsing.
+#
+# The protocol is JSON lines. A request is one JSON object per line with an
+# id chosen by the client and an op:
+#
+#   {"id": 1, "op": "create", "source": "1st_24.wav", "output": "1st_24"}
+#   {"id": 2, "op": "extract", "image": "1st_24.img"}
+#   {"id": 3, "op": "convert", "source": "wavetables/in.wav", "destination": "wavetables/out.wav", "dither": true}
+#   {"id": 4, "op": "hfe", "image": "1st_24.img"}
+#   {"id": 5, "op": "ping"}
+#   {"id": 6, "op": "metrics", "format": "prometheus"}
+#
+# Requests on a connection run concurrently and each gets one response line
+# as soon as it finishes, so responses can come back in any order:
+#
+#   {"id": 1, "ok": true, "seconds": 0.012, "value": "1st_24"}
+#   {"id": 2, "ok": false, "seconds": 0.001, "error": "Traceback ..."}
+#
+# Paths are relative to the app_root folders: create reads
+# INTERMEDIATE_WAV_FOLDER and writes OUTPUT_DISK_IMAGE_FOLDER, extract and hfe
+# read images from OUTPUT_DISK_IMAGE_FOLDER, and convert works anywhere under
+# app_root. The server only listens on loopback unless --allow-remote is given.
+#
+# metrics answers with the server's counters and stage timers (see
+# metrics.py), as JSON or Prometheus text; they are collected when the server
+# runs with --metrics.
+#
+# usage: python -m diskimages.server [--socket PATH | --host HOST [--allow-remote] --port N] [--workers N]
+#        [--config FILE] [--metrics]
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from diskimages import batch
+from diskimages import metrics
+from diskimages import riff
+
+HOST = '127.0.0.1'
+PORT = 7811
+# longest request line accepted
+LINE_LIMIT = 1 << 20
+
+
+# Job functions. They run in the worker processes, where
+# batch._worker_manager() is the worker's MirageDiskManager. Every path in a
+# request is a name relative to one of the manager's folders under app_root,
+# and a request naming anything outside that folder (an absolute path, .. or
+# a symlink out) is refused, so clients can only touch the application's own
+# files.
+
+
+def _confine(folder, name):
+    root = os.path.realpath(os.path.join(batch._worker_manager().app_root, folder))
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise PermissionError(f'{name} is outside {root}')
+    return path
+
+
+def _create(request):
+    manager = batch._worker_manager()
+    _confine(manager.intermediate_wav, request['source'])
+    _confine(manager.mirage_ready, request['output'] + '.img')
+    return batch.build_image(batch.Job(request['source'], request['output']))
+
+
+def _extract(request):
+    manager = batch._worker_manager()
+    path = _confine(manager.mirage_ready, request['image'])
+    output = _confine(manager.mirage_sounds, request.get('output') or '')
+    return batch.extract_image(path, output)
+
+
+def _convert(request):
+    return riff.convert_wave_file(_confine('', request['source']), _confine('', request['destination']),
+                                  dither=request.get('dither', False), normalize=request.get('normalize', False))
+
+
+def _hfe(request):
+    manager = batch._worker_manager()
+    _confine(manager.mirage_ready, request['image'])
+    _confine(manager.hfe, os.path.splitext(request['image'])[0] + '.hfe')
+    return manager.write_hfe(request['image'])
+
+
+OPERATIONS = {'create': _create, 'extract': _extract, 'convert': _convert, 'hfe': _hfe}
+
+
+class JobServer:
+
+    def __init__(self, workers=None, config_file=None):
+        # a bad config is reported now rather than by every job
+        batch._make_manager(config_file)
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=batch._init_manager,
+                                        initargs=(config_file,))
+        self.server = None
+        self.jobs = 0
+        self.failures = 0
+
+    # start every worker now so the first jobs don't wait for process startup
+    async def warm(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, os.getpid) for _ in range(self.workers)])
+
+    async def run(self, request):
+        op = request.get('op')
+        if op == 'ping':
+            return {'ok': True, 'value': {'jobs': self.jobs, 'failures': self.failures, 'workers': self.workers}}
+        if op == 'metrics':
+            if request.get('format') == 'prometheus':
+                return {'ok': True, 'value': metrics.to_prometheus()}
+            return {'ok': True, 'value': metrics.snapshot()}
+        if op not in OPERATIONS:
+            return {'ok': False, 'error': f'unknown op {op}'}
+        result = await asyncio.get_running_loop().run_in_executor(self.pool, batch._timed, OPERATIONS[op], request,
+                                                                  metrics.enabled)
+        if result.metrics:
+            metrics.merge(result.metrics)
+        self.jobs += 1
+        if result.error:
+            self.failures += 1
+            return {'ok': False, 'seconds': result.seconds, 'error': result.error}
+        return {'ok': True, 'seconds': result.seconds, 'value': result.value}
+
+    async def respond(self, request, writer):
+        response = await self.run(request)
+        response['id'] = request.get('id')
+        try:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+        except ConnectionError:
+            # the client went away; the job itself has finished
+            pass
+
+    async def handle(self, reader, writer):
+        pending = set()
+        while True:
+            try:
+                line = await reader.readline()
+            except (ValueError, ConnectionError):
+                # line over LINE_LIMIT or connection reset
+                break
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('request is not a JSON object')
+            except ValueError as error:
+                writer.write(json.dumps({'id': None, 'ok': False, 'error': f'bad request: {error}'}).encode() + b'\n')
+                continue
+            task = asyncio.create_task(self.respond(request, writer))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+        writer.close()
+
+    async def start(self, socket_path=None, host=HOST, port=PORT):
+        await self.warm()
+        if socket_path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path=socket_path, limit=LINE_LIMIT)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # waiting for the workers blocks, so don't do it on the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.shutdown)
+
+    async def serve_forever(self, socket_path=None, host=HOST, port=PORT):
+        server = await self.start(socket_path, host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            await self.close()
+
+
+# Client side: send a list of requests on one connection and collect the
+# responses, in the order they finish.
+
+
+async def submit(requests, socket_path=None, host=HOST, port=PORT):
+    if socket_path is not None:
+        reader, writer = await asyncio.open_unix_connection(socket_path, limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    for request in requests:
+        writer.write(json.dumps(request).encode() + b'\n')
+    await writer.drain()
+    writer.write_eof()
+    responses = [json.loads(line) async for line in reader]
+    writer.close()
+    return responses
+
+
+def send(requests, socket_path=None, host=HOST, port=PORT):
+    return asyncio.run(submit(requests, socket_path, host, port))
+
+
+def _is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve Mirage image jobs over a socket.')
+    parser.add_argument('--socket', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--allow-remote', action='store_true',
+                        help='allow a --host other than a loopback address (anyone who can connect can run jobs)')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--config', help='config.ini (default: settings/config.ini)')
+    parser.add_argument('--metrics', action='store_true', help='collect metrics for the metrics op')
+    args = parser.parse_args(argv)
+    if args.socket is None and not args.allow_remote and not _is_loopback(args.host):
+        parser.error(f'{args.host} is not a loopback address; pass --allow-remote to serve on it')
+    metrics.enable(args.metrics)
+    server = JobServer(args.workers, args.config)
+    print(f'serving on {args.socket or f"{args.host}:{args.port}"}')
+    try:
+        asyncio.run(server.serve_forever(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
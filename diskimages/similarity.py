@@ -0,0 +1,218 @@
+# Waveform similarity search over the wavetables and extracted wavesamples.
+# Each sample is reduced to a short feature vector: its average magnitude
+# spectrum pooled into log spaced bands, plus RMS level and zero crossing
+# rate. Features are computed for a whole batch at once (the frames of all
+# samples go through rfft together) and kept in an array-backed index.
+# "Sounds like this one" is then one matrix-vector product of cosine
+# similarities and a partial sort, milliseconds even for 100k samples.
+#
+# The index grows in place as samples are added, so a library can be kept
+# up to date incrementally, and is saved as an .npz file. Files are tracked
+# by modification time and size, as BuildManifest does, so a re-scan picks
+# up changed files as well as new ones.
+#
+# Samples are unsigned 8 bit PCM, raw or in a WAV file (wider WAV formats
+# are converted first).
+#
+# usage: python -m diskimages.similarity build FOLDER INDEX
+#        python -m diskimages.similarity update INDEX FOLDER
+#        python -m diskimages.similarity query INDEX SAMPLE [-k N]
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from diskimages import riff
+
+FRAME = 1024
+# frames per rfft call
+CHUNK = 4096
+BANDS = 32
+# weight of the level and zero crossing features relative to the spectrum
+LEVEL_WEIGHT = 0.5
+FEATURES = BANDS + 2
+# the files add_folder indexes: WAV files and raw 8 bit PCM (extracted
+# wavesamples, WavesampleStore objects)
+SAMPLE_SUFFIXES = ('.wav', '.raw', '.bin')
+
+# band edges over the rfft bins, log spaced from bin 1 up to Nyquist
+_EDGES = np.unique(np.geomspace(1, FRAME // 2 + 1, BANDS + 1).astype(np.int64))
+
+
+# Feature vectors of a list of samples (buffers of unsigned 8 bit PCM, any
+# lengths). Returns a float32 array of shape (len(samples), FEATURES), each
+# row unit length.
+
+
+def features(samples):
+    if not samples:
+        return np.zeros((0, FEATURES), dtype=np.float32)
+    arrays = [np.frombuffer(sample, dtype=np.uint8) for sample in samples]
+    # every sample is cut into whole frames, the last one zero padded
+    counts = np.array([max(1, -(-len(array) // FRAME)) for array in arrays])
+    frames = np.zeros((counts.sum(), FRAME), dtype=np.float32)
+    row = 0
+    for array, count in zip(arrays, counts):
+        values = (array.astype(np.float32) - 128) / 128
+        frames.reshape(-1)[row * FRAME:row * FRAME + len(values)] = values
+        row += count
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    window = np.hanning(FRAME).astype(np.float32)
+    # band energies of every frame, a chunk of frames at a time to bound the
+    # memory the rfft needs
+    frame_bands = np.empty((len(frames), len(_EDGES) - 1), dtype=np.float32)
+    for first in range(0, len(frames), CHUNK):
+        spectra = np.abs(np.fft.rfft(frames[first:first + CHUNK] * window, axis=1))
+        frame_bands[first:first + CHUNK] = np.add.reduceat(spectra[:, _EDGES[0]:], _EDGES[:-1] - _EDGES[0], axis=1)
+    bands = np.log1p(np.add.reduceat(frame_bands, starts, axis=0) / counts[:, None])
+    bands /= np.maximum(np.linalg.norm(bands, axis=1, keepdims=True), 1e-9)
+    lengths = np.array([max(1, len(array)) for array in arrays])
+    rms = np.sqrt(np.add.reduceat(np.einsum('ij,ij->i', frames, frames), starts) / lengths)
+    signs = np.signbit(frames)
+    # crossings within frames; the zero padding adds at most one per sample
+    crossings = np.add.reduceat((signs[:, 1:] != signs[:, :-1]).sum(axis=1), starts)
+    zero_crossing_rate = crossings / lengths
+    vectors = np.zeros((len(samples), FEATURES), dtype=np.float32)
+    vectors[:, :bands.shape[1]] = bands
+    vectors[:, BANDS] = LEVEL_WEIGHT * rms
+    vectors[:, BANDS + 1] = LEVEL_WEIGHT * zero_crossing_rate * 4
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+    return vectors
+
+
+class SimilarityIndex:
+
+    def __init__(self, names=(), vectors=None, stamps=None):
+        self.names = list(names)
+        self.positions = {name: position for position, name in enumerate(self.names)}
+        # name -> (mtime_ns, size) of the file its features came from
+        self.stamps = {name: tuple(stamp) for name, stamp in zip(self.names, stamps)} if stamps is not None else {}
+        vectors = np.zeros((0, FEATURES), dtype=np.float32) if vectors is None else vectors
+        # spare rows so adding samples doesn't copy the whole index each time
+        self._vectors = np.zeros((max(64, len(vectors) * 2), FEATURES), dtype=np.float32)
+        self._vectors[:len(vectors)] = vectors
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    @property
+    def vectors(self):
+        return self._vectors[:len(self.names)]
+
+    # Add samples under the given names. A name already in the index has its
+    # features replaced. stamps, if given, are the (mtime_ns, size) of the
+    # files the samples were read from.
+
+    def add(self, names, samples, stamps=None):
+        vectors = features(samples)
+        if stamps is not None:
+            self.stamps.update(zip(names, stamps))
+        new = []
+        for name, vector in zip(names, vectors):
+            if name in self.positions:
+                self._vectors[self.positions[name]] = vector
+            else:
+                new.append((name, vector))
+        needed = len(self.names) + len(new)
+        if needed > len(self._vectors):
+            grown = np.zeros((max(needed, len(self._vectors) * 2), FEATURES), dtype=np.float32)
+            grown[:len(self.names)] = self.vectors
+            self._vectors = grown
+        for name, vector in new:
+            self.positions[name] = len(self.names)
+            self._vectors[len(self.names)] = vector
+            self.names.append(name)
+
+    # Add every sample file (see SAMPLE_SUFFIXES) under a folder tree that is
+    # not in the index yet or has changed since it was added, in batches.
+    # Returns the number added or updated.
+
+    def add_folder(self, folder, batch_size=256, suffixes=SAMPLE_SUFFIXES):
+        paths = sorted(os.path.join(root, name) for root, _, files in os.walk(os.path.abspath(folder))
+                       for name in files if name.lower().endswith(suffixes))
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if path not in self.positions or self.stamps.get(path) != stamp:
+                changed.append((path, stamp))
+        for start in range(0, len(changed), batch_size):
+            chunk = changed[start:start + batch_size]
+            self.add([path for path, _ in chunk], [riff.read_sample(path) for path, _ in chunk],
+                     [stamp for _, stamp in chunk])
+        return len(changed)
+
+    # The k most similar samples to a sample (a buffer) or feature vector, as
+    # (name, cosine similarity) pairs, best first. exclude leaves out a name,
+    # usually the query itself.
+
+    def query(self, sample=None, k=10, vector=None, exclude=None):
+        if vector is None:
+            vector = features([sample])[0]
+        scores = self.vectors @ vector
+        if exclude in self.positions:
+            scores[self.positions[exclude]] = -np.inf
+        k = min(k, len(scores) - (exclude in self.positions))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.names[index], float(scores[index])) for index in best]
+
+    def neighbors(self, name, k=10):
+        return self.query(k=k, vector=self.vectors[self.positions[name]], exclude=name)
+
+    def save(self, path):
+        stamps = np.array([self.stamps.get(name, (-1, -1)) for name in self.names], dtype=np.int64).reshape(-1, 2)
+        np.savez(path, names=np.asarray(self.names, dtype=str), vectors=self.vectors, stamps=stamps)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            # indexes saved before files were tracked have no stamps; their files are read again once
+            stamps = data['stamps'].tolist() if 'stamps' in data.files else None
+            return cls(data['names'].tolist(), data['vectors'], stamps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find similar sounding waveforms.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='index every sample under a folder')
+    build.add_argument('folder')
+    build.add_argument('index', help='output .npz file')
+    update = commands.add_parser('update', help='add new and changed samples under a folder to an index')
+    update.add_argument('index')
+    update.add_argument('folder')
+    query = commands.add_parser('query', help='list the samples most like a sample')
+    query.add_argument('index')
+    query.add_argument('sample')
+    query.add_argument('-k', type=int, default=10)
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        index = SimilarityIndex()
+        added = index.add_folder(args.folder)
+        index.save(args.index)
+        print(f'indexed {added} samples')
+    elif args.command == 'update':
+        index = SimilarityIndex.load(args.index)
+        added = index.add_folder(args.folder)
+        index.save(args.index)
+        print(f'added or updated {added} samples, {len(index)} in the index')
+    else:
+        index = SimilarityIndex.load(args.index)
+        sample = os.path.abspath(args.sample)
+        if sample in index:
+            matches = index.neighbors(sample, args.k)
+        else:
+            matches = index.query(riff.read_sample(sample), args.k)
+        for name, score in matches:
+            print(f'{score:6.3f} {name}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
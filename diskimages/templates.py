@@ -0,0 +1,74 @@
+# In-process cache of template disk images. Building an image used to read
+# the template from disk and then copy it into a second buffer every time.
+# Here each template file is opened once and new images are private
+# (copy-on-write) memory maps of it: pages are only copied when they are
+# written, so the per-image cost is the wavesample data that changes.
+# Entries are keyed by path, modification time and size, so an edited
+# template is picked up on the next build, and the least recently used
+# template is dropped when the cache is full.
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+from diskimages.diskimage import MirageDiskImage
+
+
+class TemplateCache:
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # the open template file for a path, reopening it if it changed on disk.
+    # Call with the lock held.
+    def _open(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            self._entries.move_to_end(path)
+            return entry[1]
+        if entry is not None:
+            entry[1].close()
+        file = open(path, 'rb')
+        self._entries[path] = (key, file)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)[1][1].close()
+        return file
+
+    # A new image that starts as a copy of the template. Writes only touch
+    # the private copy, never the template file. Close the image when done.
+    def clone(self, path):
+        with self._lock:
+            mapping = mmap.mmap(self._open(path).fileno(), 0, access=mmap.ACCESS_COPY)
+        try:
+            return MirageDiskImage(mapping, path)
+        except ValueError:
+            mapping.close()
+            raise
+
+    # The template contents as immutable bytes.
+    def read(self, path):
+        with self._lock:
+            file = self._open(path)
+            file.seek(0)
+            return file.read()
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                self._entries.popitem()[1][1].close()
+
+
+# shared cache used by MirageDiskManager
+TEMPLATE_CACHE = TemplateCache()
+
+
+def clone(path):
+    return TEMPLATE_CACHE.clone(path)
@@ -1,103 +1,125 @@
 # Utility functions needed for audio manipulation
 import hashlib
+import logging
 import os
-import struct
+import random
 import sys
 
+from diskimages import convert
+from diskimages import diskimage
+from diskimages import layout
+from diskimages import metrics
+from diskimages import pipeline
+from diskimages import riff
+
 # Global variables
 WAVHEADER = 44
-TRACK_LENGTH = 5632
+TRACK_LENGTH = layout.TRACK_LENGTH
 
 
-# TODO Should check for presence of WAV header rather than assume one.
+# Strip the header from a wav file, leaving the PCM data. The RIFF chunks are
+# parsed so LIST/fact chunks are handled; anything without a RIFF header is
+# assumed to have the classic 44 byte header.
 # Flag could be used to determine if wav or raw output is desired.
 # Write WAV header if user wants one.
 # In the meantime, the Mirage only uses RAW data so that is what this provides.
 
 
 def remove_waveheader(data):
-    # return data (bytearray) without 44 byte header
+    if riff.is_riff(data):
+        return bytearray(riff.parse_wave(data)[1])
     return data[44: len(data)]
 
 
 def write_file(data, name):
-    output = open(name, 'wb')
-    output.write(data)
-    output.close()
-    print(f'wrote file {name}')
+    with metrics.timer('write'):
+        output = open(name, 'wb')
+        output.write(data)
+        output.close()
+    metrics.count('bytes_written', len(data))
+    logging.info(f'wrote file {name}')
 
 
 # Read from the current working directory or an optional root directory.
 
 
 def read_file_bytes(sample_file, root=None):
-    if root is None:
-        samples = open(os.path.join(sys.path[0], sample_file), 'rb')
+    path = os.path.join(sys.path[0] if root is None else root, sample_file)
+    with metrics.timer('read'):
+        samples = open(path, 'rb')
         data = bytearray(samples.read())
-        print(f'info: data read from source file = {len(data)}.')
         samples.close()
-        return data
-    else:
-        samples = open(os.path.join(root, sample_file), 'rb')
-        data = bytearray(samples.read())
-        print(f'info: data read from source file = {len(data)}.')
-        samples.close()
-        return data
+    metrics.count('bytes_read', len(data))
+    logging.debug(f'data read from {path} = {len(data)}.')
+    return data
 
 
 # Take a data stream consisting of 32 bit floats (audio data) and convert to 8 bit. Assuming little-endian data.
 
 
 def convert_32bf_to_8bit(input_bytes):
-    size = len(input_bytes)
-    # 32 bit floats are 4 byte values.
-    eight_bit = bytearray(int(size / 4))
-    index = 0
-    for i in range(0, size, 4):
-        # read 4 and unpack 4 bytes in little-endian order to a float
-        value = struct.unpack_from('<f',  input_bytes[i: i + 4])
-        # value is expected to be in range -1 to + 1. Convert to 0 - 255.
-        eight_bit[index] = int((value[0] + 1) / 2 * 255)
-        index += 1
-    return eight_bit
-
-
-# Operates on bytearrays and converts 16 to 8 bit. This assumes little-endian byte order.
-# FIXME assumes a wav (riff) file header. Need to test for this instead.
+    # values are expected to be in range -1 to + 1 and are scaled to 0 - 255.
+    return convert.convert_to_8bit(input_bytes, 'float32')
+
+
+# Operates on bytearrays and converts a WAV file to 8 bit. The sample format
+# and channel count come from the fmt chunk, so 16, 24 and 32 bit and stereo
+# files all convert (stereo is mixed down to mono). Data without a RIFF
+# header is taken as 16 bit mono after a 44 byte header, keeping the MSB of
+# each sample unchanged as this function always has.
 
 def convert_16_to_8bit(input_bytes):
-    input_length = len(input_bytes)
-    # length of 8 bit with no header.
-    eightbit_length = (int)((input_length - WAVHEADER) / 2)
-    converted = bytearray(eightbit_length)
-    # little-endian data means data is stored little end (LSB) first.
-    # Skip 44 byte wavheader and start on MSB (2nd byte)
-    index = 0
-    for x in range(45, input_length, 2):
-        # why 45? zero-based. skipping 0-43, then 44 (LSB). 45 is first MSB.
-        converted[index] = input_bytes[x]
-        index += 1
-    print(f'output file length = {len(converted)}')
+    if riff.is_riff(input_bytes):
+        info, pcm = riff.parse_wave(input_bytes)
+        converted = convert.convert_to_8bit(pcm, riff.sample_format(info), info.byteorder, channels=info.channels)
+    else:
+        # reading the data as unsigned 16 bit keeps the MSB unchanged
+        converted = convert.convert_to_8bit(memoryview(input_bytes)[WAVHEADER:], 'uint16')
+    logging.debug(f'output file length = {len(converted)}')
     return converted
 
 
+# Wav files are streamed a block at a time so memory use stays constant no
+# matter how long the recording is. Returns the output file name.
+
+
 def convert_16bitfile_to_8bit(input_file):
-    input_bytes = read_file_bytes(input_file)
-    output = convert_16_to_8bit(input_bytes)
+    source = os.path.join(sys.path[0], input_file)
     # write output to a new file
     name_stub = os.path.basename(input_file)
-    write_file(output, "8bit-" + name_stub)
+    with open(source, 'rb') as stream:
+        streamable = riff.is_riff(stream.read(12))
+    if streamable:
+        riff.convert_wave_file(source, "8bit-" + name_stub)
+        logging.info(f'wrote file {"8bit-" + name_stub}')
+    else:
+        write_file(convert_16_to_8bit(read_file_bytes(input_file)), "8bit-" + name_stub)
+    return "8bit-" + name_stub
+
+
+# Convert every .wav file in a folder to 8bit-<name> in the working
+# directory, with the same output as convert_16bitfile_to_8bit. Files go
+# through the pipeline: reader threads load them, converter threads convert
+# them and writer threads write them, so reads, conversion and writes of
+# different files overlap and only a few files are in memory at once.
+# Returns the pipeline's JobResults, one per file.
 
 
 def convert_16bitfile_folder_to_8bit(input_folder):
-    # iterate the folder for .wav files and convert each
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(".wav"):
-            # convert. need path and file name
-            print(f'converting {os.path.join(input_folder, filename)}')
-            convert_16bitfile_to_8bit(os.path.join(input_folder, filename))
-        else:
-            continue
+    sources = [os.path.abspath(os.path.join(input_folder, filename)) for filename in sorted(os.listdir(input_folder))
+               if filename.lower().endswith(".wav")]
+    results = []
+    for result in pipeline.run_pipeline(sources, read_file_bytes, convert_16_to_8bit, _write_8bit):
+        if result.error:
+            logging.error(f'failed to convert {result.job}\n{result.error}')
+        results.append(result)
+    return results
+
+
+def _write_8bit(source, converted):
+    name = "8bit-" + os.path.basename(source)
+    write_file(converted, name)
+    return name
 
 
 # each block of data includes the wavesample data plus 512 byte chunks
@@ -106,52 +128,48 @@ def convert_16bitfile_folder_to_8bit(input_folder):
 
 
 def collapse_wave_data(samples):
-    clean_wavesample = bytearray(66560)
-    wave_data = 5120
-    skip_data = 512
+    # samples is any buffer starting at the first track of a wavesample
+    # (layout.WAVESAMPLE_SPAN bytes). One gather through the precomputed
+    # layout index copies the data, skipping the first 1024 bytes of
+    # parameter data and the short sectors.
+    logging.debug(f"collapsing {len(samples)} bytes of track data to {layout.WAVESAMPLE_SIZE} bytes")
+    return layout.unpack_span(samples)
 
-    for start in range(13):
-        end = start * wave_data + wave_data
-        print(f"copying bytes {start * TRACK_LENGTH}:{start * TRACK_LENGTH + wave_data}")
-        print(f"to {start * wave_data}:{end}")
-        clean_wavesample[start * wave_data:end] = \
-            samples[start * TRACK_LENGTH:start * TRACK_LENGTH + wave_data]
 
-    # skip first 1024 bytes of parameter data
-    return clean_wavesample[1024:66560]
+# Take a full image (bytes or a MirageDiskImage) and checksum all six wave samples. Each lower/upper pair
+# should match when both halves hold the same data. Returns the hex digests in lh1, uh1 ... uh3 order.
+# For a sector by sector check of the whole image see verify.py.
 
 
-# Take a full image bytearray and verify the wave samples in each upper/lower pair are identical.
-# Read each chunk of data and compare. Could use checksum to avoid brute force method.
-# Only works if upper and lower are the same.
+def verify_image(data):
+    image = data if isinstance(data, diskimage.MirageDiskImage) else diskimage.MirageDiskImage(data)
+    wavesample = bytearray(diskimage.WAVESAMPLE_SIZE)
+    digests = []
+    for half, label in enumerate(diskimage.HALF_NAMES):
+        image.read_wavesample(half, wavesample)
+        # do checksum
+        md5 = hashlib.md5(wavesample)
+        logging.debug(f'{label} checksum = {md5.hexdigest()}')
+        digests.append(md5.hexdigest())
+    return digests
 
 
-def verify_image(data):
-    # chunk to collapse_wave_data and do checksum. Compare with next chunk. And so.
-    sample_metadata = {2, 15, 28, 41, 54, 67}
-    lower1 = bytearray(73216)
-    lower1_start = 2 * 5632
-    lower1[0:73215] = data[lower1_start: lower1_start + 73216]
-    lower1 = collapse_wave_data(lower1)
-    # do checksum
-    lower1_md5 = hashlib.md5(lower1)
-    print(f'first checksum = {lower1_md5.hexdigest()}')
+# Return a random byte array. With a seed the same bytes come back every
+# time, for reproducible tests and benchmarks.
+
 
-    lower2 = bytearray(73216)
-    lower2_start = 15 * 5632
-    lower2[0:73215] = data[lower2_start: lower2_start + 73216]
-    lower2 = collapse_wave_data(lower2)
-    # do checksum
-    lower2_md5 = hashlib.md5(lower2)
-    print(f'second checksum = {lower2_md5.hexdigest()}')
+def create_dummy_data(seed=None, size=65536):
+    # just make a 64KB random data array
+    if seed is None:
+        return bytearray(os.urandom(size))
+    return bytearray(random.Random(seed).randbytes(size))
 
 
-# Return a random byte array.
+# A random full disk image, usable as a synthetic template.
 
 
-def create_dummy_data():
-    # just make a 64KB random data array
-    return bytearray(os.urandom(65536))
+def create_dummy_image(seed=None):
+    return create_dummy_data(seed, layout.IMAGE_SIZE)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+# Full image integrity checks. Every one of the 480 sectors (80 tracks, six
+# sectors each) is checksummed with CRC32 or BLAKE2b and compared against a
+# reference: either the template the image was built from or checksums saved
+# earlier. Differences are reported as (track, sector) pairs. Folders of
+# images are verified on a process pool.
+#
+# usage: python -m diskimages.verify FOLDER (--template IMG | --reference JSON) [--save-reference JSON]
+#        [--algorithm crc32|blake2b] [--all-sectors] [--workers N]
+import argparse
+import hashlib
+import json
+import sys
+import zlib
+from collections import namedtuple
+
+from diskimages import batch
+from diskimages import layout
+from diskimages import metrics
+from diskimages.diskimage import MirageDiskImage
+
+ALGORITHMS = ('crc32', 'blake2b')
+
+VerifyResult = namedtuple('VerifyResult', ['path', 'differences'])
+
+
+def _checksum(data, algorithm):
+    if algorithm == 'crc32':
+        return zlib.crc32(data)
+    if algorithm == 'blake2b':
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    raise ValueError(f'unknown checksum algorithm {algorithm}')
+
+
+# Checksums of all 480 sectors of an image (a MirageDiskImage or any buffer),
+# in disk order. Index with track * 6 + sector.
+
+
+@metrics.timed('verify')
+def sector_checksums(image, algorithm='crc32'):
+    view = image.data if isinstance(image, MirageDiskImage) else memoryview(image)
+    if len(view) != layout.IMAGE_SIZE:
+        raise ValueError(f'disk image is {len(view)} bytes, expected {layout.IMAGE_SIZE}')
+    return [_checksum(view[offset:offset + size], algorithm) for track, sector, offset, size in layout.SECTORS]
+
+
+def file_checksums(path, algorithm='crc32'):
+    with MirageDiskImage.open(path) as image:
+        return sector_checksums(image, algorithm)
+
+
+# (track, sector) of every sector whose checksum differs from the reference.
+# Sectors in skip (e.g. layout.WAVESAMPLE_SECTORS when comparing against the
+# template) are not compared.
+
+
+def compare(checksums, reference, skip=frozenset()):
+    return [(track, sector) for (track, sector, _, _), checksum, expected in zip(layout.SECTORS, checksums, reference)
+            if checksum != expected and (track, sector) not in skip]
+
+
+def save_reference(path, checksums, algorithm):
+    with open(path, 'w') as output:
+        json.dump({'algorithm': algorithm, 'sectors': checksums}, output)
+
+
+def load_reference(path):
+    with open(path) as reference:
+        data = json.load(reference)
+    return data['sectors'], data['algorithm']
+
+
+def verify_file(path, reference, algorithm='crc32', skip=frozenset()):
+    return VerifyResult(path, compare(file_checksums(path, algorithm), reference, skip))
+
+
+def _verify_task(task):
+    path, reference, algorithm, skip = task
+    return verify_file(path, reference, algorithm, skip).differences
+
+
+# Verify every .img under a folder tree against one set of reference
+# checksums, in parallel. Returns batch.JobResults whose value is the list of
+# differing sectors; images that can't be read have an error instead.
+
+
+def verify_directory(folder, reference, algorithm='crc32', skip=frozenset(), workers=None):
+    tasks = [(path, reference, algorithm, skip) for path in batch.find_images(folder)]
+    return sorted(batch.run_jobs(_verify_task, tasks, workers), key=lambda result: result.job[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify Mirage disk images sector by sector.')
+    parser.add_argument('folder', help='folder tree of .img files to verify')
+    parser.add_argument('--template', help='compare against this template image')
+    parser.add_argument('--reference', help='compare against checksums saved with --save-reference')
+    parser.add_argument('--save-reference', metavar='JSON', help='save the template checksums to this file')
+    parser.add_argument('--algorithm', choices=ALGORITHMS, default='crc32')
+    parser.add_argument('--all-sectors', action='store_true',
+                        help='also compare wavesample sectors (by default only OS and parameter sectors are)')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    algorithm = args.algorithm
+    if args.reference:
+        reference, algorithm = load_reference(args.reference)
+    elif args.template:
+        reference = file_checksums(args.template, algorithm)
+        if args.save_reference:
+            save_reference(args.save_reference, reference, algorithm)
+    else:
+        parser.error('--template or --reference is required')
+    skip = frozenset() if args.all_sectors else layout.WAVESAMPLE_SECTORS
+    failures = 0
+    for result in verify_directory(args.folder, reference, algorithm, skip, args.workers):
+        path = result.job[0]
+        if result.error:
+            failures += 1
+            print(f'ERROR  {path}\n{result.error}')
+        elif result.value:
+            failures += 1
+            print(f'DIFFER {path}: ' + ', '.join(f'track {track} sector {sector}' for track, sector in result.value))
+        else:
+            print(f'ok     {path}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from diskimages import archives
+from diskimages import buildmanifest
+from diskimages import preprocessor
+from tests.waves import make_wave
+
+DISKS = ('Strings One', 'Brass')
+
+
+def voice(seed):
+    return bytes(44) + bytes((seed * 7 + index) % 256 for index in range(16384))
+
+
+def disk_files():
+    return {f'IIx_disks/{disk}/EXPORT/VC2WAV/{name}.wav': voice(number * 10 + index)
+            for number, disk in enumerate(DISKS) for index, name in enumerate(('b', 'a', 'c'))}
+
+
+def add_tar_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+class ArchivesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.files = disk_files()
+        self.zip = os.path.join(self.folder.name, 'disks.zip')
+        with zipfile.ZipFile(self.zip, 'w') as archive:
+            archive.writestr('IIx_disks/readme.txt', b'not a sample')
+            for name, data in self.files.items():
+                archive.writestr(name, data)
+        self.tar = os.path.join(self.folder.name, 'disks.tar.gz')
+        with tarfile.open(self.tar, 'w:gz') as archive:
+            for name, data in self.files.items():
+                add_tar_member(archive, name, data)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_members(self):
+        for path in (self.zip, self.tar):
+            self.assertTrue(archives.is_archive(path))
+            members = dict(archives.members(path))
+            self.assertEqual(members, self.files)
+        self.assertEqual(len(list(archives.members(self.zip, suffixes=None))), 7)
+        with self.assertRaises(ValueError):
+            list(archives.members(self.tar, max_size=1000))
+
+    def test_folders(self):
+        for path in (self.zip, self.tar):
+            folders = list(archives.folders(path, 'EXPORT/VC2WAV'))
+            self.assertEqual(sorted(folder.name for folder in folders),
+                             sorted(f'IIx_disks/{disk}/EXPORT/VC2WAV' for disk in DISKS))
+            for folder in folders:
+                self.assertEqual([name.rsplit('/', 1)[1] for name, _ in folder.members], ['a.wav', 'b.wav', 'c.wav'])
+        self.assertEqual(list(archives.folders(self.zip, 'EXPORT/OTHER')), [])
+
+    def test_zip_subfolders_keep_folders_together(self):
+        path = os.path.join(self.folder.name, 'nested.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name in ('a/b/a.wav', 'a/b/c/y.wav', 'a/b/x.wav'):
+                archive.writestr(name, b'data')
+        self.assertEqual([(folder.name, [name for name, _ in folder.members]) for folder in archives.folders(path)],
+                         [('a/b', ['a/b/a.wav', 'a/b/x.wav']), ('a/b/c', ['a/b/c/y.wav'])])
+
+    def test_packed_archive_matches_directory(self):
+        files = {f'{index:02}.raw': bytes([index]) * (3000 + index * 997) for index in range(20)}
+        files['wave.wav'] = make_wave(bytes([7]) * 5000, bits=8, rate=30200)
+        path = os.path.join(self.folder.name, 'loose.tar')
+        with tarfile.open(path, 'w') as archive:
+            for name in sorted(files):
+                add_tar_member(archive, name, files[name])
+        self.assertEqual(archives.sample_lengths(path)[-1], ('wave.wav', 5000, 30200))
+        cwd = os.getcwd()
+        os.chdir(self.folder.name)
+        try:
+            os.makedirs('intermediate_wav')
+            os.makedirs('loose')
+            for name, data in files.items():
+                with open(os.path.join('loose', name), 'wb') as output:
+                    output.write(data)
+            for options in ({}, {'rate': 29411, 'source_rate': 44100}):
+                expected = preprocessor.write_packed_directory_to_intermediate_wav('loose', 'expected.wav', **options)
+                outputs = preprocessor.write_packed_archive_to_intermediate_wav(path, 'streamed.wav', **options)
+                self.assertEqual(len(outputs), len(expected))
+                for output, reference in zip(outputs, expected):
+                    with open(output, 'rb') as streamed, open(reference, 'rb') as packed:
+                        self.assertEqual(streamed.read(), packed.read())
+        finally:
+            os.chdir(cwd)
+
+    def test_scattered_tar_folder_is_an_error(self):
+        path = os.path.join(self.folder.name, 'scattered.tar')
+        with tarfile.open(path, 'w') as archive:
+            for name in ('one/a.wav', 'two/a.wav', 'one/b.wav'):
+                add_tar_member(archive, name, b'data')
+        with self.assertRaises(ValueError):
+            list(archives.folders(path))
+        with self.assertRaises(ValueError):
+            list(archives.map_folders(archives.folders(path), len, lambda folder, value: value))
+
+    def test_fairlight_manifest_checks_every_spill_output(self):
+        cwd = os.getcwd()
+        os.chdir(self.folder.name)
+        try:
+            os.makedirs('intermediate_wav')
+            os.makedirs('many')
+            for index in range(30):
+                with open(os.path.join('many', f'{index:02}.wav'), 'wb') as output:
+                    output.write(voice(index))
+            manifest = buildmanifest.BuildManifest('manifest.json')
+            outputs = preprocessor.write_fairlight_directory_to_intermediate_wav('many', 'many.wav', manifest)
+            self.assertEqual(outputs, preprocessor.fairlight_outputs(os.path.join('intermediate_wav', 'many.wav'), 30))
+            self.assertEqual(len(outputs), 2)
+            self.assertIsNone(preprocessor.write_fairlight_directory_to_intermediate_wav('many', 'many.wav', manifest))
+            os.remove(outputs[1])
+            self.assertEqual(preprocessor.write_fairlight_directory_to_intermediate_wav('many', 'many.wav', manifest),
+                             outputs)
+        finally:
+            os.chdir(cwd)
+
+    def test_fairlight_archive_matches_directory(self):
+        cwd = os.getcwd()
+        os.chdir(self.folder.name)
+        try:
+            os.makedirs('intermediate_wav')
+            os.makedirs('unpacked')
+            for name, data in self.files.items():
+                if name.startswith('IIx_disks/Brass/'):
+                    with open(os.path.join('unpacked', name.rsplit('/', 1)[1]), 'wb') as output:
+                        output.write(data)
+            preprocessor.write_fairlight_directory_to_intermediate_wav('unpacked', 'expected.wav')
+            with open(os.path.join('intermediate_wav', 'expected.wav'), 'rb') as source:
+                expected = source.read()
+            manifest = buildmanifest.BuildManifest('manifest.json')
+            results = preprocessor.write_fairlight_archive_to_intermediate_wavs(self.tar, manifest,
+                                                                                 exclude=('Strings One',))
+            self.assertEqual([(result.job, result.error) for result in results],
+                             [('IIx_disks/Brass/EXPORT/VC2WAV', None)])
+            self.assertEqual(sorted(os.listdir('intermediate_wav')), ['Brass', 'expected.wav'])
+            with open(os.path.join('intermediate_wav', 'Brass'), 'rb') as source:
+                packed = source.read()
+            # directory order is whatever listdir gives, so compare the samples as a set
+            samples = {packed[offset:offset + 16384] for offset in range(0, 3 * 16384, 16384)}
+            self.assertEqual(samples, {expected[offset:offset + 16384] for offset in range(0, 3 * 16384, 16384)})
+            # up to date now
+            self.assertEqual(preprocessor.write_fairlight_archive_to_intermediate_wavs(
+                self.tar, manifest, exclude=('Strings One',)), [])
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+
+from diskimages import batch
+from diskimages import layout
+
+
+def half(value):
+    if value == 3:
+        raise ValueError('bad job')
+    return value / 2
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def test_read_manifest(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'manifest.json')
+            with open(path, 'w') as manifest:
+                json.dump([{'source': '1st_24.wav', 'output': 'first'}, {'source': '2nd_24.wav'}], manifest)
+            self.assertEqual(batch.read_manifest(path),
+                             [batch.Job('1st_24.wav', 'first'), batch.Job('2nd_24.wav', '2nd_24')])
+
+    def test_jobs_from_directory(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for name in ('b.wav', 'a.wav'):
+                open(os.path.join(folder, name), 'wb').close()
+            os.mkdir(os.path.join(folder, 'skipped'))
+            jobs = batch.jobs_from_directory(folder)
+        self.assertEqual([job.output for job in jobs], ['a', 'b'])
+        self.assertTrue(all(os.path.isabs(job.source) for job in jobs))
+
+    def test_failures_do_not_abort_batch(self):
+        results = sorted(batch.run_jobs(half, range(6), workers=2), key=lambda result: result.job)
+        self.assertEqual([result.value for result in results], [0, 0.5, 1, None, 2, 2.5])
+        self.assertIn('bad job', results[3].error)
+        self.assertTrue(all(result.seconds >= 0 for result in results))
+
+    def test_bad_config_is_reported(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config = os.path.join(folder, 'config.ini')
+            with open(config, 'w') as output:
+                output.write('[LOGS]\nLEVEL = WARNING\n')
+            jobs = [batch.Job('a.wav', 'a'), batch.Job('b.wav', 'b')]
+            # checked before the pool starts
+            with self.assertRaises(KeyError):
+                batch.build_images(jobs, workers=2, config_file=config)
+            # a worker that can't set up fails each job, not the pool
+            results = list(batch.run_jobs(batch.build_image, jobs, workers=2, initializer=batch._init_manager,
+                                          initargs=(config,)))
+            self.assertEqual(len(results), 2)
+            self.assertTrue(all('could not be set up' in result.error and 'KeyError' in result.error
+                                for result in results))
+
+    def test_extract_library(self):
+        wavesamples = os.urandom(6 * 65536)
+        image = bytearray(layout.IMAGE_SIZE)
+        layout.pack(image, wavesamples)
+        with tempfile.TemporaryDirectory() as folder:
+            library = os.path.join(folder, 'library')
+            os.makedirs(os.path.join(library, 'set1'))
+            for path in (os.path.join(library, 'one.img'), os.path.join(library, 'set1', 'two.img')):
+                with open(path, 'wb') as output:
+                    output.write(image)
+            with open(os.path.join(library, 'broken.img'), 'wb') as output:
+                output.write(bytes(10))
+            output_root = os.path.join(folder, 'sounds')
+            results = batch.extract_library(library, output_root, workers=2)
+            self.assertEqual(len(results), 3)
+            self.assertEqual(len([result for result in results if result.error]), 1)
+            with open(os.path.join(output_root, 'set1', 'two_uh2.wav'), 'rb') as sound:
+                self.assertEqual(sound.read(), wavesamples[3 * 65536:4 * 65536])
+            with open(os.path.join(output_root, 'extract_manifest.json')) as manifest:
+                self.assertEqual(len(json.load(manifest)['images']), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+from benchmarks import bench
+from diskimages import utility
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_dummy_data_is_seeded(self):
+        self.assertEqual(utility.create_dummy_data(5), utility.create_dummy_data(5))
+        self.assertNotEqual(utility.create_dummy_data(5), utility.create_dummy_data(6))
+        self.assertEqual(len(utility.create_dummy_image(5)), 450560)
+
+    def test_run_all(self):
+        results = bench.run(sizes=(1,), repeat=1)
+        self.assertEqual([result.name for result in results], list(bench.BENCHMARKS))
+        for result in results:
+            self.assertGreater(result.mb_per_s, 0)
+            self.assertGreater(result.images_per_s, 0)
+
+    def test_regressions(self):
+        results = [bench.Result('verify_image', 8, 1.0, 100.0, 10.0), bench.Result('img_to_hfe', 8, 1.0, 70.0, 2.0),
+                   bench.Result('layout_pack', 8, 1.0, 50.0, 2.0)]
+        baseline = {'verify_image/8': {'mb_per_s': 110.0}, 'img_to_hfe/8': {'mb_per_s': 100.0}}
+        slower = bench.regressions(results, baseline, tolerance=0.25)
+        self.assertEqual(slower, [(results[1], 100.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+from diskimages.buildmanifest import BuildManifest
+
+
+class BuildManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.source = self.path('source.wav')
+        self.output = self.path('out.img')
+        self.write(self.source, b'abc')
+        self.write(self.output, b'image')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.folder.name, name)
+
+    def write(self, path, data):
+        with open(path, 'wb') as output:
+            output.write(data)
+
+    def test_stale_until_recorded(self):
+        manifest = BuildManifest(self.path('manifest.json'))
+        self.assertTrue(manifest.is_stale(self.output, [self.source], {'layout': 1}))
+        manifest.record(self.output, [self.source], {'layout': 1})
+        manifest.save()
+        manifest = BuildManifest(self.path('manifest.json'))
+        self.assertFalse(manifest.is_stale(self.output, [self.source], {'layout': 1}))
+        self.assertTrue(manifest.is_stale(self.output, [self.source], {'layout': 2}))
+
+    def test_changed_or_missing_files(self):
+        manifest = BuildManifest(self.path('manifest.json'))
+        manifest.record(self.output, [self.source])
+        self.write(self.source, b'abcd')
+        self.assertTrue(manifest.is_stale(self.output, [self.source]))
+        manifest.record(self.output, [self.source])
+        os.remove(self.output)
+        self.assertTrue(manifest.is_stale(self.output, [self.source]))
+        self.write(self.output, b'image')
+        os.remove(self.source)
+        self.assertTrue(manifest.is_stale(self.output, [self.source]))
+
+    def test_hash_cached_by_stat(self):
+        manifest = BuildManifest(self.path('manifest.json'))
+        digest = manifest.hash(self.source)
+        # same size and mtime: the cached hash is trusted
+        stat = os.stat(self.source)
+        self.write(self.source, b'xyz')
+        os.utime(self.source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(manifest.hash(self.source), digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
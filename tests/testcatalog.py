@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from diskimages import catalog
+from diskimages import layout
+from diskimages import parameters
+from diskimages.diskimage import MirageDiskImage
+from tests import testparameters
+
+
+def make_image(periods, looped):
+    image = bytearray(layout.IMAGE_SIZE)
+    with MirageDiskImage(image) as disk:
+        for half, (period, loop_on) in enumerate(zip(periods, looped)):
+            block = parameters.encode({'sample_period': period},
+                                      [{'end_page': 255, 'loop_on': int(loop_on), 'top_key': 60}])
+            disk.parameter_block(half)[:] = block
+    return image
+
+
+class CatalogTestCase(unittest.TestCase):
+
+    def test_build_and_query(self):
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, 'library', 'b'))
+            with open(os.path.join(folder, 'library', 'a.img'), 'wb') as output:
+                output.write(make_image([34, 30, 34, 25, 34, 34], [False, True, True, False, False, False]))
+            with open(os.path.join(folder, 'library', 'b', 'c.img'), 'wb') as output:
+                output.write(make_image([32] * 6, [True] * 6))
+            with open(os.path.join(folder, 'library', 'broken.img'), 'wb') as output:
+                output.write(bytes(100))
+            built, failures = catalog.build_catalog(os.path.join(folder, 'library'), workers=2)
+            self.assertEqual(len(failures), 1)
+            self.assertEqual(len(built), 12)
+            path = os.path.join(folder, 'catalog.npz')
+            built.save(path)
+            loaded = catalog.Catalog.load(path)
+        found = loaded.rows(loaded.find(looped=True, sample_rate=(30000, None)))
+        a = os.path.join(folder, 'library', 'a.img')
+        c = os.path.join(folder, 'library', 'b', 'c.img')
+        self.assertEqual(found, [(a, 'uh1')] + [(c, name) for name in layout.HALF_NAMES])
+        self.assertEqual(loaded.rows(loaded.find(sample_period=25)), [(a, 'uh2')])
+        self.assertEqual(list(loaded.find(wavesample_count=lambda values: values != 1)), [])
+
+    def test_fixture_block(self):
+        image = make_image([34] * 6, [False] * 6)
+        with MirageDiskImage(image) as disk:
+            disk.parameter_block(4)[:] = testparameters.FIXTURE_BLOCK
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'fixture.img')
+            with open(path, 'wb') as output:
+                output.write(image)
+            built, failures = catalog.build_catalog(folder, workers=1)
+        self.assertEqual(failures, [])
+        self.assertEqual(built.column('sample_rate')[4], 31250.0)
+        self.assertEqual(built.column('sample_period')[4], 32)
+        self.assertEqual(built.column('wavesample_count')[4], 2)
+        self.assertEqual(built.column('top_key')[4], 60)
+        self.assertEqual(built.column('looped').tolist(), [False] * 4 + [True, False])
+        self.assertEqual(built.rows(built.find(looped=True, sample_rate=(31000, None))), [(path, 'lh3')])
+
+    def test_large_query(self):
+        rows = 60000
+        records = np.zeros(rows, dtype=catalog.RECORD_DTYPE)
+        records['sample_period'] = np.arange(rows) % 40 + 20
+        records['wavesamples']['end_page'][:, 0] = 255
+        records['wavesamples']['loop_on'][::3, 0] = 1
+        large = catalog.Catalog([f'disk{index}.img' for index in range(rows // 6)],
+                                np.arange(rows) // 6, np.arange(rows) % 6, records)
+        found = large.find(looped=True, sample_rate=(30000, None))
+        expected = [row for row in range(0, rows, 3) if 1e6 / (row % 40 + 20) >= 30000]
+        self.assertEqual(found.tolist(), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,27 +1,48 @@
 import configparser
 import os
-import platform
+import tempfile
 import unittest
 
 import diskimages.diskmanager
+from diskimages import utility
 from diskimages.diskmanager import MirageDiskManager
 
-home = os.getenv("HOMEPATH")
+
+# settings/config.ini with HOME moved to a temporary folder, so the tests
+# never write under the HOME of the real config (G: is a relative folder
+# anywhere but Windows).
+
+
+def temp_config(folder):
+    config = configparser.ConfigParser()
+    config.read(diskimages.diskmanager.CONFIG_FILE)
+    config['FILES']['HOME'] = folder
+    config_file = os.path.join(folder, 'config.ini')
+    with open(config_file, 'w') as output:
+        config.write(output)
+    return config_file
 
 
 class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config_file = temp_config(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
     def test_config(self):
         # spot check some config values
-        writer = MirageDiskManager()
-        # this is a test specific to my system since I want to use the F drive
-        self.assertEqual(writer.app_root, "F:\wavsyn")
+        writer = MirageDiskManager(self.config_file)
+        self.assertEqual(writer.app_root, self.folder.name + os.path.sep + diskimages.diskmanager.APP)
         self.assertIsNotNone(writer.intermediate_wav)
         self.assertIsNotNone(writer.logfile)
 
     def test_directories(self):
         # verify all directories created
+        MirageDiskManager(self.config_file)
         config = configparser.ConfigParser()
-        config.read("settings" + os.path.sep + "config.ini")
+        config.read(self.config_file)
         # set variables
         if config['FILES']['HOME']:
             self.home = config['FILES']['HOME']
@@ -45,30 +66,35 @@ class ConfigTestCase(unittest.TestCase):
 
 
 class FileWritingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config_file = temp_config(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
 
     def test_write_read_wave_sample(self):
-        mirage = MirageDiskManager()
+        mirage = MirageDiskManager(self.config_file)
         data = bytearray(100)
         testfile = "test.dat"
         mirage.write_wave_sample(data, testfile)
-        # do a test read - another method??
+        self.assertEqual(mirage.read_sample_source(testfile), data)
 
         # reading a 384KB wav file
+        mirage.write_wave_sample(bytes(6 * 65536), "testdata.wav")
         data = mirage.read_sample_source("testdata.wav")
         self.assertEqual(len(data), 6 * 65536)
 
     def test_extraction(self):
         config = configparser.ConfigParser()
-        config.read("settings" + os.path.sep + "config.ini")
-        if platform == "linux" or platform == "linux2" or platform == "darwin":
-            # linux
-            self.home = os.getenv("HOME")
-        if config['FILES']['HOME']:
-            self.home = config['FILES']['HOME']
+        config.read(self.config_file)
+        self.home = config['FILES']['HOME']
         self.app_root = self.home + os.path.sep + diskimages.diskmanager.APP
         self.mirage_sounds = config['FILES']['MIRAGE_SOUNDS']
-        mirage = MirageDiskManager()
+        mirage = MirageDiskManager(self.config_file)
         testfile = "testimage.img"
+        utility.write_file(utility.create_dummy_image(1),
+                           os.path.join(mirage.app_root, mirage.mirage_ready, testfile))
         mirage.extract_wavesamples(testfile)
         # check that it wrote the 6 separate files to MIRAGE_SOUNDS
         listing = os.listdir(self.app_root + os.path.sep + self.mirage_sounds)
@@ -84,5 +110,6 @@ class FileWritingTestCase(unittest.TestCase):
             if os.path.exists(self.app_root + os.path.sep + self.mirage_sounds + os.path.sep + file):
                 os.remove(self.app_root + os.path.sep + self.mirage_sounds + os.path.sep + file)
 
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,82 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from diskimages import convert
+from diskimages import utility
+from tests.waves import make_wave
+
+
+class ConvertTestCase(unittest.TestCase):
+
+    def test_int16_both_byte_orders(self):
+        values = [-32768, -256, 0, 255, 32767]
+        little = struct.pack('<5h', *values)
+        big = struct.pack('>5h', *values)
+        expected = bytearray([0, 127, 128, 128, 255])
+        self.assertEqual(convert.convert_to_8bit(little, 'int16'), expected)
+        self.assertEqual(convert.convert_to_8bit(big, 'int16', 'big'), expected)
+
+    def test_int24(self):
+        # -8388608, -1, 0 and 8388607 little-endian
+        data = bytes([0, 0, 0x80, 0xff, 0xff, 0xff, 0, 0, 0, 0xff, 0xff, 0x7f])
+        self.assertEqual(convert.convert_to_8bit(data, 'int24'), bytearray([0, 127, 128, 255]))
+        big = bytes([0x80, 0, 0, 0xff, 0xff, 0xff, 0, 0, 0, 0x7f, 0xff, 0xff])
+        self.assertEqual(convert.convert_to_8bit(big, 'int24', 'big'), bytearray([0, 127, 128, 255]))
+
+    def test_float_matches_legacy_formula(self):
+        values = [-1.0, -0.5, 0.0, 0.5, 1.0, 2.0]
+        data = struct.pack('<6f', *values)
+        expected = bytearray(int((min(v, 1.0) + 1) / 2 * 255) for v in values)
+        self.assertEqual(utility.convert_32bf_to_8bit(data), expected)
+        self.assertEqual(convert.convert_to_8bit(struct.pack('>6d', *values), 'float64', 'big'), expected)
+
+    def test_normalize(self):
+        data = struct.pack('<3f', -0.25, 0.0, 0.25)
+        self.assertEqual(convert.convert_to_8bit(data, 'float32', normalize=True), bytearray([0, 127, 255]))
+
+    def test_dither_stays_within_one_lsb(self):
+        data = np.full(10000, 0.3, dtype='<f4').tobytes()
+        exact = 1.3 / 2 * 255
+        dithered = np.frombuffer(convert.convert_to_8bit(data, 'float32', dither=True,
+                                                         rng=np.random.default_rng(0)), dtype=np.uint8)
+        # within one LSB of the rounded value, and unbiased on average
+        self.assertTrue(np.all(np.abs(dithered.astype(int) - round(exact)) <= 1))
+        self.assertAlmostEqual(float(dithered.mean()), exact, delta=0.05)
+        self.assertGreater(len(np.unique(dithered)), 1)
+
+    def test_16_to_8bit_wrapper(self):
+        data = bytearray(44) + struct.pack('<3H', 0x0102, 0x8000, 0xff00)
+        self.assertEqual(utility.convert_16_to_8bit(data), bytearray([1, 0x80, 0xff]))
+
+    def convert_both_ways(self, wave):
+        # the in-memory conversion and the streamed file conversion
+        in_memory = utility.convert_16_to_8bit(wave)
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'source.wav')
+            with open(source, 'wb') as output:
+                output.write(wave)
+            cwd = os.getcwd()
+            os.chdir(folder)
+            try:
+                with open(utility.convert_16bitfile_to_8bit(source), 'rb') as converted:
+                    streamed = converted.read()
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(bytes(in_memory), streamed)
+        return in_memory
+
+    def test_16bit_file_stereo(self):
+        pcm = struct.pack('<4h', -16384, -16384, 16384, 16384)
+        self.assertEqual(self.convert_both_ways(make_wave(pcm, channels=2)), bytearray([63, 191]))
+
+    def test_16bit_file_24bit_mono(self):
+        pcm = b''.join(value.to_bytes(3, 'little', signed=True) for value in (-8388608, 8388607, 0))
+        self.assertEqual(self.convert_both_ways(make_wave(pcm, bits=24)), bytearray([0, 255, 128]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from diskimages import diskimage
+from diskimages import utility
+from diskimages.diskimage import MirageDiskImage
+
+
+class MirageDiskImageTestCase(unittest.TestCase):
+
+    def test_write_and_read_wavesample(self):
+        image = MirageDiskImage(bytearray(diskimage.IMAGE_SIZE))
+        data = utility.create_dummy_data()
+        image.write_wavesample(3, data)
+        self.assertEqual(image.read_wavesample(3), data)
+        # parameter block and short sectors are untouched
+        self.assertEqual(bytes(image.parameter_block(3)), bytes(1024))
+        self.assertEqual(bytes(image.sector(diskimage.WAVESAMPLE_TRACKS[3], 5)), bytes(512))
+        self.assertEqual(image.read_wavesample(2), bytearray(65536))
+
+    def test_segments(self):
+        image = MirageDiskImage(bytes(diskimage.IMAGE_SIZE))
+        segments = image.wavesample_segments(0)
+        self.assertEqual(len(segments), 13)
+        self.assertEqual(sum(len(segment) for segment in segments), diskimage.WAVESAMPLE_SIZE)
+        self.assertTrue(segments[0].readonly)
+
+    def test_collapse_matches_image(self):
+        data = bytearray(os.urandom(diskimage.IMAGE_SIZE))
+        image = MirageDiskImage(data)
+        start = diskimage.WAVESAMPLE_TRACKS[1] * diskimage.TRACK_LENGTH
+        self.assertEqual(utility.collapse_wave_data(data[start:start + 72704]), image.read_wavesample(1))
+
+    def test_mapped_file(self):
+        data = utility.create_dummy_data()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'test.img')
+            with open(path, 'wb') as output:
+                output.write(bytes(diskimage.IMAGE_SIZE))
+            with MirageDiskImage.open(path, writable=True) as image:
+                image.write_wavesample(5, data)
+            with MirageDiskImage.open(path) as image:
+                self.assertEqual(image.read_wavesample(5), data)
+                digests = utility.verify_image(image)
+            self.assertEqual(digests[0], digests[1])
+
+    def test_wrong_size(self):
+        with self.assertRaises(ValueError):
+            MirageDiskImage(bytearray(100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import binascii
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from diskimages import batch
+from diskimages import hfe
+from diskimages import layout
+
+
+class HfeWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.image = os.urandom(layout.IMAGE_SIZE)
+        self.hfe = hfe.img_to_hfe(self.image)
+
+    def test_header_and_track_list(self):
+        signature, revision, tracks, sides, encoding, bit_rate, rpm = struct.unpack_from('<8sBBBBHH', self.hfe)
+        self.assertEqual((signature, tracks, sides, bit_rate, rpm), (b'HXCPICFE', 80, 1, 250, 300))
+        offset, length = struct.unpack_from('<HH', self.hfe, 512 + 4 * 79)
+        self.assertEqual(offset, 2 + 79 * hfe.TRACK_BLOCKS)
+        self.assertEqual(length, 2 * hfe.SIDE_BYTES)
+        self.assertEqual(len(self.hfe), (2 + 80 * hfe.TRACK_BLOCKS) * 512)
+
+    def test_track_decodes_to_raw_bytes(self):
+        track = 41
+        start = (2 + track * hfe.TRACK_BLOCKS) * 512
+        blocks = np.frombuffer(self.hfe[start:start + hfe.TRACK_BLOCKS * 512], dtype=np.uint8)
+        side0 = blocks.reshape(-1, 2, 256)[:, 0, :].reshape(-1)[:hfe.SIDE_BYTES]
+        bits = np.unpackbits(hfe.BIT_REVERSE[side0])
+        decoded = np.packbits(bits[1::2])
+        raw = hfe.raw_tracks(self.image)[track]
+        self.assertTrue(np.array_equal(decoded, raw))
+        # sector 2 data and its CRC
+        data_start = hfe.DATA_POSITIONS[2]
+        sector = raw[data_start + 4:data_start + 4 + 1024].tobytes()
+        self.assertEqual(sector, self.image[track * 5632 + 2048:track * 5632 + 3072])
+        crc = binascii.crc_hqx(raw[data_start:data_start + 4 + 1024 + 2].tobytes(), 0xffff)
+        self.assertEqual(crc, 0)
+
+    def test_sync_marks(self):
+        cells = hfe.mfm_encode(hfe.raw_tracks(self.image)[:1])[0]
+        words = cells.view('>u2')
+        self.assertEqual(int(np.count_nonzero(words == hfe.SYNC_A1)), 3 * 2 * 6)
+        self.assertEqual(int(np.count_nonzero(words == hfe.SYNC_C2)), 3)
+
+
+class HfeReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.image = os.urandom(layout.IMAGE_SIZE)
+        self.hfe = bytearray(hfe.img_to_hfe(self.image))
+
+    def test_round_trip(self):
+        self.assertEqual(hfe.hfe_to_img(self.hfe), self.image)
+
+    def test_bad_sector(self):
+        # flip a data cell in the middle of track 3, sector 0
+        start = (2 + 3 * hfe.TRACK_BLOCKS) * 512
+        self.hfe[start + 1024 + 100] ^= 0x02
+        with self.assertRaises(hfe.HfeError):
+            hfe.hfe_to_img(self.hfe)
+        image = hfe.hfe_to_img(self.hfe, strict=False)
+        self.assertEqual(image[3 * 5632:3 * 5632 + 1024], bytes(1024))
+        self.assertEqual(image[4 * 5632:], self.image[4 * 5632:])
+
+    def test_not_hfe(self):
+        with self.assertRaises(hfe.HfeError):
+            hfe.hfe_to_img(bytes(1024))
+
+    def test_extract_from_hfe(self):
+        with tempfile.TemporaryDirectory() as folder:
+            with open(os.path.join(folder, 'field.hfe'), 'wb') as output:
+                output.write(self.hfe)
+            results = batch.extract_library(folder, os.path.join(folder, 'out'), workers=1)
+            self.assertIsNone(results[0].error)
+            with open(os.path.join(folder, 'out', 'field_lh2.wav'), 'rb') as sound:
+                expected = batch.MirageDiskImage(self.image).read_wavesample(2)
+                self.assertEqual(sound.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
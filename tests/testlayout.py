@@ -0,0 +1,52 @@
+import os
+import unittest
+
+from diskimages import layout
+
+
+def pack_with_loops(image, wavesamples):
+    # the original create_disk_image track loop
+    for count in range(6):
+        for x in range(13):
+            position = ((count * 13) + x + 2) * 5632
+            if x == 0:
+                wavesample_position = count * 65536
+                image[position + 1024:position + 5120] = wavesamples[wavesample_position:wavesample_position + 4096]
+            else:
+                wavesample_position = count * 65536 + 4096 + (x - 1) * 5120
+                image[position:position + 5120] = wavesamples[wavesample_position:wavesample_position + 5120]
+
+
+class LayoutTestCase(unittest.TestCase):
+
+    def test_index_covers_wavesamples(self):
+        self.assertEqual(len(layout.SEGMENTS), 78)
+        self.assertEqual(len(set(layout.IMAGE_INDEX.tolist())), 6 * 65536)
+        self.assertFalse(layout.IMAGE_INDEX.flags.writeable)
+        self.assertEqual(layout.WAVESAMPLE_SPAN, 72704)
+
+    def test_pack_matches_original_loop(self):
+        template = os.urandom(layout.IMAGE_SIZE)
+        wavesamples = os.urandom(6 * 65536)
+        expected = bytearray(template)
+        pack_with_loops(expected, wavesamples)
+        image = bytearray(template)
+        layout.pack(image, wavesamples)
+        self.assertEqual(image, expected)
+        self.assertEqual(layout.unpack(image), bytearray(wavesamples))
+
+    def test_unpack_span(self):
+        image = bytearray(layout.IMAGE_SIZE)
+        wavesamples = os.urandom(6 * 65536)
+        layout.pack(image, wavesamples)
+        start = layout.WAVESAMPLE_TRACKS[4] * layout.TRACK_LENGTH
+        self.assertEqual(layout.unpack_span(image[start:start + layout.WAVESAMPLE_SPAN]),
+                         bytearray(wavesamples[4 * 65536:5 * 65536]))
+
+    def test_pack_wrong_size(self):
+        with self.assertRaises(ValueError):
+            layout.pack(bytearray(layout.IMAGE_SIZE), bytes(100))
+
+
+if __name__ == '__main__':
+    unittest.main()
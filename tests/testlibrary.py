@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from diskimages import layout
+from diskimages import samplestore
+from diskimages.library import SampleLibrary
+from diskimages.samplestore import WavesampleStore
+
+
+class SampleLibraryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.images = []
+        for number in range(3):
+            image = bytearray(os.urandom(layout.IMAGE_SIZE))
+            path = os.path.join(self.folder.name, f'disk{number}.img')
+            with open(path, 'wb') as output:
+                output.write(image)
+            self.images.append((path, image))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_from_images_matches_unpack(self):
+        library = SampleLibrary.from_images([path for path, _ in self.images])
+        self.assertEqual(len(library), 18)
+        self.assertEqual(library.records[7].name, 'disk1_uh1')
+        self.assertEqual(bytes(library.data[6:12].reshape(-1)), bytes(layout.unpack(self.images[1][1])))
+
+    def test_images_round_trip(self):
+        library = SampleLibrary.from_images([path for path, _ in self.images])
+        template = bytes(layout.IMAGE_SIZE)
+        images = [bytes(image) for image in library.iter_images(template)]
+        self.assertEqual(len(images), 3)
+        for built, (_, image) in zip(images, self.images):
+            self.assertEqual(bytes(layout.unpack(built)), bytes(layout.unpack(image)))
+        # a partial last image keeps the template's other wavesamples
+        partial = [bytes(image) for image in
+                   SampleLibrary(library.data[:8], library.records[:8]).iter_images(self.images[2][1])]
+        self.assertEqual(len(partial), 2)
+        expected = bytearray(self.images[2][1])
+        layout.pack(expected, bytes(library.data[6:8].reshape(-1)) + bytes(layout.unpack(expected))[2 * 65536:])
+        self.assertEqual(bytes(partial[1]), bytes(expected))
+
+    def test_write_images(self):
+        library = SampleLibrary.from_images([path for path, _ in self.images])
+        paths = library.write_images(bytes(layout.IMAGE_SIZE), os.path.join(self.folder.name, 'out'))
+        self.assertEqual(len(paths), 3)
+        for path, (_, image) in zip(paths, self.images):
+            with open(path, 'rb') as written:
+                self.assertEqual(bytes(layout.unpack(written.read())), bytes(layout.unpack(image)))
+
+    def test_normalize_in_chunks(self):
+        data = np.full((5, layout.WAVESAMPLE_SIZE), 128, dtype=np.uint8)
+        for row in range(4):
+            data[row, 0] = 128 + 10 * (row + 1)
+        library = SampleLibrary(data)
+        with mock.patch('diskimages.library.CHUNK', 2):
+            library.normalize()
+        self.assertEqual(library.data[:, 0].tolist(), [255, 255, 255, 255, 128])
+
+    def test_pack_file_is_memory_mapped(self):
+        library = SampleLibrary.from_images([path for path, _ in self.images])
+        library.hashes(record=True)
+        path = os.path.join(self.folder.name, 'library.pack')
+        library.save(path)
+        loaded = SampleLibrary.load(path)
+        self.assertIsInstance(loaded.data, np.memmap)
+        np.testing.assert_array_equal(loaded.data, library.data)
+        self.assertEqual([record.as_dict() for record in loaded.records],
+                         [record.as_dict() for record in library.records])
+        self.assertEqual(loaded.verify(), [])
+        del loaded
+        writable = SampleLibrary.load(path, mode='r+')
+        writable.data[4, 100] ^= 0xff
+        writable.data.flush()
+        del writable
+        self.assertEqual(SampleLibrary.load(path, mode=None).verify(), [4])
+
+    def test_hashes_and_duplicates(self):
+        library = SampleLibrary.from_images([path for path, _ in self.images])
+        library.data[10] = library.data[3]
+        digests = library.hashes()
+        self.assertEqual(digests[5], samplestore.wavesample_hash(bytes(library.data[5])))
+        self.assertEqual(library.duplicates(), [[3, 10]])
+        with WavesampleStore(os.path.join(self.folder.name, 'store')) as store:
+            library.add_to_store(store)
+            self.assertEqual(len(store), 17)
+            self.assertEqual(store.where(digests[3]), [(self.images[0][0], 'uh2'), (self.images[1][0], 'lh3')])
+
+    def test_from_files_and_normalize(self):
+        path = os.path.join(self.folder.name, 'short.raw')
+        with open(path, 'wb') as output:
+            output.write(bytes([96, 160] * 500))
+        library = SampleLibrary.from_files([path])
+        self.assertEqual(library.records[0].length, 1000)
+        self.assertEqual(int(library.data[0, 1000]), 128)
+        library.normalize()
+        self.assertEqual(library.data[0, :2].tolist(), [1, 255])
+        library.resample(2, 1)
+        self.assertEqual(library.records[0].length, 500)
+        self.assertEqual(library.data.shape, (1, 65536))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from diskimages import layout
+from diskimages import loops
+from diskimages import packing
+from diskimages import parameters
+from diskimages import utility
+from diskimages.diskimage import MirageDiskImage
+from diskimages.diskmanager import MirageDiskManager
+
+CONFIG = """[LOGS]
+LEVEL = WARNING
+LOGFILE = wavsyn.log
+
+[FILES]
+HOME = {home}
+OUTPUT_DISK_IMAGE_FOLDER = mirage_ready
+OUTPUT_HFE_FOLDER = hfe
+INTERMEDIATE_WAV_FOLDER = intermediate_wav
+WAVETABLES = wavetables
+FAIRLIGHT = fairlight
+KAWAIK3 = k3
+MIRAGE_SOUNDS = mirage_sounds
+"""
+
+
+def make_tone(length, period, seed=0):
+    # a noisy attack followed by a steady periodic tone
+    rng = np.random.default_rng(seed)
+    index = np.arange(length)
+    values = 90 * np.sin(2 * np.pi * index / period) + 30 * np.sin(6 * np.pi * index / period)
+    attack = length // 8
+    values[:attack] = rng.uniform(-120, 120, attack)
+    return bytes(np.clip(values + 128, 0, 255).astype(np.uint8))
+
+
+class LoopsTestCase(unittest.TestCase):
+
+    def test_zero_crossings(self):
+        self.assertEqual(list(loops.zero_crossings(bytes([100, 130, 140, 120, 128, 90, 200]))), [1, 4, 6])
+
+    def test_loop_is_whole_periods(self):
+        period = 64
+        loop = loops.find_loop(make_tone(16384, period))
+        self.assertGreater(loop.score, 0.99)
+        self.assertGreaterEqual(loop.end - loop.start, loops.MIN_LENGTH)
+        self.assertGreaterEqual(loop.start, 16384 // 8)
+        self.assertEqual((loop.end - loop.start) % period, 0)
+
+    def test_page_loops(self):
+        loop = loops.find_loop(make_tone(8192, 32), pages=True)
+        self.assertEqual(loop.start % 256, 0)
+        self.assertEqual(loop.end % 256, 0)
+        self.assertGreater(loop.score, 0.99)
+        self.assertIsNone(loops.find_loop(bytes(100)))
+
+    def test_slots_and_entries(self):
+        samples = [make_tone(4000, 50, seed) for seed in range(3)] + [make_tone(20000, 100)]
+        buffers, placements = packing.pack_images(samples, align=parameters.PAGE_SIZE)
+        self.assertTrue(all(placement.offset % 256 == 0 for placement in placements))
+        found = loops.find_loops(buffers[0], [(placement.half * 65536 + placement.offset, placement.length)
+                                              for placement in placements], pages=True)
+        self.assertTrue(all(loop.score > 0.9 for loop in found))
+        tables = loops.wavesample_entries(placements, found)
+        self.assertEqual(sum(len(entries) for entries in tables.values()), 4)
+        image = MirageDiskImage(bytearray(layout.IMAGE_SIZE))
+        for (number, half), entries in tables.items():
+            loops.write_loops(image, half, entries)
+        decoded = parameters.decode(image.parameter_block(placements[3].half))['wavesamples']
+        entry = [wavesample for wavesample in decoded if wavesample['start'] == placements[3].offset][0]
+        self.assertTrue(entry['loop_on'])
+        self.assertEqual(entry['loop_start'], placements[3].offset + found[3].start)
+        self.assertEqual(entry['loop_end'] + 256, placements[3].offset + found[3].end)
+
+    def test_packed_images_with_loops(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config = os.path.join(folder, 'config.ini')
+            with open(config, 'w') as output:
+                output.write(CONFIG.format(home=folder))
+            manager = MirageDiskManager(config)
+            manager.fairlight_template = os.path.join(folder, 'template.img')
+            with open(manager.fairlight_template, 'wb') as output:
+                output.write(utility.create_dummy_image(3))
+            samples = [make_tone(10000, 40 + seed, seed) for seed in range(14)]
+            placements = manager.create_packed_disk_images(samples, 'tones', find_loops=True)
+            results = loops.analyze_library(os.path.join(folder, 'wavsyn', 'mirage_ready'), workers=2, pages=True)
+        self.assertEqual(len(results), 1)
+        used = {placement.half for placement in placements}
+        # halves with an empty wavesample table are analyzed whole
+        analyzed = [(half, loop) for half, entry, loop in results[0].value if half in used]
+        self.assertEqual(len(analyzed), len(placements))
+        self.assertEqual(len(results[0].value), len(placements) + 6 - len(used))
+        self.assertTrue(all(loop is not None and loop.score > 0.9 for half, loop in analyzed))
+
+    def test_packed_images_keep_template_parameters(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config = os.path.join(folder, 'config.ini')
+            with open(config, 'w') as output:
+                output.write(CONFIG.format(home=folder))
+            manager = MirageDiskManager(config)
+            manager.fairlight_template = os.path.join(folder, 'template.img')
+            with open(manager.fairlight_template, 'wb') as output:
+                output.write(utility.create_dummy_image(3))
+            samples = [make_tone(3000 + seed * 100, 40, seed) for seed in range(10)]
+            manager.create_packed_disk_images(samples, 'plain')
+            with MirageDiskImage.open(manager.fairlight_template) as template, \
+                    MirageDiskImage.open(os.path.join(folder, 'wavsyn', 'mirage_ready', 'plain.img')) as image:
+                for half in range(6):
+                    self.assertEqual(bytes(image.parameter_block(half)), bytes(template.parameter_block(half)))
+
+    def test_packed_images_with_tables(self):
+        with tempfile.TemporaryDirectory() as folder:
+            config = os.path.join(folder, 'config.ini')
+            with open(config, 'w') as output:
+                output.write(CONFIG.format(home=folder))
+            manager = MirageDiskManager(config)
+            manager.fairlight_template = os.path.join(folder, 'template.img')
+            with open(manager.fairlight_template, 'wb') as output:
+                output.write(utility.create_dummy_image(3))
+            samples = [make_tone(3000 + seed * 100, 40, seed) for seed in range(10)]
+            verified = []
+            with mock.patch.object(utility, 'write_file', wraps=utility.write_file) as write_file, \
+                    mock.patch.object(utility, 'verify_image', lambda image: verified.append(bytes(image.data))):
+                placements = manager.create_packed_disk_images(samples, 'plain', write_tables=True)
+            path = os.path.join(folder, 'wavsyn', 'mirage_ready', 'plain.img')
+            # the tables go into the clone: the image is written once, as verified
+            self.assertEqual([call.args[1] for call in write_file.call_args_list if call.args[1].endswith('.img')],
+                             [path])
+            with open(path, 'rb') as written:
+                self.assertEqual([written.read()], verified)
+            with MirageDiskImage.open(path) as image:
+                tables = [parameters.decode(image.parameter_block(half))['wavesamples'] for half in range(6)]
+        for placement in placements:
+            self.assertEqual(placement.offset % 256, 0)
+            entry = [wavesample for wavesample in tables[placement.half] if wavesample['start'] == placement.offset]
+            self.assertEqual(len(entry), 1)
+            self.assertFalse(entry[0]['loop_on'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from diskimages import batch
+from diskimages import convert
+from diskimages import metrics
+from diskimages import utility
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.reset()
+
+    def test_disabled_records_nothing(self):
+        metrics.enable(False)
+        metrics.count('bytes_read', 10)
+        with metrics.timer('read'):
+            pass
+        convert.convert_to_8bit(bytes(64))
+        self.assertEqual(metrics.snapshot(), {'counters': {}, 'timers': {}})
+
+    def test_counters_and_timers(self):
+        convert.convert_to_8bit(bytes(64))
+        convert.convert_to_8bit(bytes(32))
+        values = metrics.snapshot()
+        self.assertEqual(values['counters']['samples_converted'], 48)
+        self.assertEqual(values['timers']['convert']['calls'], 2)
+        self.assertGreaterEqual(values['timers']['convert']['seconds'], 0)
+
+    def test_merge_and_prometheus(self):
+        metrics.count('images_built', 2)
+        metrics.merge({'counters': {'images_built': 3}, 'timers': {'write': {'calls': 4, 'seconds': 0.5}}})
+        text = metrics.to_prometheus()
+        self.assertIn('mirage_images_built_total 5\n', text)
+        self.assertIn('mirage_stage_calls_total{stage="write"} 4\n', text)
+        self.assertIn('mirage_stage_seconds_total{stage="write"} 0.500000\n', text)
+
+    def test_worker_metrics_are_collected(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for index in range(3):
+                with open(os.path.join(folder, f'image{index}.img'), 'wb') as image:
+                    image.write(utility.create_dummy_image(index))
+            results = batch.extract_library(folder, os.path.join(folder, 'out'), workers=2)
+        self.assertTrue(all(result.error is None for result in results))
+        values = metrics.snapshot()
+        self.assertEqual(values['counters']['wavesamples_extracted'], 18)
+        self.assertEqual(values['counters']['bytes_written'], 18 * 65536)
+        self.assertEqual(values['timers']['extract_image']['calls'], 3)
+
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'run.prof')
+            with metrics.profile(path):
+                convert.convert_to_8bit(bytes(64))
+            self.assertTrue(os.path.getsize(path) > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
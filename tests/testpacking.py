@@ -0,0 +1,129 @@
+import os
+import unittest
+
+from diskimages import packing
+from diskimages import preprocessor
+
+
+def four_kb_with_loops(tables):
+    # the original wavetable16_to_4KB_sample_source loop
+    output = bytearray(6 * 65536)
+    count = 0
+    for table in tables:
+        chunksize = 1024
+        for x in range(2):
+            for j in range(16):
+                for k in range(4):
+                    sample_start = j * chunksize
+                    sample = table[sample_start: sample_start + chunksize]
+                    index = j * 4 + k
+                    output_start = index * chunksize + count * 65536
+                    output[output_start:output_start + chunksize] = sample
+            count = count + 1
+    return output
+
+
+def repeat_with_loops(tables, repeat, chunksize, passes=1):
+    # the original 8x wavetable and virus loops
+    output = bytearray(6 * 65536)
+    index = 0
+    for x in range(passes):
+        for table in tables:
+            for j in range(repeat):
+                output[index:index + chunksize] = table[0:chunksize]
+                index += chunksize
+    return output
+
+
+class PackingTestCase(unittest.TestCase):
+
+    def test_four_kb_matches_original_loop(self):
+        tables = [os.urandom(16384) for _ in range(3)]
+        self.assertEqual(packing.pack(preprocessor.FOUR_KB_SCHEME, tables), four_kb_with_loops(tables))
+
+    def test_four_kb_ignores_longer_tables(self):
+        tables = [os.urandom(16384) for _ in range(3)]
+        longer = [table + os.urandom(1024) for table in tables]
+        self.assertEqual(packing.pack(preprocessor.FOUR_KB_SCHEME, longer), four_kb_with_loops(tables))
+
+    def test_repeat_matches_original_loop(self):
+        tables = [os.urandom(16384) for _ in range(3)]
+        rules = [packing.Rule(i, repeat=8) for i in range(3)]
+        self.assertEqual(packing.pack(rules, tables), repeat_with_loops(tables, 8, 16384))
+
+    def test_virus_passes_match_original_loop(self):
+        samples = [os.urandom(3000) for _ in range(20)]
+        rules = [packing.Rule(i, length=2048) for i in range(20)] * 3
+        self.assertEqual(packing.pack(rules, samples), repeat_with_loops(samples, 1, 2048, passes=3))
+
+    def test_plan_is_merged(self):
+        rules = (packing.Rule(0, repeat=1), packing.Rule(0, length=100, halves=(5,)))
+        plan = packing.compile_plan(rules, (4096,))
+        self.assertEqual(plan, (packing.Copy(0, 0, 0, 4096), packing.Copy(0, 0, 5 * 65536, 100)))
+        # a chunked copy of a whole table is one block
+        plan = packing.compile_plan((packing.Rule(0, chunk_size=1024),), (16384,))
+        self.assertEqual(plan, (packing.Copy(0, 0, 0, 16384),))
+
+    def test_overflow(self):
+        with self.assertRaises(ValueError):
+            packing.pack([packing.Rule(0, repeat=25)], [bytes(16384)])
+        with self.assertRaises(ValueError):
+            packing.pack([packing.Rule(0, repeat=2, halves=(5,))], [bytes(65536)])
+        # a rule with halves must stay inside each half, not run into the next
+        with self.assertRaises(ValueError):
+            packing.pack([packing.Rule(0, halves=(0,), offset=256)], [bytes(65536)])
+        with self.assertRaises(ValueError):
+            packing.pack([packing.Rule(0, chunk_size=1024, repeat=4, halves=(2, 3))], [bytes(17408)])
+
+    def test_output_buffer(self):
+        output = bytearray(b'\x80' * (6 * 65536))
+        result = packing.pack([packing.Rule(0)], [b'\x01\x02'], output)
+        self.assertIs(result, output)
+        self.assertEqual(output[:3], b'\x01\x02\x80')
+
+    def test_plan_halves_fills_in_order(self):
+        # 30 Fairlight voices: the first 24 fill one image exactly as before, the rest spill into a second
+        placements = packing.plan_halves([16384] * 30)
+        for index, placement in enumerate(placements):
+            self.assertEqual((placement.image, placement.half, placement.offset),
+                             (index // 24, index % 24 // 4, index % 4 * 16384))
+
+    def test_plan_halves_limits(self):
+        # 100 tiny samples still need 13 halves at 8 per half
+        placements = packing.plan_halves([100] * 100)
+        self.assertEqual(len({(placement.image, placement.half) for placement in placements}), 13)
+        with self.assertRaises(ValueError):
+            packing.plan_halves([65537])
+
+    def test_plan_halves_best_fit(self):
+        lengths = [40000, 30000, 25000, 20000, 10000, 5536]
+        placements = packing.plan_halves(lengths, align=1)
+        # 40000 + 25000, 30000 + 20000 + 10000 + 5536
+        self.assertEqual(len({placement.half for placement in placements}), 2)
+
+    def test_pack_images(self):
+        samples = [os.urandom(length) for length in (70, 65536, 30000, 9000, 65536) * 3]
+        buffers, placements = packing.pack_images(samples)
+        self.assertLessEqual(len(buffers), 2)
+        used = {}
+        for placement in placements:
+            start = placement.half * 65536 + placement.offset
+            self.assertEqual(buffers[placement.image][start:start + placement.length], samples[placement.source])
+            self.assertLessEqual(placement.offset + placement.length, 65536)
+            self.assertEqual(placement.offset % 256, 0)
+            used.setdefault((placement.image, placement.half), []).append(placement)
+        for half in used.values():
+            self.assertLessEqual(len(half), packing.MAX_PER_HALF)
+            self.assertLessEqual(sum(placement.length for placement in half), 65536)
+
+    def test_plan_thousands(self):
+        lengths = [(index * 7919) % 16000 + 256 for index in range(5000)]
+        placements = packing.plan_halves(lengths)
+        halves = {(placement.image, placement.half) for placement in placements}
+        # within a few percent of the lower bound for page aligned samples
+        pages = sum(-(-length // 256) * 256 for length in lengths)
+        self.assertLessEqual(len(halves), max(pages / 65536, len(lengths) / 8) * 1.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
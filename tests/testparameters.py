@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import unittest
+
+from diskimages import batch
+from diskimages import layout
+from diskimages import parameters
+from diskimages.diskimage import MirageDiskImage
+
+
+# A parameter block as raw bytes, written out by hand at the offsets of the
+# published Mirage parameter list rather than through parameters.encode: a
+# 32us sampling period, both envelopes set, and two wavesamples, the first
+# looped with a negative fine tune, the second not looped and tuned down.
+# It was not taken from a real disk, so it only checks that the decoder and
+# encoder agree with the documented layout, not that the layout is right.
+FIXTURE_BLOCK = bytes.fromhex(
+    '20000000000000000000000000000000'
+    '001f141f0e001f001f0a300028000000'
+    '00000000000000000000000000000000'
+    '00000000000000000000000000000000'
+    '003f203f00012700fe00000000000000'
+    '40ff40ff00003cff0000000000000000').ljust(1024, b'\0')
+
+
+def make_block(period, loop_on=False, count=2):
+    wavesamples = [{'start_page': index * 32, 'end_page': index * 32 + 31, 'loop_start_page': index * 32 + 8,
+                    'loop_end_page': index * 32 + 31, 'loop_on': int(loop_on), 'top_key': 30 + index * 20}
+                   for index in range(count)]
+    return parameters.encode({'sample_period': period, 'amp_attack': 12, 'filter_cutoff': 99}, wavesamples)
+
+
+class ParametersTestCase(unittest.TestCase):
+
+    def test_block_layout(self):
+        self.assertEqual(parameters.BLOCK_DTYPE.itemsize, 1024)
+        block = make_block(34)
+        self.assertEqual(block[0x00], 34)
+        self.assertEqual(block[0x15], 12)
+        # second wavesample entry, top key
+        self.assertEqual(block[0x40 + 0x10 + 0x6], 50)
+
+    def test_decode(self):
+        values = parameters.decode(make_block(34, loop_on=True))
+        self.assertAlmostEqual(values['sample_rate'], 29411.76, places=1)
+        self.assertEqual(values['amp_attack'], 12)
+        self.assertEqual(values['filter_cutoff'], 99)
+        self.assertEqual(len(values['wavesamples']), 2)
+        second = values['wavesamples'][1]
+        self.assertTrue(second['loop_on'])
+        self.assertEqual((second['start'], second['loop_start']), (32 * 256, 40 * 256))
+
+    def test_fixture_matches_documented_layout(self):
+        values = parameters.decode(FIXTURE_BLOCK)
+        self.assertEqual(values['sample_period'], 32)
+        self.assertEqual(values['sample_rate'], 31250.0)
+        self.assertEqual([values[name] for name in ('filter_attack', 'filter_peak', 'filter_decay', 'filter_sustain',
+                                                    'filter_release')], [0, 31, 20, 31, 14])
+        self.assertEqual([values[name] for name in ('amp_attack', 'amp_peak', 'amp_decay', 'amp_sustain',
+                                                    'amp_release')], [0, 31, 0, 31, 10])
+        self.assertEqual((values['filter_cutoff'], values['filter_resonance']), (48, 0))
+        self.assertEqual((values['lfo_speed'], values['lfo_depth']), (40, 0))
+        first, second = values['wavesamples']
+        self.assertEqual((first['start'], first['end'], first['loop_start'], first['loop_end']),
+                         (0, 0x3f00, 0x2000, 0x3f00))
+        self.assertEqual((first['loop_on'], first['top_key'], first['relative_tune'], first['fine_tune']),
+                         (True, 39, 0, -2))
+        self.assertEqual((second['start_page'], second['end_page'], second['loop_on'], second['top_key']),
+                         (0x40, 0xff, False, 60))
+        self.assertEqual(second['relative_tune'], -1)
+        # the encoder writes the same bytes
+        block = parameters.encode({'sample_period': 32, 'filter_peak': 31, 'filter_decay': 20, 'filter_sustain': 31,
+                                   'filter_release': 14, 'amp_peak': 31, 'amp_sustain': 31, 'amp_release': 10,
+                                   'filter_cutoff': 48, 'lfo_speed': 40},
+                                  [{name: first[name] for name in parameters.WAVESAMPLE_FIELDS},
+                                   {name: second[name] for name in parameters.WAVESAMPLE_FIELDS}])
+        self.assertEqual(bytes(block), FIXTURE_BLOCK)
+
+    def test_encode_keeps_other_fields(self):
+        block = make_block(34)
+        with self.assertRaises(ValueError):
+            parameters.encode({'sample_period': 25}, block=block)
+        self.assertEqual(parameters.decode(block)['sample_period'], 34)
+        parameters.encode({'sample_period': 25}, block=block, experimental=True)
+        values = parameters.decode(block)
+        self.assertEqual(values['sample_period'], 25)
+        self.assertEqual(values['amp_attack'], 12)
+        with self.assertRaises(KeyError):
+            parameters.encode({'volume': 1})
+
+    def test_decode_many(self):
+        blocks = parameters.decode_blocks(bytes(make_block(30)) + bytes(make_block(40)))
+        self.assertEqual(list(parameters.sample_rate(blocks['sample_period']).round()), [33333, 25000])
+        self.assertEqual(parameters.period_for_rate(29411), 34)
+        with self.assertRaises(ValueError):
+            parameters.decode_blocks(bytes(1000))
+
+    def test_extract_with_parameters(self):
+        image = bytearray(layout.IMAGE_SIZE)
+        with MirageDiskImage(image) as disk:
+            disk.parameter_block(2)[:] = make_block(30, loop_on=True)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'sound.img')
+            with open(path, 'wb') as output:
+                output.write(image)
+            outputs = batch.extract_image(path, folder, with_parameters=True)
+            self.assertEqual(len(outputs), 7)
+            with open(os.path.join(folder, 'sound_params.json')) as params:
+                values = json.load(params)
+        self.assertEqual(values['lh2']['sample_period'], 30)
+        self.assertEqual(values['lh1']['wavesamples'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from diskimages import layout
+from diskimages import parameters
+from diskimages import patch
+from diskimages.diskimage import MirageDiskImage
+
+
+class PatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.original = os.urandom(layout.IMAGE_SIZE)
+        self.paths = []
+        for number in range(3):
+            path = os.path.join(self.folder.name, f'disk{number}.img')
+            with open(path, 'wb') as output:
+                output.write(self.original)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def read(self, path):
+        with open(path, 'rb') as source:
+            return source.read()
+
+    def test_replace_wavesample(self):
+        wavesample = os.urandom(layout.WAVESAMPLE_SIZE)
+        written = patch.apply_patches(self.paths[0], patch.half_patches(3, wavesample))
+        self.assertLessEqual(written, layout.WAVESAMPLE_SIZE)
+        expected = bytearray(self.original)
+        with MirageDiskImage(expected) as image:
+            image.write_wavesample(3, wavesample)
+        self.assertEqual(self.read(self.paths[0]), bytes(expected))
+        self.assertFalse(os.path.exists(patch.journal_path(self.paths[0])))
+        # the same patch again changes nothing
+        self.assertEqual(patch.apply_patches(self.paths[0], patch.half_patches(3, wavesample)), 0)
+
+    def test_only_changed_bytes_are_written(self):
+        sector = bytearray(self.original[5 * layout.TRACK_LENGTH + layout.SECTOR_SIZE:][:layout.SECTOR_SIZE])
+        sector[10] ^= 1
+        sector[900] ^= 1
+        with mock.patch.object(patch, '_pwrite', wraps=patch._pwrite) as pwrite:
+            self.assertEqual(patch.apply_patches(self.paths[0], [patch.sector_patch(5, 1, sector)]), 2)
+        self.assertEqual([call.args[2] for call in pwrite.call_args_list],
+                         [5 * layout.TRACK_LENGTH + layout.SECTOR_SIZE + offset for offset in (10, 900)])
+        with self.assertRaises(ValueError):
+            patch.sector_patch(5, 5, sector)
+
+    def test_parameter_edit_keeps_other_fields(self):
+        patch.apply_patches(self.paths[0], [patch.ParameterEdit(2, {'sample_period': 40}, experimental=True)])
+        with MirageDiskImage(bytearray(self.read(self.paths[0]))) as image:
+            values = parameters.decode(image.parameter_block(2))
+        with MirageDiskImage(bytearray(self.original)) as image:
+            before = parameters.decode(image.parameter_block(2))
+        self.assertEqual(values['sample_period'], 40)
+        self.assertEqual(values['filter_cutoff'], before['filter_cutoff'])
+        self.assertEqual(values['wavesamples'], before['wavesamples'])
+
+    def test_parameter_edit_needs_experimental(self):
+        with self.assertRaises(ValueError):
+            patch.apply_patches(self.paths[0], [patch.ParameterEdit(2, {'sample_period': 40})])
+        with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+            patch.main([self.paths[0], '--half', 'lh2', '--period', '40'])
+        self.assertEqual(self.read(self.paths[0]), self.original)
+
+    def test_parameter_edit_after_block_patch(self):
+        block = parameters.encode({'amp_attack': 12, 'filter_cutoff': 99, 'sample_period': 34})
+        patch.apply_patches(self.paths[0], [patch.parameter_patch(0, block),
+                                            patch.ParameterEdit(0, {'sample_period': 30}, experimental=True)])
+        with MirageDiskImage(bytearray(self.read(self.paths[0]))) as image:
+            values = parameters.decode(image.parameter_block(0))
+        self.assertEqual((values['amp_attack'], values['filter_cutoff'], values['sample_period']), (12, 99, 30))
+
+    def test_failed_write_rolls_back(self):
+        patches = patch.half_patches(0, os.urandom(layout.WAVESAMPLE_SIZE))
+        real = patch._pwrite
+        calls = []
+
+        def failing(file, data, offset):
+            calls.append(offset)
+            if len(calls) == 5:
+                raise OSError('disk full')
+            real(file, data, offset)
+
+        with mock.patch.object(patch, '_pwrite', failing):
+            with self.assertRaises(OSError):
+                patch.apply_patches(self.paths[0], patches)
+        self.assertEqual(self.read(self.paths[0]), self.original)
+        self.assertFalse(os.path.exists(patch.journal_path(self.paths[0])))
+
+    def test_recover_from_journal(self):
+        patches = patch.half_patches(1, os.urandom(layout.WAVESAMPLE_SIZE))
+        real = patch._pwrite
+        calls = []
+
+        def dying(file, data, offset):
+            calls.append(offset)
+            if len(calls) == 7:
+                raise OSError('crash')
+            real(file, data, offset)
+
+        # the process dies part way: nothing is rolled back and the journal stays
+        with mock.patch.object(patch, '_pwrite', dying), mock.patch.object(patch, '_restore'), \
+                mock.patch.object(patch.os, 'remove'):
+            with self.assertRaises(OSError):
+                patch.apply_patches(self.paths[1], patches)
+        self.assertNotEqual(self.read(self.paths[1]), self.original)
+        self.assertTrue(patch.recover(self.paths[1]))
+        self.assertEqual(self.read(self.paths[1]), self.original)
+        self.assertFalse(patch.recover(self.paths[1]))
+        # a patch after a crash recovers first
+        with mock.patch.object(patch, '_pwrite', dying), mock.patch.object(patch, '_restore'), \
+                mock.patch.object(patch.os, 'remove'):
+            calls.clear()
+            with self.assertRaises(OSError):
+                patch.apply_patches(self.paths[1], patches)
+        silence = bytes(layout.WAVESAMPLE_SIZE)
+        self.assertGreater(patch.apply_patches(self.paths[1], patch.half_patches(1, silence)), 0)
+        expected = bytearray(self.original)
+        with MirageDiskImage(expected) as image:
+            image.write_wavesample(1, bytes(layout.WAVESAMPLE_SIZE))
+        self.assertEqual(self.read(self.paths[1]), bytes(expected))
+        self.assertFalse(os.path.exists(patch.journal_path(self.paths[1])))
+
+    def test_patch_images_in_batch(self):
+        block = parameters.encode({'sample_period': 30})
+        results = patch.patch_images([(path, [patch.parameter_patch(0, block)]) for path in self.paths] +
+                                     [(os.path.join(self.folder.name, 'missing.img'), [])], workers=2)
+        self.assertEqual([result.job[0] for result in results], sorted(self.paths + [results[-1].job[0]]))
+        self.assertIsNotNone(results[-1].error)
+        for path in self.paths:
+            data = self.read(path)
+            offset = layout.WAVESAMPLE_TRACKS[0] * layout.TRACK_LENGTH
+            self.assertEqual(data[offset:offset + layout.PARAMETER_SIZE], bytes(block))
+            self.assertEqual(data[offset + layout.PARAMETER_SIZE:], self.original[offset + layout.PARAMETER_SIZE:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from diskimages import pipeline
+from diskimages import preprocessor
+from diskimages import utility
+from tests.waves import make_wave
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def test_every_item_passes_all_stages(self):
+        written = {}
+        results = list(pipeline.run_pipeline(range(100), lambda item: item, lambda value: value * 2,
+                                             lambda item, value: written.setdefault(item, value)))
+        self.assertEqual(sorted(result.job for result in results), list(range(100)))
+        self.assertEqual(written, {item: item * 2 for item in range(100)})
+        self.assertTrue(all(result.error is None and result.value == result.job * 2 for result in results))
+
+    def test_errors_skip_later_stages(self):
+        written = []
+
+        def convert(value):
+            if value % 10 == 0:
+                raise ValueError(f'bad item {value}')
+            return value
+
+        results = list(pipeline.run_pipeline(range(50), lambda item: item, convert,
+                                             lambda item, value: written.append(item)))
+        failed = sorted(result.job for result in results if result.error)
+        self.assertEqual(failed, list(range(0, 50, 10)))
+        self.assertEqual(len(written), 45)
+        self.assertTrue(all('bad item' in result.error for result in results if result.error))
+
+    def test_failing_items_are_raised(self):
+        def items():
+            yield from range(5)
+            raise ValueError('corrupt archive')
+
+        seen = []
+        with self.assertRaises(ValueError):
+            for result in pipeline.run_pipeline(items(), lambda item: item, lambda value: value,
+                                                lambda item, value: value):
+                seen.append(result.job)
+        self.assertEqual(sorted(seen), list(range(5)))
+
+    def test_backpressure(self):
+        # a slow writer holds back the reader
+        lock = threading.Lock()
+        state = {'read': 0, 'written': 0, 'most': 0}
+
+        def read(item):
+            with lock:
+                state['read'] += 1
+                state['most'] = max(state['most'], state['read'] - state['written'])
+            return item
+
+        def write(item, value):
+            time.sleep(0.002)
+            with lock:
+                state['written'] += 1
+
+        list(pipeline.run_pipeline(range(200), read, lambda value: value, write, readers=1, converters=1,
+                                   writers=1, depth=2))
+        self.assertEqual(state['written'], 200)
+        # depth per queue plus one item held by each stage
+        self.assertLessEqual(state['most'], 4 * 2 + 3)
+
+    def test_stop_early(self):
+        results = pipeline.run_pipeline(range(100), lambda item: item, lambda value: value,
+                                        lambda item, value: value, depth=1)
+        next(results)
+        results.close()
+
+    def test_convert_folder(self):
+        with tempfile.TemporaryDirectory() as folder:
+            pcm = struct.pack('<4h', -32768, 0, 256, 32767)
+            for index in range(5):
+                with open(os.path.join(folder, f'table{index}.wav'), 'wb') as wave:
+                    wave.write(make_wave(pcm, channels=2 if index == 4 else 1))
+            with open(os.path.join(folder, 'notes.txt'), 'w') as notes:
+                notes.write('skip me')
+            os.makedirs(os.path.join(folder, 'single'))
+            working = os.getcwd()
+            os.chdir(folder)
+            try:
+                results = utility.convert_16bitfile_folder_to_8bit(folder)
+                os.chdir('single')
+                for index in range(5):
+                    utility.convert_16bitfile_to_8bit(os.path.join(folder, f'table{index}.wav'))
+            finally:
+                os.chdir(working)
+            self.assertEqual(len(results), 5)
+            self.assertTrue(all(result.error is None for result in results))
+            for index in range(5):
+                with open(os.path.join(folder, f'8bit-table{index}.wav'), 'rb') as output, \
+                        open(os.path.join(folder, 'single', f'8bit-table{index}.wav'), 'rb') as single:
+                    self.assertEqual(output.read(), single.read())
+            with open(os.path.join(folder, '8bit-table4.wav'), 'rb') as stereo:
+                self.assertEqual(len(stereo.read()), 2)
+
+    def test_convert_folder_stages(self):
+        # the converter gets the file's bytes and the writer the converted data
+        with tempfile.TemporaryDirectory() as folder:
+            with open(os.path.join(folder, 'table.wav'), 'wb') as wave:
+                wave.write(make_wave(struct.pack('<2h', 0, 256)))
+            working = os.getcwd()
+            os.chdir(folder)
+            try:
+                with mock.patch.object(utility, 'convert_16_to_8bit', wraps=utility.convert_16_to_8bit) as convert, \
+                        mock.patch.object(utility, 'write_file', wraps=utility.write_file) as write:
+                    results = utility.convert_16bitfile_folder_to_8bit(folder)
+            finally:
+                os.chdir(working)
+        self.assertEqual([(result.value, result.error) for result in results], [('8bit-table.wav', None)])
+        self.assertEqual(bytes(convert.call_args.args[0]), make_wave(struct.pack('<2h', 0, 256)))
+        self.assertEqual(write.call_args.args, (bytearray([128, 129]), '8bit-table.wav'))
+
+    def test_bulk_process_virus(self):
+        values = struct.pack('<40000f', *[(index % 200) / 100 - 1 for index in range(40000)])
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, 'tables'))
+            with open(os.path.join(folder, 'tables', 'saw one.wav'), 'wb') as table:
+                table.write(bytes(100) + values)
+            working = os.getcwd()
+            os.chdir(folder)
+            try:
+                results = preprocessor.bulk_process_virus(os.path.join(folder, 'tables'))
+            finally:
+                os.chdir(working)
+            self.assertEqual([(result.value, result.error) for result in results], [('saw_one_8bit.wav', None)])
+            with open(os.path.join(folder, 'saw_one_8bit.wav'), 'rb') as output:
+                self.assertEqual(output.read(), bytes(utility.convert_32bf_to_8bit(values)))
+
+
+if __name__ == '__main__':
+    unittest.main()
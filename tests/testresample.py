@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from diskimages import preprocessor
+from diskimages import resample
+
+
+class ResampleTestCase(unittest.TestCase):
+
+    def test_sine_keeps_frequency(self):
+        source = np.sin(2 * np.pi * 440 * np.arange(16384) / resample.FAIRLIGHT_RATE)
+        for quality, tolerance in (('fast', 5e-3), ('medium', 1e-3), ('best', 1e-4)):
+            result = resample.resample(source, resample.FAIRLIGHT_RATE, resample.MIRAGE_RATE, quality)
+            self.assertEqual(len(result), 16384 * resample.MIRAGE_RATE // resample.FAIRLIGHT_RATE)
+            expected = np.sin(2 * np.pi * 440 * np.arange(len(result)) / resample.MIRAGE_RATE)
+            self.assertLess(np.max(np.abs(result - expected)[100:-100]), tolerance)
+
+    def test_downsampling_filters_aliases(self):
+        # 8kHz is above the Nyquist frequency of 11025Hz, so it must not fold back in
+        source = np.sin(2 * np.pi * 8000 * np.arange(44100) / 44100)
+        for quality, level in (('fast', 1e-2), ('medium', 1e-3), ('best', 1e-4)):
+            result = resample.resample(source, 44100, 11025, quality)
+            self.assertLess(np.sqrt(np.mean(result[200:-200] ** 2)), level)
+        # a tone below it passes
+        source = np.sin(2 * np.pi * 1000 * np.arange(44100) / 44100)
+        result = resample.resample(source, 44100, 11025)
+        expected = np.sin(2 * np.pi * 1000 * np.arange(len(result)) / 11025)
+        self.assertLess(np.max(np.abs(result - expected)[100:-100]), 1e-3)
+
+    def test_batch_matches_single(self):
+        samples = np.random.default_rng(0).uniform(-1, 1, (3, 5000))
+        batch = resample.resample(samples, 44100, 29411, 'fast')
+        for row, expected in zip(samples, batch):
+            self.assertTrue(np.allclose(resample.resample(row, 44100, 29411, 'fast'), expected))
+
+    def test_same_rate_8bit_is_identity(self):
+        data = bytes(np.random.default_rng(1).integers(0, 256, 4096, dtype=np.uint8))
+        self.assertEqual(resample.resample_8bit(data, 29411, 29411), bytearray(data))
+
+    def test_fairlight_preprocessor_resamples(self):
+        tone = np.rint(np.sin(2 * np.pi * 440 * np.arange(16384) / resample.FAIRLIGHT_RATE) * 100 + 128)
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'voice')
+            os.makedirs(source)
+            os.makedirs(os.path.join(folder, 'intermediate_wav'))
+            with open(os.path.join(source, 'a.wav'), 'wb') as output:
+                output.write(bytes(44) + tone.astype(np.uint8).tobytes())
+            cwd = os.getcwd()
+            os.chdir(folder)
+            try:
+                preprocessor.write_fairlight_directory_to_intermediate_wav(source, 'voice.wav',
+                                                                           rate=resample.MIRAGE_RATE)
+            finally:
+                os.chdir(cwd)
+            with open(os.path.join(folder, 'intermediate_wav', 'voice.wav'), 'rb') as result:
+                data = result.read()
+        self.assertEqual(len(data), 6 * 65536)
+        length = 16384 * resample.MIRAGE_RATE // resample.FAIRLIGHT_RATE
+        self.assertEqual(data[length:16384], bytes([128]) * (16384 - length))
+        self.assertNotEqual(data[:length], tone.astype(np.uint8).tobytes()[:length])
+
+    def test_packed_preprocessor_resamples(self):
+        tone = np.rint(np.sin(2 * np.pi * 440 * np.arange(22050) / 44100) * 100 + 128).astype(np.uint8).tobytes()
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'loose')
+            os.makedirs(source)
+            os.makedirs(os.path.join(folder, 'intermediate_wav'))
+            with open(os.path.join(source, 'tone.raw'), 'wb') as output:
+                output.write(tone)
+            cwd = os.getcwd()
+            os.chdir(folder)
+            try:
+                outputs = preprocessor.write_packed_directory_to_intermediate_wav(
+                    'loose', 'tone.wav', rate=resample.MIRAGE_RATE, source_rate=44100, quality='best')
+                with open(outputs[0], 'rb') as result:
+                    data = result.read()
+            finally:
+                os.chdir(cwd)
+        length = 22050 * resample.MIRAGE_RATE // 44100
+        expected = np.sin(2 * np.pi * 440 * np.arange(length) / resample.MIRAGE_RATE) * 100 + 128
+        values = np.frombuffer(data[:length], dtype=np.uint8).astype(np.float64)
+        # within the rounding of the source and the output
+        self.assertLess(np.max(np.abs(values - expected)[100:-100]), 1.5)
+        self.assertEqual(data[length:65536].strip(b'\0'), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
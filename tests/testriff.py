@@ -0,0 +1,54 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+from diskimages import riff
+from diskimages import utility
+from tests.waves import make_wave
+
+
+class RiffTestCase(unittest.TestCase):
+
+    def test_skips_list_and_fact_chunks(self):
+        pcm = struct.pack('<4h', -32768, 0, 256, 32767)
+        data = make_wave(pcm, extra_chunks=[(b'LIST', b'INFOabc'), (b'fact', b'\x04\x00\x00\x00')])
+        info, view = riff.parse_wave(data)
+        self.assertEqual(info.channels, 1)
+        self.assertEqual(riff.sample_format(info), 'int16')
+        self.assertEqual(bytes(view), pcm)
+        self.assertEqual(utility.remove_waveheader(bytearray(data)), bytearray(pcm))
+
+    def test_extensible_float(self):
+        data = make_wave(struct.pack('<2f', -1.0, 1.0), bits=32, format_tag=riff.WAVE_FORMAT_IEEE_FLOAT,
+                         extensible=True)
+        info = riff.read_wave_info(io.BytesIO(data))
+        self.assertEqual(riff.sample_format(info), 'float32')
+
+    def test_blocks_cover_data(self):
+        pcm = os.urandom(2 * 1001)
+        stream = io.BytesIO(make_wave(pcm, extra_chunks=[(b'LIST', b'x' * 33)]))
+        info = riff.read_wave_info(stream)
+        blocks = [bytes(block) for block in riff.iter_blocks(stream, info, block_frames=100)]
+        self.assertTrue(all(len(block) <= 200 for block in blocks))
+        self.assertEqual(b''.join(blocks), pcm)
+
+    def test_convert_wave_file_stereo(self):
+        pcm = struct.pack('<6h', 32767, 32767, -32768, -32768, 32767, -32768)
+        with tempfile.TemporaryDirectory() as folder:
+            source = os.path.join(folder, 'in.wav')
+            destination = os.path.join(folder, 'out.raw')
+            with open(source, 'wb') as output:
+                output.write(make_wave(pcm, channels=2))
+            self.assertEqual(riff.convert_wave_file(source, destination, block_frames=2), 3)
+            with open(destination, 'rb') as result:
+                self.assertEqual(result.read(), bytes([254, 0, 127]))
+
+    def test_not_a_wave(self):
+        with self.assertRaises(ValueError):
+            riff.read_wave_info(io.BytesIO(bytes(100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
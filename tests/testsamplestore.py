@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from diskimages import batch
+from diskimages import layout
+from diskimages import preprocessor
+from diskimages.samplestore import WavesampleStore
+
+
+class WavesampleStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.folder.name, 'store')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_put_dedups_and_persists_index(self):
+        wavesample = os.urandom(65536)
+        with WavesampleStore(self.root) as store:
+            digest = store.put(wavesample, 'a.img', 'lh1')
+            self.assertEqual(store.put(bytearray(wavesample), 'b.img', 'uh3'), digest)
+            store.put(wavesample, 'a.img', 'lh1')
+            self.assertEqual(len(store), 1)
+        with WavesampleStore(self.root) as store:
+            self.assertEqual(store.where(wavesample), [('a.img', 'lh1'), ('b.img', 'uh3')])
+            self.assertEqual(store.get(digest), wavesample)
+            self.assertEqual(store.where('0' * 32), [])
+
+    def test_extract_library_into_store(self):
+        wavesample = os.urandom(65536)
+        image = bytearray(layout.IMAGE_SIZE)
+        layout.pack(image, wavesample * 6)
+        library = os.path.join(self.folder.name, 'library')
+        os.makedirs(library)
+        for name in ('one.img', 'two.img'):
+            with open(os.path.join(library, name), 'wb') as output:
+                output.write(image)
+        with WavesampleStore(self.root) as store:
+            batch.extract_library(library, os.path.join(self.folder.name, 'out'), workers=2, store=store)
+            self.assertEqual(len(store), 1)
+            self.assertEqual(len(store.where(wavesample)), 12)
+
+    def test_preprocessors_store_wavesamples(self):
+        cwd = os.getcwd()
+        os.chdir(self.folder.name)
+        try:
+            os.makedirs('intermediate_wav')
+            os.makedirs('voices')
+            voice = os.urandom(16384)
+            for name in ('a.raw', 'b.raw', 'c.raw'):
+                with open(os.path.join('voices', name), 'wb') as output:
+                    output.write(voice)
+            with WavesampleStore(self.root) as store:
+                outputs = preprocessor.write_packed_directory_to_intermediate_wav('voices', 'voices.wav', store)
+                with open(outputs[0], 'rb') as packed:
+                    halves = [packed.read(layout.WAVESAMPLE_SIZE) for _ in range(layout.WAVESAMPLE_COUNT)]
+                # the three voices share a half; the other five halves are the same silence
+                self.assertEqual(len(store), 2)
+                self.assertEqual(store.where(halves[0]), [(outputs[0], 'lh1')])
+                self.assertEqual(len(store.where(halves[1])), 5)
+                # the 1KB wavetable source packs the same three voices into its first half
+                preprocessor.wavetable16_to_1KB_sample_source('voices', 'again.wav', store)
+                self.assertEqual(store.where(halves[0]), [(outputs[0], 'lh1'), ('again.wav', 'lh1')])
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import contextlib
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+from diskimages import server
+from tests.waves import make_wave
+
+CONFIG = """[LOGS]
+LEVEL = INFO
+LOGFILE = wavsyn.log
+
+[FILES]
+HOME = {home}
+OUTPUT_DISK_IMAGE_FOLDER = mirage_ready
+OUTPUT_HFE_FOLDER = hfe
+INTERMEDIATE_WAV_FOLDER = intermediate_wav
+WAVETABLES = wavetables
+FAIRLIGHT = fairlight
+KAWAIK3 = k3
+MIRAGE_SOUNDS = mirage_sounds
+"""
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = os.path.join(self.folder.name, 'config.ini')
+        with open(self.config, 'w') as config:
+            config.write(CONFIG.format(home=self.folder.name))
+        self.socket = os.path.join(self.folder.name, 'server.sock')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def run_requests(self, requests):
+        async def session():
+            job_server = server.JobServer(workers=2, config_file=self.config)
+            await job_server.start(self.socket)
+            try:
+                return await server.submit(requests, self.socket)
+            finally:
+                await job_server.close()
+        return asyncio.run(session())
+
+    def test_workers_use_config(self):
+        responses = self.run_requests([{'id': 1, 'op': 'ping'}])
+        self.assertEqual(responses, [{'id': 1, 'ok': True, 'value': {'jobs': 0, 'failures': 0, 'workers': 2}}])
+        self.assertTrue(os.path.isdir(os.path.join(self.folder.name, 'wavsyn', 'mirage_sounds')))
+
+    def test_concurrent_jobs(self):
+        app_root = os.path.join(self.folder.name, 'wavsyn')
+        os.makedirs(app_root)
+        requests = []
+        for index in range(6):
+            with open(os.path.join(app_root, f'in{index}.wav'), 'wb') as wave:
+                wave.write(make_wave(struct.pack('<4h', -32768, 0, 256, 32767)))
+            requests.append({'id': index, 'op': 'convert', 'source': f'in{index}.wav',
+                             'destination': f'wavetables/out{index}.wav'})
+        requests.append({'id': 'missing', 'op': 'convert', 'source': 'nothing.wav', 'destination': 'nowhere.wav'})
+        requests.append({'id': 'bad', 'op': 'format'})
+        responses = {response['id']: response for response in self.run_requests(requests)}
+        self.assertEqual(len(responses), 8)
+        for index in range(6):
+            self.assertTrue(responses[index]['ok'])
+            self.assertEqual(responses[index]['value'], 4)
+            with open(os.path.join(app_root, 'wavetables', f'out{index}.wav'), 'rb') as output:
+                self.assertEqual(output.read(), bytes([0, 128, 129, 255]))
+        self.assertFalse(responses['missing']['ok'])
+        self.assertIn('FileNotFoundError', responses['missing']['error'])
+        self.assertEqual(responses['bad'], {'id': 'bad', 'ok': False, 'error': 'unknown op format'})
+
+    def test_paths_outside_app_root_are_refused(self):
+        outside = os.path.join(self.folder.name, 'outside.wav')
+        with open(outside, 'wb') as wave:
+            wave.write(make_wave(struct.pack('<2h', 0, 256)))
+        responses = {response['id']: response for response in self.run_requests([
+            {'id': 'absolute', 'op': 'convert', 'source': outside, 'destination': 'out.wav'},
+            {'id': 'escape', 'op': 'convert', 'source': '../outside.wav', 'destination': 'out.wav'},
+            {'id': 'write', 'op': 'extract', 'image': 'x.img', 'output': '../../elsewhere'},
+            {'id': 'create', 'op': 'create', 'source': 'a.wav', 'output': '../../evil'},
+            {'id': 'hfe', 'op': 'hfe', 'image': '/etc/passwd'}])}
+        for response in responses.values():
+            self.assertFalse(response['ok'])
+            self.assertIn('PermissionError', response['error'])
+        self.assertFalse(os.path.exists(os.path.join(self.folder.name, 'wavsyn', 'out.wav')))
+
+    def test_remote_host_needs_flag(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            server.main(['--host', '0.0.0.0'])
+        self.assertTrue(server._is_loopback('::1'))
+        self.assertTrue(server._is_loopback('localhost'))
+
+    def test_bad_json(self):
+        responses = self.run_requests(['not a request', {'id': 2, 'op': 'ping'}])
+        self.assertFalse(responses[0]['ok'])
+        self.assertEqual(responses[1]['id'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
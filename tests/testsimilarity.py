@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from diskimages import similarity
+
+
+def make_wave(kind, cycles, length=1024, amplitude=100):
+    phase = (np.arange(length) * cycles / length) % 1
+    if kind == 'sine':
+        values = np.sin(2 * np.pi * phase)
+    elif kind == 'saw':
+        values = 2 * phase - 1
+    else:
+        values = np.where(phase < 0.5, 1.0, -1.0)
+    return bytes(np.clip(values * amplitude + 128, 0, 255).astype(np.uint8))
+
+
+class SimilarityTestCase(unittest.TestCase):
+
+    def test_features(self):
+        vectors = similarity.features([make_wave('sine', 4), make_wave('saw', 4, 65536), b''])
+        self.assertEqual(vectors.shape, (3, similarity.FEATURES))
+        np.testing.assert_allclose(np.linalg.norm(vectors[:2], axis=1), 1, rtol=1e-5)
+        # same waveform at another length looks the same
+        longer = similarity.features([make_wave('sine', 64, 16384)])[0]
+        self.assertGreater(float(vectors[0] @ longer), 0.95)
+
+    def test_nearest_neighbors(self):
+        index = similarity.SimilarityIndex()
+        names = [f'{kind}{cycles}' for kind in ('sine', 'saw') for cycles in (4, 5, 6)]
+        index.add(names, [make_wave(name[:-1], int(name[-1])) for name in names])
+        self.assertEqual(len(index), 6)
+        for name in names:
+            neighbors = index.neighbors(name, 2)
+            self.assertNotIn(name, [match for match, _ in neighbors])
+            self.assertTrue(neighbors[0][0].startswith(name[:-1]))
+        self.assertEqual(index.query(make_wave('saw', 5), 1)[0][0], 'saw5')
+
+    def test_incremental_update(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for cycles in range(1, 5):
+                with open(os.path.join(folder, f'sine{cycles}.wav'), 'wb') as output:
+                    output.write(make_wave('sine', cycles))
+            index = similarity.SimilarityIndex()
+            self.assertEqual(index.add_folder(folder), 4)
+            path = os.path.join(folder, 'index.npz')
+            index.save(path)
+            for cycles in range(1, 100):
+                with open(os.path.join(folder, f'saw{cycles}.wav'), 'wb') as output:
+                    output.write(make_wave('saw', cycles))
+            # images, store indexes and manifests are not samples
+            for name in ('disk.img', 'disk.hfe', 'index.jsonl', 'extract_manifest.json'):
+                with open(os.path.join(folder, name), 'wb') as output:
+                    output.write(bytes(1024))
+            loaded = similarity.SimilarityIndex.load(path)
+            self.assertEqual(loaded.add_folder(folder), 99)
+            self.assertEqual(len(loaded), 103)
+            self.assertIn(os.path.join(folder, 'saw50.wav'), loaded)
+            self.assertNotIn(os.path.join(folder, 'disk.img'), loaded)
+            np.testing.assert_array_equal(loaded.vectors[:4], index.vectors)
+            self.assertEqual(loaded.add_folder(folder), 0)
+            # a changed file is read again
+            changed = os.path.join(folder, 'sine2.wav')
+            with open(changed, 'wb') as output:
+                output.write(make_wave('square', 2, 2048))
+            loaded.save(path)
+            reloaded = similarity.SimilarityIndex.load(path)
+            self.assertEqual(reloaded.add_folder(folder), 1)
+            self.assertEqual(len(reloaded), 103)
+            self.assertEqual(reloaded.query(make_wave('square', 2, 2048), 1)[0][0], changed)
+
+    def test_large_query(self):
+        vectors = np.random.default_rng(1).random((100000, similarity.FEATURES), dtype=np.float32)
+        index = similarity.SimilarityIndex([str(row) for row in range(100000)], vectors)
+        matches = index.query(vector=vectors[7], k=5)
+        self.assertEqual([name for name, _ in matches], [str(row) for row in np.argsort(-(vectors @ vectors[7]))[:5]])
+
+if __name__ == '__main__':
+    unittest.main()
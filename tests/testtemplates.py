@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from diskimages import layout
+from diskimages.templates import TemplateCache
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = TemplateCache(maxsize=2)
+
+    def tearDown(self):
+        self.cache.clear()
+        self.folder.cleanup()
+
+    def write_template(self, name, fill):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'wb') as output:
+            output.write(bytes([fill]) * layout.IMAGE_SIZE)
+        return path
+
+    def test_clone_is_copy_on_write(self):
+        path = self.write_template('a.img', 7)
+        wavesamples = os.urandom(6 * 65536)
+        with self.cache.clone(path) as image:
+            image.write_wavesamples(wavesamples)
+            self.assertEqual(image.read_wavesamples(), bytearray(wavesamples))
+            self.assertEqual(bytes(image.parameter_block(0)), bytes([7]) * 1024)
+        # template file and later clones are unchanged
+        with self.cache.clone(path) as image:
+            self.assertEqual(bytes(image.data), bytes([7]) * layout.IMAGE_SIZE)
+        self.assertEqual(self.cache.read(path), bytes([7]) * layout.IMAGE_SIZE)
+
+    def test_changed_template_is_reloaded(self):
+        path = self.write_template('a.img', 1)
+        self.assertEqual(self.cache.read(path)[0], 1)
+        self.write_template('a.img', 2)
+        os.utime(path, ns=(0, 10 ** 9))
+        self.assertEqual(self.cache.read(path)[0], 2)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_lru_eviction(self):
+        paths = [self.write_template(f'{x}.img', x) for x in range(3)]
+        for path in paths:
+            self.cache.read(path)
+        self.assertEqual(len(self.cache), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
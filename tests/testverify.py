@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from diskimages import layout
+from diskimages import utility
+from diskimages import verify
+
+
+class VerifyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.template = os.urandom(layout.IMAGE_SIZE)
+
+    def test_reports_changed_sectors(self):
+        image = bytearray(self.template)
+        image[3 * 5632 + 5 * 1024] ^= 1
+        image[79 * 5632] ^= 1
+        for algorithm in verify.ALGORITHMS:
+            reference = verify.sector_checksums(self.template, algorithm)
+            self.assertEqual(len(reference), 480)
+            self.assertEqual(verify.compare(verify.sector_checksums(image, algorithm), reference),
+                             [(3, 5), (79, 0)])
+
+    def test_skip_wavesample_sectors(self):
+        image = bytearray(self.template)
+        layout.pack(image, os.urandom(6 * 65536))
+        checksums = verify.sector_checksums(image)
+        reference = verify.sector_checksums(self.template)
+        self.assertEqual(len(verify.compare(checksums, reference)), 384)
+        self.assertEqual(verify.compare(checksums, reference, layout.WAVESAMPLE_SECTORS), [])
+
+    def test_verify_directory(self):
+        with tempfile.TemporaryDirectory() as folder:
+            changed = bytearray(self.template)
+            changed[0] ^= 0xff
+            for name, data in (('good.img', self.template), ('bad.img', changed), ('short.img', b'x')):
+                with open(os.path.join(folder, name), 'wb') as output:
+                    output.write(data)
+            reference_path = os.path.join(folder, 'reference.json')
+            verify.save_reference(reference_path, verify.sector_checksums(self.template), 'crc32')
+            reference, algorithm = verify.load_reference(reference_path)
+            results = verify.verify_directory(folder, reference, algorithm, workers=2)
+        by_name = {os.path.basename(result.job[0]): result for result in results}
+        self.assertEqual(by_name['good.img'].value, [])
+        self.assertEqual(by_name['bad.img'].value, [(0, 0)])
+        self.assertIsNotNone(by_name['short.img'].error)
+
+    def test_verify_image_checks_all_halves(self):
+        image = bytearray(layout.IMAGE_SIZE)
+        layout.pack(image, os.urandom(65536) * 6)
+        self.assertEqual(len(set(utility.verify_image(image))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+# WAV files built in memory for the tests and benchmarks.
+import struct
+
+from diskimages import riff
+
+
+# A WAV file holding pcm, with a fmt chunk for the given sample width,
+# channels and rate. extra_chunks are (id, body) pairs put before the data
+# chunk; extensible writes a WAVE_FORMAT_EXTENSIBLE fmt chunk wrapping
+# format_tag.
+
+
+def make_wave(pcm, bits=16, channels=1, rate=44100, format_tag=riff.WAVE_FORMAT_PCM, extra_chunks=(),
+              extensible=False):
+    block_align = channels * bits // 8
+    if extensible:
+        fmt = struct.pack('<HHIIHHHHI', riff.WAVE_FORMAT_EXTENSIBLE, channels, rate, rate * block_align,
+                          block_align, bits, 22, bits, 0) + struct.pack('<H', format_tag) + bytes(14)
+    else:
+        fmt = struct.pack('<HHIIHH', format_tag, channels, rate, rate * block_align, block_align, bits)
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+    for chunk_id, body in extra_chunks:
+        chunks += chunk_id + struct.pack('<I', len(body)) + body + bytes(len(body) & 1)
+    chunks += b'data' + struct.pack('<I', len(pcm)) + pcm
+    return b'RIFF' + struct.pack('<I', len(chunks) + 4) + b'WAVE' + chunks